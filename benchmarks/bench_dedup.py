@@ -0,0 +1,82 @@
+"""Prompt size and transformation time of a long agent session, with and without the
+deduplication of repeated tool results.
+
+The agent reads `--files` distinct files of `--file-kib` KiB each, in a fixed order that
+comes back to the same files, for `--turns` rounds, as coding agents re-read the files
+they edit.
+
+    python benchmarks/bench_dedup.py --turns 100 --files 10 --file-kib 20
+"""
+
+import argparse
+import json
+import random
+import time
+
+from tooluser import HermesTransformation, PromptOverhead
+
+
+def _session(turns: int, files: int, file_kib: int) -> list[dict]:
+    rng = random.Random(0)
+    contents = [
+        "".join(
+            f"def function_{f}_{i}(x):\n    return x * {i}\n\n"
+            for i in range(file_kib * 1024 // 40)
+        )
+        for f in range(files)
+    ]
+    messages: list[dict] = [{"role": "user", "content": "Fix the failing tests."}]
+    for turn in range(turns):
+        f = rng.randrange(files)
+        call_id = f"call_{turn:024d}"
+        messages.append(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "type": "function",
+                        "function": {
+                            "name": "read_file",
+                            "arguments": json.dumps({"path": f"src/module_{f}.py"}),
+                        },
+                    }
+                ],
+            }
+        )
+        messages.append(
+            {"role": "tool", "tool_call_id": call_id, "content": contents[f]}
+        )
+    return messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--file-kib", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = _session(args.turns, args.files, args.file_kib)
+    print(f"{'dedup':<8} {'prompt KiB':>11} {'saved KiB':>10} {'ms/request':>11}")
+    for label, transformation in (
+        ("off", HermesTransformation()),
+        ("on", HermesTransformation(dedup_tool_results=256)),
+    ):
+        best = float("inf")
+        overhead = PromptOverhead(tokenizer=len)
+        for _ in range(args.repeat):
+            overhead = PromptOverhead(tokenizer=len)
+            start = time.perf_counter()
+            transformation.trans_param_messages(messages, [], overhead=overhead)  # type: ignore
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"{label:<8} {overhead.transformed_chars / 1024:>11.0f} "
+            f"{overhead.dedup_saved_bytes / 1024:>10.0f} {best * 1000:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Stream processing cost of a ToolCallDetector as formats are added.
+
+Streams a long reply (prose with `<`, backticks and JSON, then one call per format) in
+small chunks through each processor, and reports the time per chunk.
+
+    python benchmarks/bench_formats.py --paragraphs 200 --chunk-size 4
+"""
+
+import argparse
+import time
+
+from tooluser.formats import (
+    FENCED_JSON_FORMAT,
+    FUNCTION_TAG_FORMAT,
+    HERMES_FORMAT,
+    ToolCallDetector,
+)
+from tooluser.hermes_transform import HermesTransformation
+
+CALLS = (
+    '<tool_call>\n{"name": "get_weather", "arguments": {"location": "Paris"}}\n</tool_call>\n'
+    '```json\n{"name": "get_time", "arguments": {"tz": "CET"}}\n```\n'
+    '<function=read_file>{"path": "a.py"}</function>'
+)
+
+
+def _reply(paragraphs: int) -> str:
+    paragraph = (
+        'When x < y, the loop in `main()` returns {"ok": true} before the <b>last</b> '
+        "step; see ```the notes``` for details.\n"
+    )
+    return paragraph * paragraphs + CALLS
+
+
+def _run(transformation: HermesTransformation, text: str, chunk_size: int) -> int:
+    processor = transformation.create_stream_processor()
+    calls = 0
+    for i in range(0, len(text), chunk_size):
+        calls += sum(
+            not isinstance(o, str) for o in processor.process(text[i : i + chunk_size])
+        )
+    calls += sum(not isinstance(o, str) for o in processor.finalize())
+    return calls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paragraphs", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = _reply(args.paragraphs)
+    chunks = -(-len(text) // args.chunk_size)
+    setups = {
+        "HermesStreamProcessor": HermesTransformation(),
+        "detector: hermes": HermesTransformation(
+            detector=ToolCallDetector([HERMES_FORMAT])
+        ),
+        "detector: 3 formats": HermesTransformation(
+            detector=ToolCallDetector(
+                [HERMES_FORMAT, FENCED_JSON_FORMAT, FUNCTION_TAG_FORMAT]
+            )
+        ),
+    }
+    print(f"{len(text)} characters, {chunks} chunks")
+    print(f"{'processor':<24} {'µs/chunk':>9} {'tool calls':>11}")
+    for label, transformation in setups.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            calls = _run(transformation, text, args.chunk_size)
+            best = min(best, time.perf_counter() - start)
+        print(f"{label:<24} {best / chunks * 1e6:>9.2f} {calls:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Tail latency with and without hedged requests against a fake upstream.
+
+Every `--slow-every`th request the upstream receives takes `--slow` seconds instead of
+`--fast`; a hedged duplicate lands on another request number and so is usually fast.
+
+    python benchmarks/bench_hedging.py --requests 200 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+
+from openai import AsyncOpenAI
+
+from tooluser import Hedging, ToolUser
+from tooluser.testing import FakeUpstream
+
+TOOLS = [{"type": "function", "function": {"name": "get_time"}}]
+REPLY = (
+    "Let me check.\n"
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>'
+)
+
+
+async def _load(
+    tool_user: ToolUser, total: int, concurrency: int, stream: bool
+) -> list[float]:
+    latencies: list[float] = []
+    remaining = iter(range(total))
+
+    async def one():
+        start = time.perf_counter()
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "What's the time?"}],
+            tools=TOOLS,  # type: ignore
+            stream=stream,
+        )
+        if stream:
+            async with res:  # type: ignore
+                async for _ in res:  # type: ignore
+                    pass
+        latencies.append(time.perf_counter() - start)
+
+    async def worker():
+        for _ in remaining:
+            await one()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def main(args: argparse.Namespace) -> None:
+    counter = itertools.count(1)
+
+    def latency(body):
+        return args.slow if next(counter) % args.slow_every == 0 else args.fast
+
+    print(
+        f"{'mode':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+        f"{'upstream calls':>15} {'hedge wins':>11}"
+    )
+    async with FakeUpstream(REPLY, latency=latency) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="bench")
+        for stream in (False, True):
+            for hedging in (
+                None,
+                Hedging(args.delay, max_ratio=args.max_ratio),
+                Hedging(percentile=args.percentile, max_ratio=args.max_ratio),
+            ):
+                upstream.requests.clear()
+                tool_user = ToolUser(client, hedging=hedging)
+                latencies = await _load(
+                    tool_user, args.requests, args.concurrency, stream
+                )
+                if hedging is None:
+                    mode = "plain"
+                elif hedging.delay is None:
+                    mode = f"hedged (p{hedging.percentile:.0f})"
+                else:
+                    mode = f"hedged ({hedging.delay * 1000:.0f} ms)"
+                mode += " stream" if stream else ""
+                print(
+                    f"{mode:<22} {statistics.median(latencies) * 1000:>8.1f} "
+                    f"{_percentile(latencies, 95) * 1000:>8.1f} "
+                    f"{_percentile(latencies, 99) * 1000:>8.1f} "
+                    f"{max(latencies) * 1000:>8.1f} {len(upstream.requests):>15} "
+                    f"{hedging.hedge_wins if hedging else 0:>11}"
+                )
+        # Let the upstream finish the requests that lost their race
+        await asyncio.sleep(args.slow)
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--fast", type=float, default=0.02)
+    parser.add_argument("--slow", type=float, default=0.5)
+    parser.add_argument("--slow-every", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.1)
+    parser.add_argument("--percentile", type=float, default=80)
+    parser.add_argument("--max-ratio", type=float, default=0.3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""Measure the cold-start import time of tooluser, with a regression budget.
+
+Each statement runs in a fresh interpreter, so nothing is cached between runs but the
+OS file cache. Exits with status 1 when the median of `import tooluser` exceeds the
+budget.
+
+python benchmarks/bench_import.py [--budget-ms 50]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = {
+    "python (baseline)": "pass",
+    "import tooluser": "import tooluser",
+    "import tooluser.cli": "import tooluser.cli",
+    "from tooluser import ToolUser": "from tooluser import ToolUser",
+    "import openai": "import openai",
+}
+
+
+def import_ms(statement: str) -> float:
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"{statement}; print((time.perf_counter() - start) * 1000)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=50.0,
+        help="Largest accepted median of `import tooluser` (default: 50)",
+    )
+    args = parser.parse_args()
+
+    print("| statement | median ms | min ms |")
+    print("|-----------|-----------|--------|")
+    medians = {}
+    for label, statement in STATEMENTS.items():
+        times = [import_ms(statement) for _ in range(args.runs)]
+        medians[label] = statistics.median(times)
+        print(f"| {label} | {medians[label]:.1f} | {min(times):.1f} |")
+
+    if medians["import tooluser"] > args.budget_ms:
+        print(
+            f"\nimport tooluser took {medians['import tooluser']:.1f} ms, "
+            f"over the budget of {args.budget_ms:.0f} ms"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
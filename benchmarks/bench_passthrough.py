@@ -0,0 +1,73 @@
+"""Cost of ToolUser on requests without tools, next to the bare client.
+
+Streams a reply of `--chunks` small chunks from a fake upstream, and reports the time
+to the first chunk and the time per chunk of the whole stream. A request with tools is
+shown for reference.
+
+    python benchmarks/bench_passthrough.py --chunks 2000 --repeat 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from openai import AsyncOpenAI
+
+from tooluser import ToolUser
+from tooluser.testing import FakeUpstream
+
+MESSAGES = [{"role": "user", "content": "Tell me a story."}]
+TOOLS = [{"type": "function", "function": {"name": "get_time"}}]
+
+
+async def _stream(completions, tools: list | None) -> tuple[float, float, str]:
+    extra = {"tools": tools} if tools else {}
+    start = time.perf_counter()
+    stream = await completions.create(
+        model="fake", messages=MESSAGES, stream=True, **extra
+    )
+    first = None
+    async with stream:
+        async for _ in stream:
+            if first is None:
+                first = time.perf_counter() - start
+    return first or 0.0, time.perf_counter() - start, type(stream).__name__
+
+
+async def main(args: argparse.Namespace) -> None:
+    reply = "word " * (args.chunks * args.chunk_size // 5)
+    async with FakeUpstream(reply, chunk_size=args.chunk_size) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="bench")
+        tool_user = ToolUser(client)
+        setups = {
+            "client": (client.chat.completions, None),
+            "ToolUser, no tools": (tool_user.chat.completions, None),
+            "ToolUser, tools": (tool_user.chat.completions, TOOLS),
+        }
+        print(
+            f"{'request':<20} {'first chunk ms':>15} {'µs/chunk':>9} {'returned':>16}"
+        )
+        for label, (completions, tools) in setups.items():
+            # Warm up the connection pool
+            await _stream(completions, tools)
+            firsts, totals = [], []
+            returned = ""
+            for _ in range(args.repeat):
+                first, total, returned = await _stream(completions, tools)
+                firsts.append(first)
+                totals.append(total)
+            print(
+                f"{label:<20} {statistics.median(firsts) * 1000:>15.2f} "
+                f"{statistics.median(totals) / args.chunks * 1e6:>9.2f} "
+                f"{returned:>16}"
+            )
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""Raw JSON detection on JSON-heavy replies, with and without the request's tool names.
+
+Each reply is prose with many JSON examples shaped like tool calls, as in documentation
+or code reviews, and ends either with a call of a known tool or with one more example.
+Without the catalog, every `{"name": ..., "arguments": ...` candidate is checked, and an
+example at the end is taken for a call.
+
+    python benchmarks/bench_raw_json.py --examples 200 --repeat 20
+"""
+
+import argparse
+import json
+import time
+
+from openai.types.chat import ChatCompletionMessage
+
+from tooluser.catalog import ToolCatalog
+from tooluser.hermes_transform import HermesTransformation
+
+TOOLS = [
+    {"type": "function", "function": {"name": name}}
+    for name in ("get_weather", "read_file", "search_files", "run_command")
+]
+CALL = '{"name": "get_weather", "arguments": {"location": "Paris"}}'
+
+
+def _reply(examples: int, ending: str) -> str:
+    parts = []
+    for i in range(examples):
+        example = {
+            "name": f"step_{i}",
+            "arguments": {"retries": i, "hosts": ["a", "b"]},
+        }
+        parts.append(
+            f"Step {i} is configured as {json.dumps(example)}, and its result "
+            f"looks like {json.dumps({'id': i, 'ok': True})}.\n"
+        )
+    return "".join(parts) + ending
+
+
+def _measure(
+    transformation: HermesTransformation,
+    content: str,
+    catalog: ToolCatalog | None,
+    repeat: int,
+) -> tuple[float, list[str]]:
+    best = float("inf")
+    names: list[str] = []
+    for _ in range(repeat):
+        message = ChatCompletionMessage(role="assistant", content=content)
+        start = time.perf_counter()
+        message = transformation.trans_completion_message(message, catalog)
+        best = min(best, time.perf_counter() - start)
+        names = [call.function.name for call in message.tool_calls or []]
+    return best, names
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--examples", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    transformation = HermesTransformation(enable_raw_json_detection=True)
+    catalog = ToolCatalog(TOOLS)
+    endings = {
+        "known call": CALL,
+        "example": json.dumps({"name": "step_x", "arguments": {"retries": 0}}),
+    }
+    print(f"{'ending':<12} {'names':<10} {'KiB':>6} {'ms/reply':>9} {'tool calls'}")
+    for ending, text in endings.items():
+        content = _reply(args.examples, "Finally: " + text)
+        for label, used in (("any", None), ("catalog", catalog)):
+            elapsed, names = _measure(transformation, content, used, args.repeat)
+            print(
+                f"{ending:<12} {label:<10} {len(content) / 1024:>6.1f} "
+                f"{elapsed * 1000:>9.3f} {names}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Load test `tooluser serve` against a local fake upstream.
+
+Measures throughput through the proxy and the latency it adds compared with
+calling the fake upstream directly, for JSON and SSE responses.
+
+    python benchmarks/bench_server.py --workers 2 --concurrency 32 --requests 2000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import statistics
+import time
+
+from openai import AsyncOpenAI
+
+from tooluser.server import serve
+from tooluser.testing import FakeUpstream
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_time",
+            "description": "Get the time in a given location",
+            "parameters": {
+                "type": "object",
+                "properties": {"location": {"type": "string"}},
+            },
+        },
+    }
+]
+REPLY = (
+    "I need to check the current time in Shanghai. Let me use the get_time tool.\n"
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Shanghai"}}\n</tool_call>'
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _run_upstream(port: int) -> None:
+    async def main():
+        upstream = await FakeUpstream(REPLY, chunk_size=4).start(port=port)
+        assert upstream._server is not None
+        await upstream._server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def _wait_ready(port: int) -> None:
+    for _ in range(200):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+async def _load(
+    base_url: str, total: int, concurrency: int, stream: bool
+) -> tuple[list[float], float]:
+    client = AsyncOpenAI(base_url=base_url, api_key="bench", max_retries=0)
+    latencies: list[float] = []
+    remaining = iter(range(total))
+
+    async def one():
+        start = time.perf_counter()
+        if stream:
+            res = await client.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "What's the time?"}],
+                tools=TOOLS,  # type: ignore
+                stream=True,
+            )
+            async for _ in res:
+                pass
+        else:
+            await client.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "What's the time?"}],
+                tools=TOOLS,  # type: ignore
+            )
+        latencies.append(time.perf_counter() - start)
+
+    async def worker():
+        for _ in remaining:
+            await one()
+
+    # Warm up the connection pool
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    latencies.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return latencies, elapsed
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def run(args: argparse.Namespace) -> None:
+    upstream_port, proxy_port = _free_port(), _free_port()
+    upstream = multiprocessing.Process(
+        target=_run_upstream, args=(upstream_port,), daemon=True
+    )
+    proxy = multiprocessing.Process(
+        target=serve,
+        kwargs={
+            "upstream": f"http://127.0.0.1:{upstream_port}/v1",
+            "port": proxy_port,
+            "workers": args.workers,
+            "api_key": "bench",
+        },
+    )
+    upstream.start()
+    proxy.start()
+    try:
+        await _wait_ready(upstream_port)
+        await _wait_ready(proxy_port)
+        print(
+            f"workers={args.workers} concurrency={args.concurrency} requests={args.requests}\n"
+        )
+        print("| mode | req/s via proxy | p50 added (ms) | p99 added (ms) |")
+        print("|------|-----------------|----------------|----------------|")
+        for stream in (False, True):
+            direct, _ = await _load(
+                f"http://127.0.0.1:{upstream_port}/v1",
+                args.requests,
+                args.concurrency,
+                stream,
+            )
+            proxied, elapsed = await _load(
+                f"http://127.0.0.1:{proxy_port}/v1",
+                args.requests,
+                args.concurrency,
+                stream,
+            )
+            print(
+                f"| {'sse' if stream else 'json'} "
+                f"| {len(proxied) / elapsed:.0f} "
+                f"| {(_percentile(proxied, 50) - _percentile(direct, 50)) * 1000:.2f} "
+                f"| {(_percentile(proxied, 99) - _percentile(direct, 99)) * 1000:.2f} |"
+            )
+    finally:
+        proxy.terminate()
+        proxy.join()
+        upstream.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,95 @@
+"""Compare the per-chunk cost of `stream_events()` with the chunk-based stream.
+
+Streams a long reply (text and tool calls) from a local fake upstream, in
+4-character chunks, through three paths: the native client (no transformation,
+for reference), the wrapped `create(stream=True)`, and
+`stream_events()`. Reports the time per upstream chunk.
+
+    python benchmarks/bench_stream_events.py --streams 20
+"""
+
+import argparse
+import asyncio
+import time
+
+from openai import AsyncOpenAI
+
+from tooluser import ToolUser
+from tooluser.testing import FakeUpstream
+
+TOOLS = [{"type": "function", "function": {"name": "read_file"}}]
+MESSAGES = [{"role": "user", "content": "Read the sources."}]
+CHUNK_SIZE = 4
+REPLY = (
+    "I will read the files one by one and summarize what each of them does. " * 20
+    + "".join(
+        f'<tool_call>\n{{"name": "read_file", "arguments": {{"path": "src/module_{i}.py"}}}}\n</tool_call>\n'
+        for i in range(10)
+    )
+)
+
+
+async def _native(client: AsyncOpenAI) -> None:
+    stream = await client.chat.completions.create(
+        model="fake",
+        messages=MESSAGES,  # type: ignore
+        stream=True,
+    )
+    async for _ in stream:
+        pass
+
+
+async def _chunks(tool_user: ToolUser) -> None:
+    stream = await tool_user.chat.completions.create(
+        model="fake",
+        messages=MESSAGES,  # type: ignore
+        tools=TOOLS,  # type: ignore
+        stream=True,
+    )
+    async for _ in stream:  # type: ignore
+        pass
+
+
+async def _events(tool_user: ToolUser) -> None:
+    async for _ in tool_user.chat.completions.stream_events(
+        model="fake",
+        messages=MESSAGES,
+        tools=TOOLS,
+    ):
+        pass
+
+
+async def run(args: argparse.Namespace) -> None:
+    chunks = -(-len(REPLY) // CHUNK_SIZE) + 1
+    async with FakeUpstream(REPLY, chunk_size=CHUNK_SIZE) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="bench")
+        tool_user = ToolUser(client)
+        paths = {
+            "native client": lambda: _native(client),
+            "create(stream=True)": lambda: _chunks(tool_user),
+            "stream_events()": lambda: _events(tool_user),
+        }
+        print(f"{chunks} chunks per stream, {args.streams} streams\n")
+        print("| path | µs/chunk | vs native |")
+        print("|------|----------|-----------|")
+        baseline = None
+        for name, path in paths.items():
+            await path()  # warm up
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for _ in range(args.streams):
+                    await path()
+                best = min(best, time.perf_counter() - start)
+            per_chunk = best / (args.streams * chunks) * 1e6
+            if baseline is None:
+                baseline = per_chunk
+            print(f"| {name} | {per_chunk:.1f} | {per_chunk - baseline:+.1f} |")
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
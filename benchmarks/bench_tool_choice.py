@@ -0,0 +1,122 @@
+"""Prompt size and latency of a forced tool call, with and without assistant prefill.
+
+A fake upstream streams one chunk per `--chunk-delay`, as a model generating tokens. Left
+to itself, the model writes a preamble before the call; when the reply is prefilled with
+the start of the call, it only writes the arguments.
+
+    python benchmarks/bench_tool_choice.py --tools 30 --requests 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from openai import AsyncOpenAI
+
+from tooluser import HermesTransformation, PromptOverhead, ToolUser
+from tooluser.testing import FakeUpstream
+
+PREAMBLE = (
+    "To answer this I need the current weather in Paris, so I will look it up with "
+    "the weather tool and then summarize the forecast for you.\n"
+)
+CALL = (
+    '<tool_call>\n{"name": "get_weather", "arguments": {"location": "Paris", '
+    '"unit": "celsius"}}\n</tool_call>'
+)
+
+
+def _tools(count: int) -> list[dict]:
+    tools = [
+        {
+            "type": "function",
+            "function": {
+                "name": f"tool_{i}",
+                "description": f"Does task number {i} of the workflow.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"target": {"type": "string"}},
+                    "required": ["target"],
+                },
+            },
+        }
+        for i in range(count - 1)
+    ]
+    tools.append(
+        {
+            "type": "function",
+            "function": {
+                "name": "get_weather",
+                "description": "Get the current weather of a city.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "location": {"type": "string"},
+                        "unit": {"type": "string", "enum": ["celsius", "fahrenheit"]},
+                    },
+                    "required": ["location"],
+                },
+            },
+        }
+    )
+    return tools
+
+
+def _reply(body: dict) -> str:
+    last = body["messages"][-1]
+    if last["role"] == "assistant" and last.get("prefix"):
+        return CALL.removeprefix(last["content"])
+    return PREAMBLE + CALL
+
+
+async def main(args: argparse.Namespace) -> None:
+    tools = _tools(args.tools)
+    choice = {"type": "function", "function": {"name": "get_weather"}}
+    setups = {
+        "auto": (HermesTransformation(), "auto"),
+        "named": (HermesTransformation(), choice),
+        "named + prefill": (HermesTransformation(prefill="prefix"), choice),
+    }
+    print(
+        f"{'tool_choice':<16} {'prompt tokens':>14} {'reply chars':>12} "
+        f"{'median ms':>10} {'tool calls':>11}"
+    )
+    async with FakeUpstream(
+        _reply, chunk_size=args.chunk_size, chunk_delay=args.chunk_delay
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="bench")
+        for label, (transformation, tool_choice) in setups.items():
+            reports: list[PromptOverhead] = []
+            tool_user = ToolUser(client, transformation, on_overhead=reports.append)
+            latencies = []
+            calls = 0
+            upstream.requests.clear()
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                res = await tool_user.chat.completions.create(
+                    model="fake",
+                    messages=[{"role": "user", "content": "Weather in Paris?"}],
+                    tools=tools,  # type: ignore
+                    tool_choice=tool_choice,  # type: ignore
+                    stream=True,
+                )
+                async for chunk in res:  # type: ignore
+                    calls += len(chunk.choices[0].delta.tool_calls or [])
+                latencies.append(time.perf_counter() - start)
+            reply_chars = len(_reply(upstream.requests[-1]))
+            print(
+                f"{label:<16} {reports[-1].transformed_tokens:>14} {reply_chars:>12} "
+                f"{statistics.median(latencies) * 1000:>10.1f} "
+                f"{calls / args.requests:>11.0f}"
+            )
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tools", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--chunk-delay", type=float, default=0.005)
+    asyncio.run(main(parser.parse_args()))
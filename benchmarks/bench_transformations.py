@@ -0,0 +1,129 @@
+"""Compare the built-in transformations: prompt size and end-to-end parse throughput.
+
+Prompt size is measured on a multi-turn agent conversation with a realistic tool
+catalog. Parse throughput runs a reply with two tool calls through each format's
+stream processor in small chunks, as the streaming wrapper would.
+
+    python benchmarks/bench_transformations.py
+"""
+
+import json
+import re
+import timeit
+
+from tooluser import CompactTransformation, HermesTransformation
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "Path of the file"},
+                    "pattern": {"type": "string", "description": "Glob pattern"},
+                },
+                "required": ["path"],
+            },
+        },
+    }
+    for name, description in [
+        ("read_file", "Read a file from the workspace"),
+        ("write_file", "Write content to a file in the workspace"),
+        ("list_files", "List the files matching a pattern"),
+        ("search", "Search the workspace for a regular expression"),
+        ("run_command", "Run a shell command and return its output"),
+    ]
+]
+
+
+def _conversation(turns: int) -> list[dict]:
+    messages: list[dict] = [{"role": "user", "content": "Fix the failing test."}]
+    for i in range(turns):
+        call_id = f"call_{i:024d}"
+        messages.append(
+            {
+                "role": "assistant",
+                "content": "Let me look at the next file.",
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "type": "function",
+                        "function": {
+                            "name": "read_file",
+                            "arguments": json.dumps({"path": f"src/module_{i}.py"}),
+                        },
+                    }
+                ],
+            }
+        )
+        messages.append(
+            {
+                "role": "tool",
+                "tool_call_id": call_id,
+                "content": "def f():\n    return 1\n" * 5,
+            }
+        )
+    return messages
+
+
+def _reply(start: str, end: str, compact: bool) -> str:
+    calls = [
+        ("read_file", {"path": "src/a.py"}),
+        ("search", {"path": "src", "pattern": "TODO"}),
+    ]
+    if compact:
+        blocks = [
+            f"{start}{n}\n{json.dumps(a, separators=(',', ':'))}{end}" for n, a in calls
+        ]
+    else:
+        blocks = [
+            f"{start}\n{json.dumps({'name': n, 'arguments': a})}\n{end}"
+            for n, a in calls
+        ]
+    return "I will read the file and search for TODOs first.\n" + "\n".join(blocks)
+
+
+def _rough_tokens(text: str) -> int:
+    # Word pieces and punctuation, a tokenizer-free proxy for comparing formats
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def _parse(transformation, reply: str, chunk_size: int = 4) -> None:
+    processor = transformation.create_stream_processor()
+    for i in range(0, len(reply), chunk_size):
+        processor.process(reply[i : i + chunk_size])
+    processor.finalize()
+
+
+def main() -> None:
+    formats = {
+        "hermes": (
+            HermesTransformation(),
+            _reply("<tool_call>", "</tool_call>", False),
+        ),
+        "compact": (CompactTransformation(), _reply("<tc>", "</tc>", True)),
+    }
+    print("| format | turns | prompt chars | ~tokens | parses/s |")
+    print("|--------|-------|--------------|---------|----------|")
+    for name, (transformation, reply) in formats.items():
+        number = 2000
+        seconds = timeit.timeit(lambda: _parse(transformation, reply), number=number)  # noqa: B023
+        for turns in (0, 10):
+            messages = transformation.trans_param_messages(_conversation(turns), TOOLS)
+            prompt = "".join(
+                m["content"]
+                if isinstance(m["content"], str)
+                else json.dumps(m["content"])
+                for m in messages
+            )
+            print(
+                f"| {name} | {turns} | {len(prompt)} | {_rough_tokens(prompt)} "
+                f"| {number / seconds:.0f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
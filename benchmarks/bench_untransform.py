@@ -0,0 +1,89 @@
+"""Throughput of the bulk reverse conversion of logged Hermes transcripts.
+
+Generates a JSONL log of transformed requests (a share of them with tool traffic)
+in memory and runs `untransform_jsonl` over it on one core.
+
+    python benchmarks/bench_untransform.py --mb 200 --tool-share 0.5
+"""
+
+import argparse
+import io
+import json
+import random
+import time
+
+from tooluser.hermes_transform import HermesTransformation, untransform_jsonl
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "read_file",
+            "description": "Read a file from the workspace",
+            "parameters": {
+                "type": "object",
+                "properties": {"path": {"type": "string"}},
+            },
+        },
+    }
+]
+
+
+def _record(i: int, with_tools: bool) -> dict:
+    transformation = HermesTransformation()
+    messages: list[dict] = [{"role": "user", "content": "Summarize the module. " * 20}]
+    if not with_tools:
+        messages.append({"role": "assistant", "content": "It does things. " * 40})
+        return {"id": i, "messages": messages}
+    for turn in range(4):
+        call_id = f"call_{i}_{turn}"
+        messages.append(
+            {
+                "role": "assistant",
+                "content": "Let me read the next file.",
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "type": "function",
+                        "function": {
+                            "name": "read_file",
+                            "arguments": json.dumps({"path": f"src/m{turn}.py"}),
+                        },
+                    }
+                ],
+            }
+        )
+        messages.append(
+            {"role": "tool", "tool_call_id": call_id, "content": "x = 1\n" * 100}
+        )
+    return {"id": i, "messages": transformation.trans_param_messages(messages, TOOLS)}
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    samples = [
+        (json.dumps(_record(i, rng.random() < args.tool_share)) + "\n").encode()
+        for i in range(200)
+    ]
+    lines = []
+    size = 0
+    while size < args.mb * 1024 * 1024:
+        line = samples[len(lines) % len(samples)]
+        lines.append(line)
+        size += len(line)
+    src = io.BytesIO(b"".join(lines))
+
+    start = time.perf_counter()
+    count = untransform_jsonl(src, io.BytesIO())
+    elapsed = time.perf_counter() - start
+    print(
+        f"{count} lines, {size / 1e6:.0f} MB, tool share {args.tool_share:.0%}: "
+        f"{size / 1e6 / elapsed:.1f} MB/s = {size / 1e9 / elapsed * 60:.2f} GB/min"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=200)
+    parser.add_argument("--tool-share", type=float, default=0.5)
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+"""Measure the cost of validating tool call arguments with `ToolCatalog`.
+
+python benchmarks/bench_validation.py
+"""
+
+import json
+import timeit
+
+from tooluser.catalog import ToolCatalog
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_files",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "pattern": {"type": "string", "minLength": 1},
+                    "path": {"type": "string"},
+                    "include": {"type": "array", "items": {"type": "string"}},
+                    "case": {"type": "string", "enum": ["sensitive", "insensitive"]},
+                    "max_results": {"type": "integer", "minimum": 1, "maximum": 500},
+                },
+                "required": ["pattern"],
+                "additionalProperties": False,
+            },
+        },
+    }
+]
+CASES = {
+    "valid": {
+        "pattern": "def main",
+        "path": "src",
+        "include": ["*.py", "*.pyi"],
+        "case": "sensitive",
+        "max_results": 50,
+    },
+    "invalid": {"path": 3, "case": "any", "max_results": 0, "extra": True},
+}
+
+
+def main() -> None:
+    number = 100_000
+    # Compiling on first use is part of the first call only
+    start = timeit.default_timer()
+    catalog = ToolCatalog(TOOLS)  # type: ignore
+    catalog.validator("search_files")
+    compile_us = (timeit.default_timer() - start) * 1e6
+    print(f"compile: {compile_us:.1f} us\n")
+    print("| arguments | us/call | of which json.loads |")
+    print("|-----------|---------|---------------------|")
+    for case, value in CASES.items():
+        arguments = json.dumps(value)
+        seconds = min(
+            timeit.repeat(
+                lambda arguments=arguments: catalog.validate(
+                    "1", "search_files", arguments
+                ),
+                number=number,
+                repeat=5,
+            )
+        )
+        parse = min(
+            timeit.repeat(
+                lambda arguments=arguments: json.loads(arguments),
+                number=number,
+                repeat=5,
+            )
+        )
+        print(f"| {case} | {seconds / number * 1e6:.2f} | {parse / number * 1e6:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
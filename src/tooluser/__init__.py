@@ -1,5 +1,69 @@
-from tooluser.hermes_transform import HermesTransformation
-from tooluser.tool_user import make_tool_user
-from tooluser.transform import Transformation
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["HermesTransformation", "Transformation", "make_tool_user"]
+if TYPE_CHECKING:
+    from tooluser.cache import ResponseCache
+    from tooluser.catalog import InvalidToolCall
+    from tooluser.compact_transform import CompactTransformation
+    from tooluser.formats import CallFormat, ToolCallDetector
+    from tooluser.guided import GuidedDecoding
+    from tooluser.hedging import Hedging
+    from tooluser.hermes_transform import HermesTransformation
+    from tooluser.scheduler import Scheduler
+    from tooluser.single_flight import SingleFlight
+    from tooluser.tool_user import StreamTimeoutError, ToolUser, make_tool_user
+    from tooluser.transform import PromptOverhead, RepairOffload, Transformation
+
+# The public names are imported on first access, so `import tooluser` (and the CLI)
+# does not pay for importing openai and the transformations up front
+_EXPORTS = {
+    "CallFormat": "tooluser.formats",
+    "CompactTransformation": "tooluser.compact_transform",
+    "GuidedDecoding": "tooluser.guided",
+    "Hedging": "tooluser.hedging",
+    "HermesTransformation": "tooluser.hermes_transform",
+    "InvalidToolCall": "tooluser.catalog",
+    "PromptOverhead": "tooluser.transform",
+    "RepairOffload": "tooluser.transform",
+    "ResponseCache": "tooluser.cache",
+    "Scheduler": "tooluser.scheduler",
+    "SingleFlight": "tooluser.single_flight",
+    "StreamTimeoutError": "tooluser.tool_user",
+    "ToolCallDetector": "tooluser.formats",
+    "ToolUser": "tooluser.tool_user",
+    "Transformation": "tooluser.transform",
+    "make_tool_user": "tooluser.tool_user",
+}
+
+__all__ = [
+    "CallFormat",
+    "CompactTransformation",
+    "GuidedDecoding",
+    "Hedging",
+    "HermesTransformation",
+    "InvalidToolCall",
+    "PromptOverhead",
+    "RepairOffload",
+    "ResponseCache",
+    "Scheduler",
+    "SingleFlight",
+    "StreamTimeoutError",
+    "ToolCallDetector",
+    "ToolUser",
+    "Transformation",
+    "make_tool_user",
+]
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *__all__])
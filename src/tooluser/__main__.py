@@ -0,0 +1,3 @@
+from tooluser.cli import main
+
+main()
@@ -0,0 +1,203 @@
+"""Minimal HTTP/1.1 primitives shared by the proxy server and the fake upstream.
+
+Only what an OpenAI-compatible endpoint needs: request parsing with keep-alive,
+fixed-length JSON responses and chunked responses for server-sent events.
+"""
+
+import asyncio
+import json
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Any
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    version: str
+    headers: dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.body)
+        except ValueError as e:
+            raise HttpError(400, "Request body is not valid JSON") from e
+
+
+async def read_request(
+    reader: asyncio.StreamReader, max_body_size: int | None = None
+) -> HttpRequest | None:
+    """Read one request from the connection, or return None when the peer closed it.
+
+    A body longer than `max_body_size` bytes is refused with a 413 error."""
+    try:
+        request_line = await reader.readline()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        return None
+    if not request_line.strip():
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").split()
+    except ValueError as e:
+        raise HttpError(400, "Malformed request line") from e
+
+    headers: dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = await _read_chunked_body(reader, max_body_size)
+    else:
+        length = _parse_size(headers.get("content-length", "0"), 10)
+        _check_body_size(length, max_body_size)
+        body = await reader.readexactly(length)
+    return HttpRequest(
+        method=method.upper(),
+        path=target.split("?", 1)[0],
+        version=version,
+        headers=headers,
+        body=body,
+    )
+
+
+def _parse_size(value: str | bytes, base: int) -> int:
+    """A body or chunk size; HttpError 400 if it is not a non-negative integer."""
+    try:
+        size = int(value, base)
+    except ValueError:
+        size = -1
+    if size < 0:
+        raise HttpError(400, "Invalid body size")
+    return size
+
+
+def _check_body_size(size: int, max_body_size: int | None) -> None:
+    if max_body_size is not None and size > max_body_size:
+        raise HttpError(413, f"Request body is larger than {max_body_size} bytes")
+
+
+async def _read_chunked_body(
+    reader: asyncio.StreamReader, max_body_size: int | None = None
+) -> bytes:
+    parts = []
+    total = 0
+    while True:
+        size = _parse_size((await reader.readline()).split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            # Skip trailers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return b"".join(parts)
+        total += size
+        _check_body_size(total, max_body_size)
+        parts.append(await reader.readexactly(size))
+        await reader.readline()
+
+
+def _head(status: int, headers: dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def write_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    body: bytes,
+    content_type: str = "application/json",
+    keep_alive: bool = True,
+) -> None:
+    writer.write(
+        _head(
+            status,
+            {
+                "Content-Type": content_type,
+                "Content-Length": str(len(body)),
+                "Connection": "keep-alive" if keep_alive else "close",
+            },
+        )
+        + body
+    )
+    await writer.drain()
+
+
+async def write_json(
+    writer: asyncio.StreamWriter, status: int, data: Any, keep_alive: bool = True
+) -> None:
+    await write_response(
+        writer, status, json.dumps(data).encode(), keep_alive=keep_alive
+    )
+
+
+async def write_error(
+    writer: asyncio.StreamWriter, status: int, message: str, keep_alive: bool = True
+) -> None:
+    await write_json(
+        writer,
+        status,
+        {"error": {"message": message, "type": "tooluser_error", "code": status}},
+        keep_alive=keep_alive,
+    )
+
+
+class ChunkedResponse:
+    """A response whose body is sent incrementally with chunked transfer encoding."""
+
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        content_type: str = "text/event-stream",
+        keep_alive: bool = True,
+    ):
+        self.writer = writer
+        self.content_type = content_type
+        self.keep_alive = keep_alive
+        self.started = False
+
+    async def start(self, status: int = 200) -> None:
+        self.writer.write(
+            _head(
+                status,
+                {
+                    "Content-Type": self.content_type,
+                    "Cache-Control": "no-cache",
+                    "Transfer-Encoding": "chunked",
+                    "Connection": "keep-alive" if self.keep_alive else "close",
+                },
+            )
+        )
+        self.started = True
+        await self.writer.drain()
+
+    async def write(self, data: bytes) -> None:
+        if data:
+            self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await self.writer.drain()
+
+    async def end(self) -> None:
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+def sse_event(data: str) -> bytes:
+    return b"data: " + data.encode() + b"\n\n"
@@ -0,0 +1,226 @@
+"""Opt-in cache of upstream responses, to replay identical requests without sending them.
+
+Entries are keyed by a hash of the transformed request (model, transformed messages and
+every sampling parameter), and hold the upstream's response before the transformation:
+a `ChatCompletion`, or the chunks of a stream. A hit is therefore parsed exactly like a
+fresh response, and a cached stream is replayed chunk by chunk.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import anyio
+
+# Options that change how a request is sent, not what the model answers
+_TRANSPORT_OPTIONS = frozenset({"extra_headers", "extra_query", "timeout"})
+
+
+def request_key(params: dict[str, Any]) -> str:
+    """A canonical hash of the parameters of a `create()` call."""
+    canonical = json.dumps(
+        {k: v for k, v in params.items() if k not in _TRANSPORT_OPTIONS},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=repr,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class _MemoryStore:
+    def __init__(self):
+        # key -> (created, value), least recently used first
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> tuple[float, bytes] | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, created: float, value: bytes) -> None:
+        self.delete(key)
+        self._entries[key] = (created, value)
+        self._size += len(value)
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def evict(self, max_entries: int | None, max_bytes: int | None) -> None:
+        while self._entries and (
+            (max_entries is not None and len(self._entries) > max_entries)
+            or (max_bytes is not None and self._size > max_bytes)
+        ):
+            _, (_, value) = self._entries.popitem(last=False)
+            self._size -= len(value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        pass
+
+
+class _SQLiteStore:
+    def __init__(self, path: str):
+        import sqlite3
+
+        # One connection, used from worker threads one call at a time
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        # WAL lets several processes (e.g. test workers) share the file
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, created REAL, used REAL, value BLOB)"
+        )
+
+    def get(self, key: str) -> tuple[float, bytes] | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE responses SET used = ? WHERE key = ?", (time.time(), key)
+                )
+        return row
+
+    def set(self, key: str, created: float, value: bytes) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, created, time.time(), value),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self, max_entries: int | None, max_bytes: int | None) -> None:
+        with self._lock:
+            if max_entries is not None:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (max_entries,),
+                )
+            if max_bytes is not None:
+                # Keep the most recently used entries that fit in max_bytes
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM ("
+                    "SELECT key, SUM(length(value)) OVER (ORDER BY used DESC, key) AS total "
+                    "FROM responses) WHERE total > ?)",
+                    (max_bytes,),
+                )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """LRU cache of upstream responses, in memory or in a SQLite file.
+
+    Pass it as `ToolUser(client, cache=ResponseCache())`. Meant for deterministic
+    requests (e.g. temperature 0 in evals and CI): every request is answered from the
+    cache once its exact parameters have been seen. ToolUser looks entries up with
+    `aget` and `aset`, which run the SQLite queries in a worker thread rather than on
+    the event loop.
+
+    Args:
+        path: SQLite database file to keep the entries in, so they survive restarts and
+            can be shared between processes. Default to memory only.
+        max_entries: Most entries kept; the least recently used are dropped first.
+        max_bytes: Most bytes of stored JSON kept, over all the entries. Default to no limit.
+        ttl: Seconds an entry stays valid after it is stored. Default to no expiry.
+
+    Attributes:
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups that found no valid entry.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        *,
+        max_entries: int | None = 1024,
+        max_bytes: int | None = None,
+        ttl: float | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._store = _MemoryStore() if path is None else _SQLiteStore(path)
+
+    def get(self, key: str) -> Any | None:
+        """The stored value of `key`, or None when it is missing or expired."""
+        return self._count(self._lookup(key))
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value, evicting old entries beyond the limits."""
+        self._store.set(
+            key, time.time(), json.dumps(value, ensure_ascii=False).encode()
+        )
+        self._store.evict(self.max_entries, self.max_bytes)
+
+    async def aget(self, key: str) -> Any | None:
+        """`get` without blocking the event loop on the SQLite database."""
+        if isinstance(self._store, _SQLiteStore):
+            # The counters are only updated on the loop
+            return self._count(await anyio.to_thread.run_sync(self._lookup, key))
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """`set` without blocking the event loop on the SQLite database."""
+        if isinstance(self._store, _SQLiteStore):
+            await anyio.to_thread.run_sync(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def _lookup(self, key: str) -> bytes | None:
+        entry = self._store.get(key)
+        if entry is not None and self.ttl is not None:
+            if time.time() - entry[0] > self.ttl:
+                self._store.delete(key)
+                entry = None
+        return None if entry is None else entry[1]
+
+    def _count(self, value: bytes | None) -> Any | None:
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def clear(self) -> None:
+        """Drop every entry; the counters are kept."""
+        self._store.clear()
+
+    def close(self) -> None:
+        """Close the SQLite database, if any."""
+        self._store.close()
+
+    def __len__(self) -> int:
+        return len(self._store)
@@ -0,0 +1,88 @@
+"""The tool catalog of a request, and everything derived from it once per catalog."""
+
+import json
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, ClassVar, Iterable
+
+from tooluser.schema import compile_schema
+
+# Start of a raw JSON tool call: double quotes only, arguments must be object/array
+RAW_CALL_START = r'\{{\s*"name"\s*:\s*"(?:{names})"\s*,\s*"arguments"\s*:\s*[\{{\[]'
+
+
+@dataclass
+class InvalidToolCall:
+    """A parsed tool call whose arguments do not fit the tool's `parameters` schema."""
+
+    id: str
+    name: str
+    arguments: str
+    errors: list[str]
+
+
+class ToolCatalog:
+    """The tools of a request, with per-tool data compiled lazily and kept for reuse.
+
+    Use `ToolCatalog.of(tools)` to share one instance between all the requests that send
+    the same tools.
+    """
+
+    _cache: ClassVar["OrderedDict[str, ToolCatalog]"] = OrderedDict()
+    cache_size: ClassVar[int] = 128
+
+    def __init__(self, tools: Iterable[Any]):
+        self.tools = list(tools)
+        self.functions: dict[str, dict] = {}
+        for tool in self.tools:
+            function = tool.get("function", tool)
+            self.functions[function["name"]] = function
+        self.names = frozenset(self.functions)
+        self._validators: dict[str, Callable[[Any], list[str]]] = {}
+        self._raw_call_start: re.Pattern[str] | None = None
+
+    @classmethod
+    def of(cls, tools: Iterable[Any]) -> "ToolCatalog":
+        tools = list(tools)
+        key = json.dumps(tools, sort_keys=True, default=str)
+        catalog = cls._cache.get(key)
+        if catalog is None:
+            catalog = cls._cache[key] = cls(tools)
+            if len(cls._cache) > cls.cache_size:
+                cls._cache.popitem(last=False)
+        else:
+            cls._cache.move_to_end(key)
+        return catalog
+
+    def validator(self, name: str) -> Callable[[Any], list[str]] | None:
+        """The compiled validator of a tool's parameters, or None for an unknown tool."""
+        validator = self._validators.get(name)
+        if validator is None:
+            function = self.functions.get(name)
+            if function is None:
+                return None
+            validator = self._validators[name] = compile_schema(
+                function.get("parameters", {})
+            )
+        return validator
+
+    @property
+    def raw_call_start(self) -> re.Pattern[str]:
+        """Matches the start of a raw JSON call of one of these tools, and of no other name."""
+        if self._raw_call_start is None:
+            names = "|".join(re.escape(name) for name in self.functions)
+            self._raw_call_start = re.compile(RAW_CALL_START.format(names=names))
+        return self._raw_call_start
+
+    def validate(self, id: str, name: str, arguments: str) -> InvalidToolCall | None:
+        """Check a tool call against the catalog, returning None when it is valid."""
+        validator = self.validator(name)
+        if validator is None:
+            return InvalidToolCall(id, name, arguments, [f"unknown tool {name!r}"])
+        try:
+            value = json.loads(arguments)
+        except ValueError:
+            return InvalidToolCall(id, name, arguments, ["$: not valid JSON"])
+        errors = validator(value)
+        return InvalidToolCall(id, name, arguments, errors) if errors else None
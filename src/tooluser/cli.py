@@ -0,0 +1,178 @@
+"""Command line entry point: `tooluser <command>`."""
+
+import argparse
+import os
+import sys
+from typing import Sequence
+
+
+def _serve(args: argparse.Namespace) -> None:
+    from tooluser.server import serve
+
+    serve(
+        upstream=args.upstream,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        api_key=args.api_key,
+        enable_raw_json_detection=not args.no_raw_json_detection,
+        timeout=args.timeout,
+        max_body_size=args.max_body_size,
+        stream_idle_timeout=args.stream_idle_timeout,
+        stream_deadline=args.stream_deadline,
+    )
+
+
+def _untransform(args: argparse.Namespace) -> None:
+    from tooluser.compact_transform import CompactTransformation
+    from tooluser.hermes_transform import HermesTransformation, untransform_jsonl
+
+    transformation = (
+        CompactTransformation() if args.format == "compact" else HermesTransformation()
+    )
+    src = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")  # noqa: SIM115
+    dst = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")  # noqa: SIM115
+    try:
+        untransform_jsonl(src, dst, transformation)
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if dst is not sys.stdout.buffer:
+            dst.close()
+
+
+def _stress(args: argparse.Namespace) -> None:
+    import asyncio
+    import dataclasses
+    import json
+
+    from tooluser.stress import format_results, stress
+
+    results = asyncio.run(
+        stress(
+            [int(level) for level in args.concurrency.split(",")],
+            args.streams,
+            token_rate=args.token_rate,
+            chars_per_token=args.chars_per_token,
+            reply_tokens=args.reply_tokens,
+            tool_call_ratio=args.tool_call_ratio,
+            tool_calls=args.tool_calls,
+            upstream_process=not args.in_process,
+        )
+    )
+    print(format_results(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([dataclasses.asdict(result) for result in results], f, indent=2)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="tooluser",
+        description="Enable tool-use ability for any LLM model.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run an OpenAI-compatible proxy that adds tool use"
+    )
+    serve_parser.add_argument(
+        "--upstream",
+        default=os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        help="Base URL of the upstream API (default: $OPENAI_BASE_URL)",
+    )
+    serve_parser.add_argument(
+        "--api-key",
+        default=os.environ.get("OPENAI_API_KEY"),
+        help="Key used when requests carry no Authorization header (default: $OPENAI_API_KEY)",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes"
+    )
+    serve_parser.add_argument(
+        "--timeout", type=float, default=600.0, help="Upstream timeout in seconds"
+    )
+    serve_parser.add_argument(
+        "--max-body-size",
+        type=int,
+        default=32 * 1024 * 1024,
+        help="Largest request body accepted, in bytes (default: 32 MiB)",
+    )
+    serve_parser.add_argument(
+        "--stream-idle-timeout",
+        type=float,
+        help="Seconds to wait for each upstream chunk of a stream (default: no limit)",
+    )
+    serve_parser.add_argument(
+        "--stream-deadline",
+        type=float,
+        help="Seconds a whole stream may take (default: no limit)",
+    )
+    serve_parser.add_argument(
+        "--no-raw-json-detection",
+        action="store_true",
+        help="Only detect tool calls wrapped in <tool_call> tags",
+    )
+    serve_parser.set_defaults(func=_serve)
+
+    untransform_parser = subparsers.add_parser(
+        "untransform",
+        help="Convert logged transcripts (JSONL) back into native tool messages",
+    )
+    untransform_parser.add_argument(
+        "--format",
+        choices=["hermes", "compact"],
+        default="hermes",
+        help="The transformation the transcripts were logged with (default: hermes)",
+    )
+    untransform_parser.add_argument(
+        "input", nargs="?", default="-", help="Input JSONL file (default: stdin)"
+    )
+    untransform_parser.add_argument(
+        "output", nargs="?", default="-", help="Output JSONL file (default: stdout)"
+    )
+    untransform_parser.set_defaults(func=_untransform)
+
+    stress_parser = subparsers.add_parser(
+        "stress",
+        help="Measure the streaming path under load against a local fake upstream",
+    )
+    stress_parser.add_argument(
+        "--concurrency",
+        default="10,100,1000",
+        help="Comma-separated concurrency levels to ramp through (default: 10,100,1000)",
+    )
+    stress_parser.add_argument(
+        "--streams", type=int, default=1000, help="Streams per level (default: 1000)"
+    )
+    stress_parser.add_argument(
+        "--token-rate",
+        type=float,
+        default=50.0,
+        help="Tokens per second of each upstream stream, 0 for no delay (default: 50)",
+    )
+    stress_parser.add_argument("--chars-per-token", type=int, default=4)
+    stress_parser.add_argument(
+        "--reply-tokens", type=int, default=200, help="Words of text per reply"
+    )
+    stress_parser.add_argument(
+        "--tool-call-ratio",
+        type=float,
+        default=0.5,
+        help="Share of replies that end with tool calls (default: 0.5)",
+    )
+    stress_parser.add_argument(
+        "--tool-calls", type=int, default=1, help="Tool calls in those replies"
+    )
+    stress_parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run the fake upstream on the same event loop instead of its own process",
+    )
+    stress_parser.add_argument("--json", help="Also write the results to this file")
+    stress_parser.set_defaults(func=_stress)
+
+    args = parser.parse_args(argv)
+    args.func(args)
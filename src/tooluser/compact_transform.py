@@ -0,0 +1,284 @@
+import json
+import re
+import uuid
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from openai.types.chat import (
+    ChatCompletionMessageParam,
+    ChatCompletionMessageToolCall,
+    ChatCompletionMessageToolCallParam,
+    ChatCompletionToolMessageParam,
+)
+from openai.types.chat.chat_completion_message_tool_call import Function
+from openai.types.shared_params.function_definition import FunctionDefinition
+
+from tooluser.catalog import ToolCatalog
+from tooluser.hermes_transform import (
+    HermesStreamProcessor,
+    HermesTransformation,
+    _single_text,
+)
+from tooluser.transform import StreamProcessor, content_text, repair_loads
+
+START_TAG = "<tc>"
+END_TAG = "</tc>"
+RESULT_START_TAG = "<tr"
+RESULT_END_TAG = "</tr>"
+TOOL_NAME_PATTERN = re.compile(r"[A-Za-z0-9_.-]+")
+_TOOLS_PROMPT_HEAD = "Tools:\n"
+_TOOLS_PROMPT_TAIL = "\nTo call tools, end your reply with one block per call"
+# Whole blocks as written by compact_tool_call_serialize, or by the model without a ref
+_CALL_BLOCK = re.compile(
+    r"<tc>([A-Za-z0-9_.-]+)(?: #(\d+))?(?:\n(.*?))?</tc>", re.DOTALL
+)
+_DUPLICATE_RESULT = re.compile(r"\[Identical to the result of #(\d+)\]")
+
+
+def compact_tools_prompt(tools: Iterable[FunctionDefinition]) -> str:
+    functions = "\n".join(
+        json.dumps(
+            tool.get("function", tool),
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        for tool in tools
+    )
+    return f"""{_TOOLS_PROMPT_HEAD}{functions}
+To call tools, end your reply with one block per call: the tool name on the first line, then the arguments as one-line JSON. Nothing may follow the last block.
+<tc>get_weather
+{{"location":"Paris"}}</tc>
+Results arrive as <tr #n>...</tr>, matching the call marked #n."""
+
+
+def _minified_arguments(arguments: str) -> str:
+    value = repair_loads(arguments)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_tool_call_parse(text: str) -> list[ChatCompletionMessageToolCall]:
+    """Parse a `<tc>name\\n{args}</tc>` block into a tool call."""
+    text = text.strip()
+    if text.startswith(START_TAG):
+        text = text[len(START_TAG) :]
+    if text.endswith(END_TAG):
+        text = text[: -len(END_TAG)]
+    head, _, arguments = text.strip().partition("\n")
+    # Calls replayed from the history carry a "#n" reference after the name
+    name = head.split("#", 1)[0].strip()
+    if not TOOL_NAME_PATTERN.fullmatch(name):
+        raise ValueError("Invalid tool call format - missing tool name")
+
+    arguments = arguments.strip() or "{}"
+    try:
+        value = repair_loads(arguments)
+    except Exception as e:
+        raise ValueError("Invalid tool call format - must be valid JSON") from e
+    if not isinstance(value, dict):
+        raise ValueError("Invalid tool call format - arguments must be an object")
+
+    return [
+        ChatCompletionMessageToolCall(
+            id="tool_" + name + "_" + uuid.uuid4().hex[:8],
+            function=Function(
+                name=name, arguments=json.dumps(value, ensure_ascii=False)
+            ),
+            type="function",
+        )
+    ]
+
+
+def compact_tool_call_serialize(
+    tool_call: ChatCompletionMessageToolCallParam, ref: str
+) -> str:
+    return f"""{START_TAG}{tool_call["function"]["name"]} {ref}
+{_minified_arguments(tool_call["function"]["arguments"])}{END_TAG}"""
+
+
+def compact_tool_result_serialize(
+    tool_result: ChatCompletionToolMessageParam, ref: str
+) -> str:
+    res = tool_result["content"]
+    if not isinstance(res, str):
+        res = "".join([part["text"] for part in res])
+    return f"{RESULT_START_TAG} {ref}>{res}{RESULT_END_TAG}"
+
+
+class CompactStreamProcessor(HermesStreamProcessor):
+    """Stream processor for the `<tc>` blocks of CompactTransformation."""
+
+    def __init__(self, strict: bool = False):
+        super().__init__(start_tag=START_TAG, end_tag=END_TAG, strict=strict)
+
+    def parse_tool_calls(self, text: str) -> list[ChatCompletionMessageToolCall]:
+        return compact_tool_call_parse(text)
+
+    def parse_strict(self, text: str) -> list[ChatCompletionMessageToolCall]:
+        # compact_tool_call_parse only repairs what json.loads rejects
+        return compact_tool_call_parse(text)
+
+    def is_valid_json(self, text: str) -> bool:
+        try:
+            json.loads(text.strip().partition("\n")[2] or "{}")
+        except ValueError:
+            return False
+        return True
+
+
+@dataclass
+class CompactTransformation(HermesTransformation):
+    """Transform tool_use API call to a token-lean prompt.
+
+    Compared with the Hermes template, the tool catalog is minified, calls are written as
+    `<tc>name\\n{args}</tc>`, and the calls and results of the history are linked by short
+    `#n` references (assigned in history order) instead of the full tool call ids.
+    Raw JSON detection and `detector` do not apply to this format and are refused;
+    `reasoning` and the other options of HermesTransformation work the same."""
+
+    tool_call_start = START_TAG
+    transformed_markers = (
+        START_TAG.encode(),
+        (RESULT_START_TAG + " #").encode(),
+        # Without the newline, which the JSON of a log line escapes
+        _TOOLS_PROMPT_TAIL.lstrip().encode(),
+    )
+
+    def __post_init__(self):
+        if self.enable_raw_json_detection:
+            raise ValueError(
+                "CompactTransformation does not support enable_raw_json_detection"
+            )
+        if self.detector is not None:
+            raise ValueError("CompactTransformation does not support a detector")
+
+    def create_stream_processor(
+        self, catalog: ToolCatalog | None = None
+    ) -> StreamProcessor:
+        processor = CompactStreamProcessor(strict=self.guided_decoding is not None)
+        processor.reasoning = self.reasoning
+        return processor
+
+    def tool_call_layout(self, name: str) -> tuple[str, str]:
+        return f"{START_TAG}{name}\n", END_TAG
+
+    def tools_prompt(self, tools: Iterable[FunctionDefinition]) -> str:
+        return compact_tools_prompt(tools)
+
+    def serialize_tool_call(
+        self, tool_call: ChatCompletionMessageToolCallParam, call_refs: dict[str, str]
+    ) -> str:
+        ref = call_refs.setdefault(tool_call["id"], f"#{len(call_refs) + 1}")
+        return compact_tool_call_serialize(tool_call, ref)
+
+    def serialize_tool_result(
+        self, tool_result: ChatCompletionToolMessageParam, call_refs: dict[str, str]
+    ) -> str:
+        ref = call_refs.setdefault(
+            tool_result["tool_call_id"], f"#{len(call_refs) + 1}"
+        )
+        return compact_tool_result_serialize(tool_result, ref)
+
+    def duplicate_result(self, tool_call_id: str, call_refs: dict[str, str]) -> str:
+        return f"[Identical to the result of {call_refs[tool_call_id]}]"
+
+    def parse_tools_prompt(self, content: str) -> list[dict] | None:
+        return compact_tools_parse(content)
+
+    def untransform_messages(
+        self,
+        messages: Iterable[ChatCompletionMessageParam],
+    ) -> list[ChatCompletionMessageParam]:
+        """Reverse trans_param_messages for the compact format.
+
+        The `#n` references become the tool call ids `call_n`, as the original ids are
+        not in the prompt, and deduplicated results get the content they refer to back."""
+        new_messages: list = []
+        results: dict[str, str] = {}
+        for message in messages:
+            role = message["role"]
+            content = content_text(message.get("content"))
+            if role == "assistant":
+                new_messages.append(_untransform_compact_assistant(message))
+            elif role == "user" and content.startswith(RESULT_START_TAG + " #"):
+                new_messages.append(_untransform_compact_result(message, results))
+            elif role == "system" and compact_tools_parse(content) is not None:
+                continue
+            else:
+                new_messages.append(message)
+        return new_messages
+
+
+def compact_tools_parse(prompt: str) -> list[dict] | None:
+    """Recover the tools from a prompt rendered by compact_tools_prompt, or None if it is
+    not one."""
+    if not prompt.startswith(_TOOLS_PROMPT_HEAD):
+        return None
+    end = prompt.find(_TOOLS_PROMPT_TAIL)
+    if end == -1:
+        return None
+    functions = prompt[len(_TOOLS_PROMPT_HEAD) : end]
+    return [
+        {"type": "function", "function": json.loads(line)}
+        for line in functions.split("\n")
+    ]
+
+
+def _call_param(match: re.Match[str]) -> ChatCompletionMessageToolCallParam:
+    name, ref, arguments = match.groups()
+    if ref is None:
+        # Written by the model: repaired like a streamed call
+        return compact_tool_call_parse(match.group(0))[0].model_dump()  # type: ignore[return-value]
+    return {
+        "id": f"call_{ref}",
+        "type": "function",
+        "function": {
+            "name": name,
+            "arguments": json.dumps(
+                repair_loads((arguments or "").strip() or "{}"), ensure_ascii=False
+            ),
+        },
+    }
+
+
+def _untransform_compact_assistant(message: Any) -> dict:
+    content = _single_text(message.get("content"))
+    if isinstance(content, str):
+        if START_TAG not in content:
+            return message
+        matches = list(_CALL_BLOCK.finditer(content))
+        if not matches:
+            return message
+        # trans_param_messages joins the content and the calls with a newline
+        text = content[: matches[0].start()]
+        if text.endswith("\n"):
+            text = text[:-1]
+        new_content: str | list | None = text or None
+    elif isinstance(content, list):
+        matches = []
+        new_content = []
+        for part in content:
+            match = _CALL_BLOCK.fullmatch(part.get("text", ""))
+            if match:
+                matches.append(match)
+            else:
+                new_content.append(part)
+        if not matches:
+            return message
+    else:
+        return message
+    return {
+        **message,
+        "content": new_content,
+        "tool_calls": [_call_param(match) for match in matches],
+    }
+
+
+def _untransform_compact_result(message: Any, results: dict[str, str]) -> dict:
+    text = content_text(message.get("content"))
+    ref, _, result = text[len(RESULT_START_TAG) + 2 :].partition(">")
+    result = result.removesuffix(RESULT_END_TAG)
+    duplicate = _DUPLICATE_RESULT.fullmatch(result)
+    if duplicate is not None and duplicate.group(1) in results:
+        result = results[duplicate.group(1)]
+    results[ref] = result
+    return {"role": "tool", "tool_call_id": f"call_{ref}", "content": result}
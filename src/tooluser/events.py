@@ -0,0 +1,93 @@
+"""Lightweight events of `ProxyAsyncCompletions.stream_events()`.
+
+Unlike `ChatCompletionChunk`, these are plain `__slots__` objects built straight from
+the stream processor outputs. `index` is the index of the choice the event belongs to.
+"""
+
+from typing import Union
+
+
+class _Event:
+    __slots__ = ()
+
+    def __eq__(self, other: object) -> bool:
+        return type(other) is type(self) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class TextDelta(_Event):
+    """A piece of assistant text."""
+
+    __slots__ = ("index", "text")
+
+    def __init__(self, index: int, text: str):
+        self.index = index
+        self.text = text
+
+
+class ReasoningDelta(_Event):
+    """A piece of the model's reasoning, from the upstream's `reasoning_content` or a
+    `<think>` block split out of the text."""
+
+    __slots__ = ("index", "text")
+
+    def __init__(self, index: int, text: str):
+        self.index = index
+        self.text = text
+
+
+class ToolCallStart(_Event):
+    """A tool call begins."""
+
+    __slots__ = ("id", "index", "name")
+
+    def __init__(self, index: int, id: str, name: str):
+        self.index = index
+        self.id = id
+        self.name = name
+
+
+class ToolCallArgsDelta(_Event):
+    """A piece of the JSON arguments of the tool call `id`.
+
+    Calls parsed from the transformed text arrive whole, as one delta; native tool
+    calls of the upstream may be split over several."""
+
+    __slots__ = ("arguments", "id", "index")
+
+    def __init__(self, index: int, id: str, arguments: str):
+        self.index = index
+        self.id = id
+        self.arguments = arguments
+
+
+class ToolCallEnd(_Event):
+    """The arguments of the tool call `id` are complete."""
+
+    __slots__ = ("id", "index")
+
+    def __init__(self, index: int, id: str):
+        self.index = index
+        self.id = id
+
+
+class Finish(_Event):
+    """The choice is complete, with the upstream's finish reason."""
+
+    __slots__ = ("index", "reason")
+
+    def __init__(self, index: int, reason: str):
+        self.index = index
+        self.reason = reason
+
+
+StreamEvent = Union[
+    TextDelta, ReasoningDelta, ToolCallStart, ToolCallArgsDelta, ToolCallEnd, Finish
+]
@@ -0,0 +1,334 @@
+"""Tool calls written in other formats than the Hermes `<tool_call>` blocks.
+
+Models fall back on the call formats they were trained on: fenced ```json blocks,
+`<function=name>{...}</function>` tags, or bare JSON. A ToolCallDetector recognizes
+several formats at once: their opening markers are compiled into one pattern, so each
+chunk is scanned once however many formats are enabled.
+"""
+
+import json
+import re
+import uuid
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Sequence
+
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+
+from tooluser.hermes_transform import (
+    HermesStreamProcessor,
+    _find_function_call_start,
+    _find_json_end,
+    tool_call_parse,
+    tool_call_parse_strict,
+)
+from tooluser.transform import PendingToolCalls, StreamOutputType, repair_loads
+
+ToolCallParser = Callable[[str, re.Match[str]], list[ChatCompletionMessageToolCall]]
+
+
+@dataclass(frozen=True)
+class CallFormat:
+    """A way of writing tool calls in a reply.
+
+    Attributes:
+        name: Key of the format in the hit counters.
+        start: Regex of the opening marker, beginning with a literal character.
+        end: The closing marker.
+        parse: Parses the text between the markers, given the match of the opening marker.
+            Raises ValueError when the block is not a tool call; it is then kept as text.
+        max_start: Length of the longest opening marker, held back from the text while
+            it may be incomplete.
+        parse_strict: Parser of blocks kept well-formed by guided decoding, if any.
+    """
+
+    name: str
+    start: str
+    end: str
+    parse: ToolCallParser
+    max_start: int
+    parse_strict: Callable[[str], list[ChatCompletionMessageToolCall]] | None = None
+
+
+def _parse_json_calls(
+    text: str, match: re.Match[str]
+) -> list[ChatCompletionMessageToolCall]:
+    """Calls written as one JSON object, or a list of them, with `name` and `arguments`."""
+    text = text.strip()
+    if text.startswith("[") and text.endswith("]"):
+        text = text[1:-1]
+    return tool_call_parse(text)
+
+
+def _parse_function_tag(
+    text: str, match: re.Match[str]
+) -> list[ChatCompletionMessageToolCall]:
+    """The arguments of a `<function=name>` tag."""
+    name = match.group(1)
+    try:
+        arguments = repair_loads(text.strip() or "{}")
+    except Exception as e:
+        raise ValueError("Invalid tool call format - must be valid JSON") from e
+    if not isinstance(arguments, dict):
+        raise ValueError("Invalid tool call format - arguments must be an object")
+    return [
+        ChatCompletionMessageToolCall(
+            id="tool_" + name + "_" + uuid.uuid4().hex[:8],
+            function=Function(
+                name=name, arguments=json.dumps(arguments, ensure_ascii=False)
+            ),
+            type="function",
+        )
+    ]
+
+
+def _parse_hermes_block(
+    text: str, match: re.Match[str]
+) -> list[ChatCompletionMessageToolCall]:
+    return tool_call_parse(text)
+
+
+def _parse_block(
+    fmt: CallFormat, start: str, text: str, _written: str
+) -> list[ChatCompletionMessageToolCall]:
+    """Parse the text of a block opened by the marker `start`.
+
+    Takes the block as written, which PendingToolCalls gives back if it fails. The
+    marker is matched again here, as a match object cannot be sent to another process."""
+    match = re.match(fmt.start, start)
+    assert match is not None
+    return fmt.parse(text, match)
+
+
+def _count_hit(hits: dict[str, int], name: str) -> None:
+    """Count a deferred block that parsed, in the process of the detector."""
+    hits[name] += 1
+
+
+HERMES_FORMAT = CallFormat(
+    "hermes",
+    re.escape("<tool_call>"),
+    "</tool_call>",
+    _parse_hermes_block,
+    len("<tool_call>"),
+    parse_strict=tool_call_parse_strict,
+)
+FENCED_JSON_FORMAT = CallFormat(
+    "fenced_json", r"```json[ \t]*\n", "```", _parse_json_calls, len("```json \n")
+)
+FUNCTION_TAG_FORMAT = CallFormat(
+    "function_tag",
+    r"<function=([A-Za-z0-9_.-]{1,64})>",
+    "</function>",
+    _parse_function_tag,
+    len("<function=>") + 64,
+)
+
+
+class ToolCallDetector:
+    """Recognizes tool calls in several formats, and counts the hits of each format.
+
+    Set it on the transformation, e.g. `HermesTransformation(detector=ToolCallDetector())`.
+    The tool prompt still asks for Hermes blocks. A block of another format that is not a
+    tool call (e.g. a fenced JSON example) is kept as text, markers included. Raw JSON
+    calls are detected as well when the transformation enables them.
+
+    Args:
+        formats: The formats to recognize. Default to Hermes blocks, fenced ```json
+            blocks and `<function=name>` tags.
+
+    Attributes:
+        hits: Number of blocks parsed into tool calls, per format name, and "raw_json"
+            for bare JSON calls.
+    """
+
+    def __init__(
+        self,
+        formats: Sequence[CallFormat] = (
+            HERMES_FORMAT,
+            FENCED_JSON_FORMAT,
+            FUNCTION_TAG_FORMAT,
+        ),
+    ):
+        self.formats = list(formats)
+        self.hits = {fmt.name: 0 for fmt in self.formats}
+        self.hits["raw_json"] = 0
+        self.scanner = re.compile("|".join(f"(?:{fmt.start})" for fmt in self.formats))
+        self.patterns = [re.compile(fmt.start) for fmt in self.formats]
+        self.buffer_size = max(fmt.max_start for fmt in self.formats)
+        # Finds the characters an opening marker can begin with
+        first_chars = {re.sub(r"\\(.)", r"\1", fmt.start)[0] for fmt in self.formats}
+        self.marker_start = re.compile(
+            "[" + "".join(re.escape(c) for c in sorted(first_chars)) + "]"
+        )
+
+    def create_stream_processor(
+        self, enable_raw_json_detection: bool = False, strict: bool = False
+    ) -> "MultiFormatStreamProcessor":
+        return MultiFormatStreamProcessor(
+            self, enable_raw_json_detection=enable_raw_json_detection, strict=strict
+        )
+
+
+@dataclass
+class _Block:
+    """The call block a processor is in: its format and opening marker."""
+
+    format: CallFormat
+    start: re.Match[str]
+    pattern: re.Pattern[str] = field(repr=False)
+
+
+class MultiFormatStreamProcessor(HermesStreamProcessor):
+    """Stream processor of a ToolCallDetector."""
+
+    def __init__(
+        self,
+        detector: ToolCallDetector,
+        enable_raw_json_detection: bool = False,
+        strict: bool = False,
+    ):
+        super().__init__(
+            start_tag="<tool_call>",
+            end_tag="</tool_call>",
+            enable_raw_json_detection=enable_raw_json_detection,
+            strict=strict,
+        )
+        self.detector = detector
+        self.buffer_size = detector.buffer_size
+        self.block: _Block | None = None
+
+    def _open(self, pos: int) -> _Block:
+        """The block whose opening marker the scanner found at `pos`."""
+        detector = self.detector
+        for fmt, pattern in zip(detector.formats, detector.patterns, strict=True):
+            match = pattern.match(self.buffer, pos)
+            if match is not None:
+                return _Block(fmt, match, pattern)
+        raise AssertionError("The scanner matched no format")
+
+    def _parse_call_block(
+        self, block: _Block, text: str, closed: bool
+    ) -> list[StreamOutputType]:
+        fmt = block.format
+        written = block.start.group(0) + text + (fmt.end if closed else "")
+        hits = self.detector.hits
+
+        if self.strict and fmt.parse_strict is not None:
+            try:
+                calls = fmt.parse_strict(text)
+            except ValueError:
+                # The upstream did not apply the constraint
+                pass
+            else:
+                hits[fmt.name] += 1
+                return list(calls)
+        if (
+            self.offload_size is not None
+            and len(text) >= self.offload_size
+            and not self.is_valid_json(text)
+        ):
+            parse = partial(_parse_block, fmt, block.start.group(0), text)
+            count = partial(_count_hit, hits, fmt.name)
+            return [PendingToolCalls(parse, written, count)]  # type: ignore[list-item]
+        try:
+            calls = fmt.parse(text, block.start)
+        except Exception:
+            # Not a tool call: keep the block as the model wrote it
+            return [written]
+        hits[fmt.name] += 1
+        return list(calls)
+
+    def is_valid_json(self, text: str) -> bool:
+        try:
+            json.loads(text)
+        except ValueError:
+            return super().is_valid_json(text)
+        return True
+
+    def _idle(self) -> bool:
+        return self.block is None and super()._idle()
+
+    def _scan(self, chunk: str) -> list[StreamOutputType]:
+        self.buffer += chunk
+        outputs: list[StreamOutputType] = []
+
+        while True:
+            if self.in_raw_json:
+                json_end = _find_json_end(self.buffer, 0)
+                if json_end == -1:
+                    break
+                output = self.buffer[:json_end]
+                self.buffer = self.buffer[json_end:].strip()
+                if self.buffer.startswith("</tool_call>"):
+                    self.buffer = self.buffer[len("</tool_call>") :]
+                self.in_raw_json = False
+                parsed = self._parse_block(output)
+                count = partial(_count_hit, self.detector.hits, "raw_json")
+                for o in parsed:
+                    if isinstance(o, PendingToolCalls):
+                        o.on_parsed = count
+                if any(not isinstance(o, (str, PendingToolCalls)) for o in parsed):
+                    count()
+                outputs.extend(parsed)
+                continue
+
+            block = self.block
+            if block is None:
+                match = self.detector.scanner.search(self.buffer)
+                json_start_idx = -1
+                if self.enable_raw_json_detection:
+                    json_start_idx = _find_function_call_start(
+                        self.buffer, self.raw_call_start
+                    )
+                if match is not None and (
+                    json_start_idx == -1 or match.start() < json_start_idx
+                ):
+                    if match.start():
+                        outputs.append(self.buffer[: match.start()])
+                    self.block = self._open(match.start())
+                    self.buffer = self.buffer[match.end() :]
+                    continue
+                if json_start_idx != -1:
+                    if json_start_idx:
+                        outputs.append(self.buffer[:json_start_idx])
+                    self.buffer = self.buffer[json_start_idx:]
+                    self.in_raw_json = True
+                    continue
+                # Hold back the tail from where an opening marker may be starting
+                marker = self.detector.marker_start.search(
+                    self.buffer, max(len(self.buffer) - self.buffer_size, 0)
+                )
+                cut = len(self.buffer) if marker is None else marker.start()
+                if cut:
+                    outputs.append(self.buffer[:cut])
+                    self.buffer = self.buffer[cut:]
+                break
+
+            end_idx = self.buffer.find(block.format.end)
+            # A new opening marker of the same format before the end: the block was left open
+            restart = block.pattern.search(self.buffer)
+            if end_idx != -1 and (restart is None or end_idx <= restart.start()):
+                text = self.buffer[:end_idx]
+                self.buffer = self.buffer[end_idx + len(block.format.end) :]
+                self.block = None
+                outputs.extend(self._parse_call_block(block, text, closed=True))
+                continue
+            if restart is not None:
+                text = self.buffer[: restart.start()]
+                self.block = _Block(block.format, restart, block.pattern)
+                self.buffer = self.buffer[restart.end() :]
+                outputs.extend(self._parse_call_block(block, text, closed=False))
+                continue
+            break
+
+        return outputs
+
+    def _flush(self) -> Sequence[StreamOutputType]:
+        block = self.block
+        if block is not None:
+            if self.truncated:
+                return [block.start.group(0) + self.buffer]
+            return self._parse_call_block(block, self.buffer, closed=False)
+        return super()._flush()
@@ -0,0 +1,82 @@
+"""Guided decoding: constrain the replies of a local inference server to tool call syntax.
+
+Servers such as vLLM and SGLang can restrict generation to a structure passed in the
+request body. The constraint built here allows free text, and tool call blocks whose
+name is one of the request's tools and whose arguments are a JSON object, so the
+reply always parses without repair.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Literal
+
+# Arguments in the regex form: one-line JSON object, as the tool prompts ask for
+_ARGUMENTS_REGEX = r"\{[^\n]*\}"
+
+
+@dataclass(frozen=True)
+class GuidedDecoding:
+    """How to pass the tool call constraint to the upstream.
+
+    Set it on the transformation, e.g. `HermesTransformation(guided_decoding=GuidedDecoding())`.
+    The constraint is merged into `extra_body` of every request with tools, and the tool
+    call blocks of the reply are parsed on a strict path without repair.
+
+    Args:
+        kind: "structural_tag" sends a `response_format` of that type (vLLM, SGLang):
+            after the start tag, the arguments must match the tool's `parameters` schema.
+            "regex" sends a regular expression instead, for servers without structural
+            tags: the tool name is checked, the arguments only have to be a one-line object.
+        field: Body field of the regex. Default to "guided_regex" (vLLM); SGLang uses "regex".
+    """
+
+    kind: Literal["structural_tag", "regex"] = "structural_tag"
+    field: str = "guided_regex"
+
+    def constraint(
+        self, start_tag: str, calls: Iterable[tuple[str, dict[str, Any], str]]
+    ) -> dict[str, Any]:
+        """Body fields constraining a reply to text and tool calls.
+
+        `calls` holds, per tool, the text before its arguments, its parameters schema and
+        the text after its arguments; every call begins with `start_tag`."""
+        calls = list(calls)
+        if self.kind == "structural_tag":
+            return {
+                "response_format": {
+                    "type": "structural_tag",
+                    "structures": [
+                        {"begin": begin, "schema": schema, "end": end}
+                        for begin, schema, end in calls
+                    ],
+                    "triggers": [start_tag],
+                }
+            }
+        call = "|".join(
+            re.escape(begin) + _ARGUMENTS_REGEX + re.escape(end)
+            for begin, _, end in calls
+        )
+        return {self.field: f"{text_without(start_tag)}(?:(?:{call})\\s*)*"}
+
+
+def text_without(tag: str) -> str:
+    """A regex of any text that does not contain `tag`.
+
+    Built without lookahead, which the regex engines of guided decoding lack. The first
+    character of `tag` must not occur again in it, as for `<tool_call>`."""
+    first = tag[0]
+    if first in tag[1:]:
+        raise ValueError(f"{tag!r} repeats its first character")
+    # After `first`, a partial match of the rest of the tag...
+    partial = "|".join(re.escape(tag[1:k]) for k in range(2, len(tag)))
+    # ...that either restarts at another `first`, or breaks off
+    restart = f"(?:{partial})?{re.escape(first)}"
+    breaks = "|".join(
+        re.escape(tag[1:k]) + "[^" + re.escape(first + tag[k]) + "]"
+        for k in range(1, len(tag))
+    )
+    first = re.escape(first)
+    return (
+        f"(?:[^{first}]|{first}(?:{restart})*(?:{breaks}))*"
+        f"(?:{first}(?:{restart})*(?:{partial})?)?"
+    )
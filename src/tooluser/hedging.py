@@ -0,0 +1,124 @@
+"""Hedged requests: when the upstream is slow to answer, send a duplicate and keep the first reply.
+
+The duplicate can go to another model or, through another client, to another base URL.
+The loser is cancelled and its connection closed.
+"""
+
+from collections import deque
+from typing import Any, Awaitable, Callable, TypeVar
+
+import anyio
+
+_T = TypeVar("_T")
+
+
+class Hedging:
+    """Hedge upstream requests that are slower than a delay.
+
+    Pass it as `ToolUser(client, hedging=Hedging(...))`. A non-stream request is hedged
+    when no response arrives within the delay, a stream when no first chunk does.
+
+    Args:
+        delay: Seconds to wait before sending the duplicate. Default to the `percentile`
+            of the recent latencies, once `min_samples` of them are known.
+        percentile: Percentile of the recent latencies used as the delay.
+        min_samples: Latencies to observe before hedging with a learned delay.
+        model: Model of the duplicate request. Default to the same model.
+        client: A plain AsyncOpenAI client to send the duplicate with, e.g. for another
+            base URL. Default to the same client.
+        max_ratio: Most duplicates as a share of all requests, to cap the extra load.
+        history: Number of recent latencies kept to learn the delay from.
+
+    Attributes:
+        requests: Requests sent.
+        hedged: Duplicates sent.
+        hedge_wins: Duplicates that answered first.
+    """
+
+    def __init__(
+        self,
+        delay: float | None = None,
+        *,
+        percentile: float = 95.0,
+        min_samples: int = 20,
+        model: str | None = None,
+        client: Any = None,
+        max_ratio: float = 0.1,
+        history: int = 200,
+    ):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.model = model
+        self.client = client
+        self.max_ratio = max_ratio
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies: deque[float] = deque(maxlen=history)
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None while too few latencies are known."""
+        if self.delay is not None:
+            return self.delay
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    async def race(
+        self,
+        primary: Callable[[], Awaitable[_T]],
+        backup: Callable[[], Awaitable[_T]],
+        discard: Callable[[_T], Awaitable[Any]] | None = None,
+    ) -> _T:
+        """The result of `primary()`, or of `backup()` if that is sent and answers first.
+
+        The slower one is cancelled; `discard` releases a result that arrives too late
+        to be used. Errors are only raised once every request sent has failed."""
+        self.requests += 1
+        started_at = anyio.current_time()
+        winner: list[tuple[_T, bool]] = []
+        errors: list[Exception] = []
+        settled = anyio.Event()
+        attempts = 0
+
+        async def run(fetch: Callable[[], Awaitable[_T]], hedge: bool) -> None:
+            try:
+                result = await fetch()
+            except Exception as e:
+                errors.append(e)
+                if len(errors) == attempts:
+                    settled.set()
+                return
+            if winner:
+                if discard is not None:
+                    with anyio.CancelScope(shield=True):
+                        await discard(result)
+                return
+            winner.append((result, hedge))
+            settled.set()
+
+        async with anyio.create_task_group() as tg:
+            attempts += 1
+            tg.start_soon(run, primary, False)
+            delay = self.hedge_delay()
+            if delay is not None:
+                with anyio.move_on_after(delay):
+                    await settled.wait()
+                if (
+                    not settled.is_set()
+                    and self.hedged + 1 <= self.max_ratio * self.requests
+                ):
+                    self.hedged += 1
+                    attempts += 1
+                    tg.start_soon(run, backup, True)
+            await settled.wait()
+            tg.cancel_scope.cancel()
+
+        if not winner:
+            raise errors[0]
+        result, hedge = winner[0]
+        self.hedge_wins += hedge
+        self._latencies.append(anyio.current_time() - started_at)
+        return result
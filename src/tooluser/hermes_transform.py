@@ -1,16 +1,16 @@
+import ast
 import json
 import re
 import uuid
 from dataclasses import dataclass
-from typing import Iterable, List, Sequence
+from typing import TYPE_CHECKING, Any, BinaryIO, Iterable, List, Literal, Sequence
 
-from jinja2 import Template
-from json_repair import repair_json
 from openai.types.chat import (
     ChatCompletionMessage,
     ChatCompletionMessageParam,
     ChatCompletionMessageToolCall,
     ChatCompletionMessageToolCallParam,
+    ChatCompletionToolChoiceOptionParam,
     ChatCompletionToolMessageParam,
 )
 from openai.types.chat.chat_completion_chunk import (
@@ -21,15 +21,31 @@ from openai.types.chat.chat_completion_chunk import (
 from openai.types.chat.chat_completion_message_tool_call import Function
 from openai.types.shared_params.function_definition import FunctionDefinition
 
-from tooluser.transform import StreamOutputType, StreamProcessor, Transformation
+from tooluser.catalog import RAW_CALL_START, ToolCatalog
+from tooluser.guided import GuidedDecoding
+from tooluser.transform import (
+    PendingToolCalls,
+    PromptOverhead,
+    ReasoningText,
+    RepairOffload,
+    StreamOutputType,
+    StreamProcessor,
+    Transformation,
+    aresolve_outputs,
+    content_text,
+    repair_loads,
+    resolve_outputs,
+)
 
+if TYPE_CHECKING:
+    from tooluser.formats import ToolCallDetector
 
-def tools_list_prompt(tools: Iterable[FunctionDefinition]):
-    tools_template = """
+_TOOLS_PROMPT_HEAD = """
 <tool_instruction>
 You are a function calling AI model. You are provided with function signatures within <tools> </tools> XML tags. You may call one or more functions to assist with the user query. Don't make assumptions about what values to plug into functions.
 <tools>
-{{tools}}
+"""
+_TOOLS_PROMPT_TAIL = """
 </tools>
 
 For each function call return a json object with function name and arguments within <tool_call> </tool_call> tags with the following schema:
@@ -43,17 +59,50 @@ Here is an example of a tool call:
 </tool_call>
 
 IMPORTANT: Ensure each tool call is individually enclosed in its own <tool_call> </tool_call> tags. If you are making multiple tool calls, each must have its own pair of these tags. All tool calls must be placed at the VERY END of your response, and no text should follow the final </tool_call> tag.
-</tool_instruction>
-"""
-    return Template(tools_template).render(
-        tools=[
-            json.dumps(
-                tool,
-                ensure_ascii=False,
-            )
-            for tool in tools
-        ]
-    )
+</tool_instruction>"""
+
+
+def chosen_function(
+    tool_choice: ChatCompletionToolChoiceOptionParam | None,
+) -> str | None:
+    """The name of the function a `tool_choice` forces, if any."""
+    if isinstance(tool_choice, dict) and tool_choice.get("type") == "function":
+        return tool_choice["function"]["name"]  # type: ignore[typeddict-item]
+    return None
+
+
+def tool_choice_directive(
+    tool_choice: ChatCompletionToolChoiceOptionParam | None,
+    parallel_tool_calls: bool | None = None,
+) -> str:
+    """Instructions appended to the tool prompt for `tool_choice` and `parallel_tool_calls`."""
+    lines = []
+    name = chosen_function(tool_choice)
+    if tool_choice == "required":
+        lines.append("You must call at least one function in this reply.")
+    elif name is not None:
+        lines.append(f"You must call the function {name} in this reply.")
+    if parallel_tool_calls is False:
+        lines.append("Call at most one function in this reply.")
+    return "".join("\n" + line for line in lines)
+
+
+def tools_list_prompt(tools: Iterable[FunctionDefinition]):
+    # The tools are listed as the repr of a list of JSON strings, as the former Jinja
+    # template rendered them; tools_list_parse relies on that
+    tools_list = [json.dumps(tool, ensure_ascii=False) for tool in tools]
+    return _TOOLS_PROMPT_HEAD + str(tools_list) + _TOOLS_PROMPT_TAIL
+
+
+_TOOLS_LIST = re.compile(r"<tools>\n(.*?)\n</tools>", re.DOTALL)
+
+
+def tools_list_parse(prompt: str) -> list[dict]:
+    """Recover the tools from a prompt rendered by tools_list_prompt."""
+    match = _TOOLS_LIST.search(prompt)
+    if not match:
+        raise ValueError("Invalid tools prompt format")
+    return [json.loads(tool) for tool in ast.literal_eval(match.group(1))]
 
 
 def tool_call_parse(text: str) -> list[ChatCompletionMessageToolCall]:
@@ -70,7 +119,7 @@ def tool_call_parse(text: str) -> list[ChatCompletionMessageToolCall]:
 
     # Parse the JSON-formatted tool call
     try:
-        tool_call_data: list[dict] = repair_json(text, return_objects=True)  # type: ignore
+        tool_call_data: list[dict] = repair_loads(text)
     except Exception as e:
         raise ValueError("Invalid tool call format - must be valid JSON") from e
 
@@ -105,6 +154,24 @@ def tool_call_parse(text: str) -> list[ChatCompletionMessageToolCall]:
         raise ValueError("Invalid tool call format - missing required fields") from e
 
 
+def tool_call_parse_strict(text: str) -> list[ChatCompletionMessageToolCall]:
+    """Parse one tool call that guided decoding kept well-formed: a JSON object with only
+    `name` and `arguments`, and no tags. Raise ValueError otherwise, without repairing."""
+    data = json.loads(text)
+    if not isinstance(data, dict) or data.keys() != {"name", "arguments"}:
+        raise ValueError("Invalid tool call format - not a single tool call")
+    name = data["name"]
+    return [
+        ChatCompletionMessageToolCall(
+            id="tool_" + name + "_" + uuid.uuid4().hex[:8],
+            function=Function(
+                name=name, arguments=json.dumps(data["arguments"], ensure_ascii=False)
+            ),
+            type="function",
+        )
+    ]
+
+
 def tool_call_parse_parama(text: str) -> ChatCompletionMessageToolCallParam:
     tool_call = tool_call_parse(text)
     return tool_call.model_dump()  # type: ignore
@@ -113,9 +180,7 @@ def tool_call_parse_parama(text: str) -> ChatCompletionMessageToolCallParam:
 def tool_call_serialize(tool_call: ChatCompletionMessageToolCallParam):
     # Parse the arguments string back into a dictionary
     try:
-        arguments: dict | str = repair_json(
-            tool_call["function"]["arguments"], return_objects=True
-        )  # type: ignore
+        arguments: dict | str = repair_loads(tool_call["function"]["arguments"])
     except Exception as e:
         arguments = tool_call["function"]["arguments"]
         raise ValueError("Invalid tool call format - must be valid JSON") from e
@@ -144,9 +209,15 @@ def tool_result_serialize(tool_result: ChatCompletionToolMessageParam):
 </tool_result>"""
 
 
+_TOOL_RESULT_ID = re.compile(r"<id>(.*?)</id>", re.DOTALL)
+_TOOL_RESULT_CONTENT = re.compile(r"<result>(.*?)</result>", re.DOTALL)
+# Whole blocks as written by tool_call_serialize
+_TOOL_CALL_BLOCK = re.compile(r"<tool_call>(.*?)</tool_call>", re.DOTALL)
+
+
 def tool_result_parse(text: str) -> ChatCompletionToolMessageParam:
-    id_match = re.search(r"<id>(.*?)</id>", text, re.DOTALL)
-    result_match = re.search(r"<result>(.*?)</result>", text, re.DOTALL)
+    id_match = _TOOL_RESULT_ID.search(text)
+    result_match = _TOOL_RESULT_CONTENT.search(text)
     if not id_match or not result_match:
         raise ValueError("Invalid tool result format")
     return {
@@ -156,25 +227,165 @@ def tool_result_parse(text: str) -> ChatCompletionToolMessageParam:
     }
 
 
+def _tool_call_param_parse(text: str) -> list[ChatCompletionMessageToolCallParam]:
+    """Parse the inside of a serialized <tool_call> block back into tool call params,
+    keeping the id written by tool_call_serialize."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Model-written calls may need repairing, and may hold several objects
+        return [tool_call.model_dump() for tool_call in tool_call_parse(text)]  # type: ignore
+    if not isinstance(data, dict) or "name" not in data or "arguments" not in data:
+        raise ValueError("Invalid tool call format - missing required fields")
+    return [
+        {
+            "id": data.get("id") or "tool_" + data["name"] + "_" + uuid.uuid4().hex[:8],
+            "type": "function",
+            "function": {
+                "name": data["name"],
+                "arguments": json.dumps(data["arguments"], ensure_ascii=False),
+            },
+        }
+    ]
+
+
+def _single_text(content: Any) -> Any:
+    """The text of a content made of one text part (e.g. a cache-control marked message)."""
+    if (
+        isinstance(content, list)
+        and len(content) == 1
+        and content[0].get("type") == "text"
+    ):
+        return content[0]["text"]
+    return content
+
+
+def _untransform_assistant_message(message: dict) -> dict:
+    content = _single_text(message.get("content"))
+    if isinstance(content, str):
+        if "<tool_call>" not in content:
+            return message
+        tool_calls: list[ChatCompletionMessageToolCallParam] = []
+        text_end = None
+        for match in _TOOL_CALL_BLOCK.finditer(content):
+            if text_end is None:
+                text_end = match.start()
+            tool_calls.extend(_tool_call_param_parse(match.group(1)))
+        if text_end is None:
+            return message
+        # trans_param_messages joins the content and the calls with a newline
+        text = content[:text_end]
+        if text.endswith("\n"):
+            text = text[:-1]
+        new_content: str | list | None = text or None
+    elif isinstance(content, list):
+        tool_calls = []
+        new_content = []
+        for part in content:
+            text = part.get("text", "")
+            match = _TOOL_CALL_BLOCK.fullmatch(text) if "<tool_call>" in text else None
+            if match:
+                tool_calls.extend(_tool_call_param_parse(match.group(1)))
+            else:
+                new_content.append(part)
+        if not tool_calls:
+            return message
+    else:
+        return message
+
+    new_message = message.copy()
+    new_message["content"] = new_content
+    new_message["tool_calls"] = tool_calls
+    return new_message
+
+
+def _untransform_user_message(message: dict) -> list[dict]:
+    content = _single_text(message.get("content"))
+    if not isinstance(content, str) or not content.startswith("<tool_result>"):
+        return [message]
+    # str.find is much faster than a lazy regex over large results
+    results = []
+    pos = 0
+    while pos < len(content):
+        id_start = content.find("<id>", pos)
+        id_end = content.find("</id>", id_start)
+        result_start = content.find("<result>", id_end)
+        result_end = content.find("</result>", result_start)
+        block_end = content.find("</tool_result>", result_end)
+        if not content.startswith("<tool_result>", pos) or -1 in (
+            id_start,
+            id_end,
+            result_start,
+            result_end,
+            block_end,
+        ):
+            return [message]
+        result = content[result_start + len("<result>") : result_end]
+        # tool_result_serialize puts the result on its own lines
+        if result.startswith("\n"):
+            result = result[1:]
+        if result.endswith("\n"):
+            result = result[:-1]
+        results.append(
+            {
+                "role": "tool",
+                "tool_call_id": content[id_start + len("<id>") : id_end],
+                "content": result,
+            }
+        )
+        pos = block_end + len("</tool_result>")
+        while pos < len(content) and content[pos].isspace():
+            pos += 1
+    return results
+
+
 # Helper functions for the processing logic
 
 
-def _is_potential_function_call_start(text: str, start_pos: int) -> bool:
-    """Check if the JSON starting at start_pos looks like a function call. Works for only non-stream mode."""
-    # More restrictive pattern: double quotes only, arguments must be object/array
-    remaining = text[start_pos:]
-    pattern = (
-        r'^\s*\{\s*"name"\s*:\s*"[a-zA-Z_][a-zA-Z0-9_]*"\s*,\s*"arguments"\s*:\s*[\{\[]'
-    )
+# Raw JSON calls of any tool name, when the request's tools are not known
+_ANY_CALL_START = re.compile(RAW_CALL_START.format(names="[a-zA-Z_][a-zA-Z0-9_]*"))
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+# A reasoning block of the history, unclosed if the reply was cut inside it
+_THINK_BLOCK = re.compile(r"<think>.*?(?:</think>\s*|\Z)", re.DOTALL)
+
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    """Length of the longest end of `text` that is the beginning of `tag`."""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
 
-    if not re.match(pattern, remaining, re.DOTALL):
+
+def _find_function_call_start(text: str, pattern: re.Pattern[str]) -> int:
+    """Position of the first JSON in text that looks like a function call, or -1.
+
+    `pattern` finds the candidates in one pass; each one must also pass the heuristics."""
+    match = pattern.search(text)
+    while match is not None:
+        if _passes_function_call_heuristics(text, match.start(), pattern):
+            return match.start()
+        # A candidate may start inside the previous one, e.g. in its arguments
+        match = pattern.search(text, match.start() + 1)
+    return -1
+
+
+def _is_potential_function_call_start(
+    text: str, start_pos: int, pattern: re.Pattern[str] = _ANY_CALL_START
+) -> bool:
+    """Check if the JSON starting at start_pos looks like a function call. Works for only non-stream mode."""
+    if not pattern.match(text, start_pos):
         return False
 
     # Additional heuristics to reduce false positives
-    return _passes_function_call_heuristics(text, start_pos)
+    return _passes_function_call_heuristics(text, start_pos, pattern)
 
 
-def _passes_function_call_heuristics(text: str, start_pos: int) -> bool:
+def _passes_function_call_heuristics(
+    text: str, start_pos: int, pattern: re.Pattern[str] = _ANY_CALL_START
+) -> bool:
     """Apply additional heuristics to determine if this is likely a function call. Works for only non-stream mode."""
 
     # Only detect JSON that appears at the very end of the text
@@ -187,7 +398,7 @@ def _passes_function_call_heuristics(text: str, start_pos: int) -> bool:
             len(after_json) == 0
             or after_json.startswith("</tool_call>")
             or after_json.startswith("<tool_call>")
-            or _is_potential_function_call_start(after_json, 0)
+            or _is_potential_function_call_start(after_json, 0, pattern)
         )
 
     return False
@@ -235,9 +446,26 @@ class HermesStreamProcessor(StreamProcessor):
     in_tool_call: bool
     in_raw_json: bool
     enable_raw_json_detection: bool
+    # Set when the stream stopped early, so an unfinished call must not be repaired
+    truncated: bool
+    # Blocks at least this long that need repair are deferred as PendingToolCalls
+    offload_size: int | None
+    # Set when guided decoding keeps the blocks well-formed, so they are parsed strictly
+    strict: bool
+    # Finds raw JSON calls; narrowed to the request's tool names when they are known
+    raw_call_start: re.Pattern[str]
+    # How <think> blocks are emitted, no tool calls being looked for inside them: as text
+    # ("inline") or as ReasoningText ("split"). None treats them as any other text.
+    reasoning: Literal["inline", "split"] | None
+    in_think: bool
+    think_buffer: str
 
     def __init__(
-        self, start_tag: str, end_tag: str, enable_raw_json_detection: bool = False
+        self,
+        start_tag: str,
+        end_tag: str,
+        enable_raw_json_detection: bool = False,
+        strict: bool = False,
     ):
         self.start_tag = start_tag
         self.end_tag = end_tag
@@ -246,8 +474,144 @@ class HermesStreamProcessor(StreamProcessor):
         self.in_tool_call = False
         self.in_raw_json = False
         self.enable_raw_json_detection = enable_raw_json_detection
+        self.truncated = False
+        self.offload_size = None
+        self.strict = strict
+        self.raw_call_start = _ANY_CALL_START
+        self.reasoning = None
+        self.in_think = False
+        self.think_buffer = ""
+
+    def parse_tool_calls(self, text: str) -> list[ChatCompletionMessageToolCall]:
+        """Parse the text of one tool call block. Raise ValueError if it is not a tool call."""
+        return tool_call_parse(text)
+
+    def parse_strict(self, text: str) -> list[ChatCompletionMessageToolCall]:
+        """Parse a block that guided decoding kept well-formed, without repair."""
+        return tool_call_parse_strict(text)
+
+    def is_valid_json(self, text: str) -> bool:
+        """Whether a tool call block parses without repair, which keeps parsing it cheap."""
+        try:
+            json.loads("[" + text.strip() + "]")
+        except ValueError:
+            return False
+        return True
+
+    def _parse_block(self, text: str) -> list[StreamOutputType]:
+        if self.strict:
+            try:
+                return list(self.parse_strict(text))
+            except ValueError:
+                # The upstream did not apply the constraint
+                pass
+        if (
+            self.offload_size is not None
+            and len(text) >= self.offload_size
+            and not self.is_valid_json(text)
+        ):
+            return [PendingToolCalls(self.parse_tool_calls, text)]  # type: ignore[list-item]
+        try:
+            return list(self.parse_tool_calls(text))
+        except Exception:
+            # If parsing fails, treat as regular text
+            return [text]
+
+    def _idle(self) -> bool:
+        """Whether the processor is outside of any tool call block."""
+        return not self.in_tool_call and not self.in_raw_json
+
+    def _reasoning_output(self, text: str) -> StreamOutputType:
+        return ReasoningText(text) if self.reasoning == "split" else text
+
+    def _find_think_start(self, text: str) -> tuple[int, int | None]:
+        """Position of the first <think> tag of `text` outside of raw JSON calls, or -1, and
+        the start of an unfinished raw JSON call to hold back until it ends, if any."""
+        pos = 0
+        while True:
+            start_idx = text.find(THINK_START, pos)
+            if not self.enable_raw_json_detection:
+                return start_idx, None
+            match = self.raw_call_start.search(
+                text, pos, len(text) if start_idx == -1 else start_idx
+            )
+            if match is None:
+                return start_idx, None
+            json_end = _find_json_end(text, match.start())
+            if json_end == -1:
+                # A tag after the start of the call is in its arguments
+                return -1, match.start()
+            pos = json_end
 
     def process(self, chunk: str) -> list[StreamOutputType]:
+        if self.reasoning is None:
+            return self._scan(chunk)
+        self.think_buffer += chunk
+        outputs: list[StreamOutputType] = []
+
+        while self.think_buffer:
+            text = self.think_buffer
+            if self.in_think:
+                end_idx = text.find(THINK_END)
+                if end_idx == -1:
+                    cut = len(text) - _partial_tag_len(text, THINK_END)
+                    if cut:
+                        outputs.append(self._reasoning_output(text[:cut]))
+                    self.think_buffer = text[cut:]
+                    break
+                body = text[:end_idx]
+                if self.reasoning == "inline":
+                    body += THINK_END
+                if body:
+                    outputs.append(self._reasoning_output(body))
+                self.think_buffer = text[end_idx + len(THINK_END) :]
+                self.in_think = False
+                continue
+
+            idle = self._idle()
+            start_idx, hold = self._find_think_start(text) if idle else (-1, None)
+            if start_idx == -1:
+                if hold is not None:
+                    cut = hold
+                elif idle:
+                    cut = len(text) - _partial_tag_len(text, THINK_START)
+                else:
+                    cut = len(text)
+                outputs.extend(self._scan(text[:cut]))
+                self.think_buffer = text[cut:]
+                break
+            outputs.extend(self._scan(text[:start_idx]))
+            if not self._idle():
+                # The text before the tag opened a tool call, which the tag is part of
+                outputs.extend(self._scan(text[start_idx:]))
+                self.think_buffer = ""
+                break
+            # What the scanner holds back cannot be the start of a tool call any more
+            if self.buffer:
+                outputs.append(self.buffer)
+                self.buffer = ""
+            if self.reasoning == "inline":
+                outputs.append(THINK_START)
+            self.think_buffer = text[start_idx + len(THINK_START) :]
+            self.in_think = True
+
+        return outputs
+
+    def finalize(self) -> Sequence[StreamOutputType]:
+        if self.reasoning is None:
+            return self._flush()
+        outputs: list[StreamOutputType] = []
+        if self.in_think:
+            if self.think_buffer:
+                outputs.append(self._reasoning_output(self.think_buffer))
+        else:
+            outputs.extend(self._scan(self.think_buffer))
+        self.think_buffer = ""
+        outputs.extend(self._flush())
+        return outputs
+
+    def _scan(self, chunk: str) -> list[StreamOutputType]:
+        """Process a chunk of text outside of reasoning blocks."""
         self.buffer += chunk
         outputs: list[StreamOutputType] = []
 
@@ -259,12 +623,9 @@ class HermesStreamProcessor(StreamProcessor):
                 # Look for potential raw JSON function calls (only if enabled)
                 json_start_idx = -1
                 if self.enable_raw_json_detection:
-                    for i in range(len(self.buffer)):
-                        if self.buffer[i] == "{" and _is_potential_function_call_start(
-                            self.buffer, i
-                        ):
-                            json_start_idx = i
-                            break
+                    json_start_idx = _find_function_call_start(
+                        self.buffer, self.raw_call_start
+                    )
 
                 # Decide which pattern to follow
                 if start_idx != -1 and (
@@ -317,11 +678,7 @@ class HermesStreamProcessor(StreamProcessor):
                 if end_idx != -1 or start_idx != -1:
                     output = self.buffer[:output_idx]
                     self.buffer = self.buffer[output_idx_end:]
-                    try:
-                        outputs.extend(tool_call_parse(output))
-                    except Exception:
-                        # If parsing fails, treat as regular text
-                        outputs.append(output)
+                    outputs.extend(self._parse_block(output))
 
                     if normal_close:
                         self.in_tool_call = False
@@ -339,23 +696,19 @@ class HermesStreamProcessor(StreamProcessor):
                     if self.buffer.startswith("</tool_call>"):
                         self.buffer = self.buffer[len("</tool_call>") :]
                     self.in_raw_json = False
-                    try:
-                        # Try to parse as function call
-                        parsed_call = tool_call_parse(output)
-                        outputs.extend(parsed_call)
-                    except Exception:
-                        # If parsing fails, treat as regular text
-                        outputs.append(output)
+                    # Try to parse as function call
+                    outputs.extend(self._parse_block(output))
                     continue
 
         return outputs
 
-    def finalize(self) -> Sequence[StreamOutputType]:
+    def _flush(self) -> Sequence[StreamOutputType]:
+        if self.truncated and self.in_tool_call:
+            return [self.start_tag + self.buffer]
         if self.in_tool_call or self.in_raw_json:
-            try:
-                return tool_call_parse(self.buffer)
-            except Exception:
+            if self.truncated:
                 return [self.buffer]
+            return self._parse_block(self.buffer)
         else:
             return [self.buffer]
 
@@ -363,37 +716,198 @@ class HermesStreamProcessor(StreamProcessor):
 @dataclass
 class HermesTransformation(Transformation):
     """Transform tool_use API call to a user prompt, in Hermes template format.
-    ref: https://huggingface.co/Qwen/Qwen2.5-0.5B-Instruct/blob/main/tokenizer_config.json#L198"""
+    ref: https://huggingface.co/Qwen/Qwen2.5-0.5B-Instruct/blob/main/tokenizer_config.json#L198
+
+    Set `cache_control` (e.g. `{"type": "ephemeral"}`) to send the injected tool prompt as a
+    content part carrying this prompt-cache marker, for providers that support explicit
+    cache breakpoints. With `cache_history`, the last message before the newest one is
+    marked too, so the stable history is cached as well. Providers that do not know the
+    field ignore it and see the same text.
+
+    Set `guided_decoding` to have a local inference server constrain the reply to text and
+    well-formed tool calls of the request's tools (see `guided_constraint`). Raw JSON
+    detection is then off, as the constraint only allows calls inside tags.
+
+    Set `detector` to a ToolCallDetector to also recognize calls written in other formats
+    than Hermes blocks, e.g. fenced ```json blocks.
+
+    A `tool_choice` of "none" leaves the tool prompt out. "required" and a named function
+    are asked for in the prompt, or with `prefill`, forced by starting the assistant reply
+    with the tool call tag (and the function name), so the model writes no preamble.
+    "prefix" sends that start as a final assistant message marked `"prefix": true`
+    (DeepSeek, Mistral); "continue" marks nothing, the request then needs
+    `continue_final_message` (see `prefill_fields`, for vLLM and SGLang).
+
+    Set `dedup_tool_results` to a size in characters to replace every tool result of the
+    history at least that long, which repeats an earlier result exactly, with a reference
+    to the earlier one, e.g. when an agent reads the same file again. Only later copies
+    are replaced, so the prompt of the next turn keeps the same prefix.
+
+    Set `reasoning` for models that think in `<think>...</think>` blocks before replying:
+    no tool calls are looked for inside them, so a call the model only considers stays
+    reasoning. "inline" keeps the blocks in the content as written, "split" moves their
+    text to `reasoning_content`. With `strip_reasoning`, the reasoning of the assistant
+    messages of the history (`<think>` blocks and `reasoning_content`) is not sent back."""
 
     enable_raw_json_detection: bool = False
+    cache_control: dict[str, Any] | None = None
+    cache_history: bool = False
+    guided_decoding: GuidedDecoding | None = None
+    detector: "ToolCallDetector | None" = None
+    reasoning: Literal["inline", "split"] | None = None
+    strip_reasoning: bool = False
+    prefill: Literal["prefix", "continue"] | None = None
+    dedup_tool_results: int | None = None
+
+    # The tag every tool call of the reply starts with
+    tool_call_start = "<tool_call>"
+    # A logged line holds one of these when it went through the transformation
+    transformed_markers = (b"<tool_call>", b"<tool_result>", b"<tool_instruction>")
+
+    def create_stream_processor(
+        self, catalog: ToolCatalog | None = None
+    ) -> StreamProcessor:
+        """A processor for one reply. With the request's `catalog`, raw JSON detection only
+        accepts calls of its tools."""
+        enable_raw_json_detection = (
+            self.enable_raw_json_detection and self.guided_decoding is None
+        )
+        strict = self.guided_decoding is not None
+        if self.detector is not None:
+            processor = self.detector.create_stream_processor(
+                enable_raw_json_detection, strict
+            )
+        else:
+            processor = HermesStreamProcessor(
+                start_tag="<tool_call>",
+                end_tag="</tool_call>",
+                enable_raw_json_detection=enable_raw_json_detection,
+                strict=strict,
+            )
+        if catalog is not None:
+            processor.raw_call_start = catalog.raw_call_start
+        processor.reasoning = self.reasoning
+        return processor
 
-    def create_stream_processor(self) -> StreamProcessor:
-        return HermesStreamProcessor(
-            start_tag="<tool_call>",
-            end_tag="</tool_call>",
-            enable_raw_json_detection=self.enable_raw_json_detection,
+    def tool_call_layout(self, name: str) -> tuple[str, str]:
+        """The text before and after the arguments of a call to `name`, as the model writes it."""
+        return (
+            f'<tool_call>\n{{"name": {json.dumps(name, ensure_ascii=False)}, "arguments": ',
+            "}\n</tool_call>",
         )
 
+    def guided_constraint(self, tools: Iterable[FunctionDefinition]) -> dict[str, Any]:
+        """Fields to merge into the request body for guided decoding, or {} when it is off."""
+        if self.guided_decoding is None:
+            return {}
+        calls = []
+        for tool in tools:
+            function = tool.get("function", tool)
+            begin, end = self.tool_call_layout(function["name"])
+            schema = function.get("parameters") or {"type": "object"}
+            calls.append((begin, schema, end))
+        return self.guided_decoding.constraint(self.tool_call_start, calls)
+
+    def tools_prompt(self, tools: Iterable[FunctionDefinition]) -> str:
+        return tools_list_prompt(tools)
+
+    def tool_choice_prefill(
+        self, tool_choice: ChatCompletionToolChoiceOptionParam | None
+    ) -> str:
+        """The start of the assistant reply that forces `tool_choice`, or "" when the reply
+        is not prefilled. The model continues it, so the reply is parsed after it."""
+        if self.prefill is None:
+            return ""
+        if tool_choice == "required":
+            return self.tool_call_start
+        name = chosen_function(tool_choice)
+        return "" if name is None else self.tool_call_layout(name)[0]
+
+    def prefill_message(self, text: str) -> ChatCompletionMessageParam:
+        """The final assistant message that the reply is to continue from `text`."""
+        message: dict[str, Any] = {"role": "assistant", "content": text}
+        if self.prefill == "prefix":
+            message["prefix"] = True
+        return message  # type: ignore[return-value]
+
+    def prefill_fields(self) -> dict[str, Any]:
+        """Fields to merge into the request body of a prefilled request."""
+        if self.prefill == "continue":
+            return {"continue_final_message": True, "add_generation_prompt": False}
+        return {}
+
+    def serialize_tool_call(
+        self, tool_call: ChatCompletionMessageToolCallParam, call_refs: dict[str, str]
+    ) -> str:
+        """Serialize a tool call of the history.
+        `call_refs` is shared by all the messages of one request, so that formats which
+        refer to calls by short references can assign them in history order."""
+        return tool_call_serialize(tool_call)
+
+    def serialize_tool_result(
+        self, tool_result: ChatCompletionToolMessageParam, call_refs: dict[str, str]
+    ) -> str:
+        return tool_result_serialize(tool_result)
+
+    def duplicate_result(self, tool_call_id: str, call_refs: dict[str, str]) -> str:
+        """The content standing for a tool result identical to that of `tool_call_id`."""
+        return f"[Identical to the <tool_result> of {tool_call_id} above]"
+
     def trans_param_messages(
         self,
         messages: Iterable[ChatCompletionMessageParam],
         tools: Iterable[FunctionDefinition],
+        overhead: PromptOverhead | None = None,
+        tool_choice: ChatCompletionToolChoiceOptionParam | None = None,
+        parallel_tool_calls: bool | None = None,
     ) -> Iterable[ChatCompletionMessageParam]:
+        """Move the tools into the prompt and the tool calls and results of the history into
+        the text. `tools` is expected to hold only the function a `tool_choice` names."""
         new_messages = []
-        new_messages.append(
-            {
-                "role": "system",
-                "content": tools_list_prompt(tools),
-            }
-        )
+        prefill = self.tool_choice_prefill(tool_choice)
+        # Dedup savings are always counted, the character and token breakdown on request
+        breakdown = overhead if overhead is not None and overhead.breakdown else None
+        if tool_choice != "none":
+            # A prefilled reply needs no instruction to call a tool
+            catalog = self.tools_prompt(tools) + tool_choice_directive(
+                None if prefill else tool_choice, parallel_tool_calls
+            )
+            new_messages.append(
+                {
+                    "role": "system",
+                    "content": catalog
+                    if self.cache_control is None
+                    else _with_cache_control(catalog, self.cache_control),
+                }
+            )
+            if breakdown is not None:
+                breakdown.record("catalog", catalog + prefill)
+        call_refs: dict[str, str] = {}
+        # The tool call id of the first result with each content, for deduplication
+        first_results: dict[str, str] = {}
         for message in messages:
+            if breakdown is not None:
+                breakdown.record("original", content_text(message.get("content")))
+            if self.strip_reasoning and message["role"] == "assistant":
+                message = _strip_reasoning(message)  # noqa: PLW2901
             if "tool_calls" in message:
                 new_message = message.copy()
                 new_message.pop("tool_calls")
+                tool_calls = list(message["tool_calls"])
                 tools_prompt = [
-                    tool_call_serialize(tool_call)
-                    for tool_call in message["tool_calls"]
+                    self.serialize_tool_call(tool_call, call_refs)
+                    for tool_call in tool_calls
                 ]
+                if breakdown is not None:
+                    for tool_call, serialized in zip(
+                        tool_calls, tools_prompt, strict=True
+                    ):
+                        breakdown.record(
+                            "original",
+                            tool_call["function"]["name"]
+                            + tool_call["function"]["arguments"],
+                        )
+                        breakdown.record("tool_calls", serialized)
                 content = message.get("content", "")
                 if isinstance(content, str) or (content is None):
                     content = content or ""
@@ -405,7 +919,17 @@ class HermesTransformation(Transformation):
                     ]
                 new_messages.append(new_message)
             elif message["role"] == "tool":
-                tool_results = tool_result_serialize(message)
+                if self.dedup_tool_results is not None:
+                    message = self._dedup_result(  # noqa: PLW2901
+                        message,
+                        self.dedup_tool_results,
+                        first_results,
+                        call_refs,
+                        overhead,
+                    )
+                tool_results = self.serialize_tool_result(message, call_refs)
+                if breakdown is not None:
+                    breakdown.record("tool_results", tool_results)
                 new_messages.append(
                     {
                         "role": "user",
@@ -415,26 +939,107 @@ class HermesTransformation(Transformation):
             else:
                 new_messages.append(message)
 
+        if self.cache_control is not None and self.cache_history:
+            # The newest message changes every turn, everything before it is stable
+            if len(new_messages) > 2:  # noqa: PLR2004
+                stable = new_messages[-2] = dict(new_messages[-2])
+                if stable.get("content"):
+                    stable["content"] = _with_cache_control(
+                        stable["content"], self.cache_control
+                    )
+
+        if prefill:
+            new_messages.append(self.prefill_message(prefill))
+
+        if breakdown is not None:
+            for new_message in new_messages:
+                breakdown.record(
+                    "transformed", content_text(new_message.get("content"))
+                )
+        return new_messages
+
+    def _dedup_result(
+        self,
+        tool_result: ChatCompletionToolMessageParam,
+        min_chars: int,
+        first_results: dict[str, str],
+        call_refs: dict[str, str],
+        overhead: PromptOverhead | None,
+    ) -> ChatCompletionToolMessageParam:
+        # Joined once here rather than again by the serializer
+        text = content_text(tool_result["content"])
+        if len(text) < min_chars:
+            return tool_result
+        tool_call_id = tool_result["tool_call_id"]
+        first_id = first_results.setdefault(text, tool_call_id)
+        if first_id == tool_call_id:
+            return {**tool_result, "content": text}
+        reference = self.duplicate_result(first_id, call_refs)
+        saved_bytes = len(text.encode()) - len(reference.encode())
+        if saved_bytes <= 0:
+            # A result shorter than the reference to it is kept as is
+            return {**tool_result, "content": text}
+        if overhead is not None:
+            overhead.dedup_saved_bytes += saved_bytes
+        return {**tool_result, "content": reference}
+
+    def parse_tools_prompt(self, content: str) -> list[dict] | None:
+        """The tools of `content` if it is the injected tool prompt, else None."""
+        if "<tool_instruction>" not in content:
+            return None
+        return tools_list_parse(content)
+
+    def untransform_messages(
+        self,
+        messages: Iterable[ChatCompletionMessageParam],
+    ) -> list[ChatCompletionMessageParam]:
+        """Reverse trans_param_messages: turn a transformed message list back into native
+        `tool_calls` / `role: tool` messages, e.g. to convert logged traffic into training data.
+
+        The injected <tool_instruction> system message is dropped (see tools_list_parse to
+        recover the tools from it). Each message is scanned once with precompiled patterns.
+        """
+        new_messages: list = []
+        for message in messages:
+            role = message["role"]
+            if role == "assistant":
+                new_messages.append(_untransform_assistant_message(message))  # type: ignore
+            elif role == "user":
+                new_messages.extend(_untransform_user_message(message))  # type: ignore
+            elif role == "system" and "<tool_instruction>" in content_text(
+                message.get("content")
+            ):
+                continue
+            else:
+                new_messages.append(message)
         return new_messages
 
     def trans_completion_message(
         self,
         message: ChatCompletionMessage,
+        catalog: ToolCatalog | None = None,
     ) -> ChatCompletionMessage:
-        processor = self.create_stream_processor()
         if message.content is not None:
-            tool_calls: List[ChatCompletionMessageToolCall] = []
-            output_content = ""
+            processor = self.create_stream_processor(catalog)
             outputs = processor.process(message.content)
             outputs.extend(processor.finalize())
-            for output in outputs:
-                if isinstance(output, ChatCompletionMessageToolCall):
-                    tool_calls.append(output)
-                else:
-                    output_content += output
-            message.content = output_content
-            if tool_calls:
-                message.tool_calls = tool_calls
+            _apply_message_outputs(message, resolve_outputs(outputs))
+        return message
+
+    async def atrans_completion_message(
+        self,
+        message: ChatCompletionMessage,
+        offload: RepairOffload,
+        catalog: ToolCatalog | None = None,
+    ) -> ChatCompletionMessage:
+        """Like `trans_completion_message`, parsing large blocks that need repair per `offload`."""
+        if message.content is not None:
+            processor = self.create_stream_processor(catalog)
+            if isinstance(processor, HermesStreamProcessor):
+                processor.offload_size = offload.min_size
+            outputs = processor.process(message.content)
+            outputs.extend(processor.finalize())
+            _apply_message_outputs(message, await aresolve_outputs(outputs, offload))
         return message
 
     def trans_completion_message_stream(
@@ -443,30 +1048,167 @@ class HermesTransformation(Transformation):
         delta: ChoiceDelta,
         finalize: bool = False,
     ) -> ChoiceDelta:
-        if not finalize:
-            if delta.content is None:
-                raise ValueError("Delta content is None but finalize is False")
-            outputs = processor.process(delta.content)
+        outputs = _delta_outputs(processor, delta, finalize)
+        return _apply_delta_outputs(delta, resolve_outputs(outputs))
+
+    async def atrans_completion_message_stream(
+        self,
+        processor: StreamProcessor,
+        delta: ChoiceDelta,
+        offload: RepairOffload,
+        finalize: bool = False,
+    ) -> ChoiceDelta:
+        """Like `trans_completion_message_stream`, parsing large blocks that need repair per `offload`.
+
+        Deferred blocks are awaited before the delta is returned, so outputs keep their order."""
+        if isinstance(processor, HermesStreamProcessor):
+            processor.offload_size = offload.min_size
+        outputs = _delta_outputs(processor, delta, finalize)
+        return _apply_delta_outputs(delta, await aresolve_outputs(outputs, offload))
+
+
+def _with_cache_control(content: Any, cache_control: dict[str, Any]) -> list[dict]:
+    """Content as a list of parts whose last text part carries `cache_control`."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": cache_control}]
+    parts = [dict(part) for part in content]
+    for part in reversed(parts):
+        if part.get("type") == "text":
+            part["cache_control"] = cache_control
+            break
+    return parts
+
+
+def _strip_reasoning(
+    message: ChatCompletionMessageParam,
+) -> ChatCompletionMessageParam:
+    """An assistant message of the history without its reasoning."""
+    new_message: dict[str, Any] = dict(message)
+    new_message.pop("reasoning_content", None)
+    content = new_message.get("content")
+    if isinstance(content, str):
+        new_message["content"] = _THINK_BLOCK.sub("", content)
+    elif content is not None:
+        new_message["content"] = [
+            {**part, "text": _THINK_BLOCK.sub("", part["text"])}
+            if part.get("type") == "text"
+            else part
+            for part in content
+        ]
+    return new_message  # type: ignore[return-value]
+
+
+def _delta_outputs(
+    processor: StreamProcessor, delta: ChoiceDelta, finalize: bool
+) -> list[StreamOutputType]:
+    if not finalize:
+        if delta.content is None:
+            raise ValueError("Delta content is None but finalize is False")
+        return processor.process(delta.content)
+    outputs = processor.process(delta.content) if delta.content else []
+    outputs.extend(processor.finalize())
+    return outputs
+
+
+def _apply_message_outputs(
+    message: ChatCompletionMessage, outputs: Iterable[StreamOutputType]
+) -> None:
+    tool_calls: List[ChatCompletionMessageToolCall] = []
+    output_content = ""
+    reasoning = ""
+    for output in outputs:
+        if isinstance(output, ChatCompletionMessageToolCall):
+            tool_calls.append(output)
+        elif isinstance(output, ReasoningText):
+            reasoning += output
         else:
-            outputs = processor.finalize()
-        tool_calls: list[ChatCompletionMessageToolCall] = []
-        content = ""
-        for output in outputs:
-            if isinstance(output, ChatCompletionMessageToolCall):
-                tool_calls.append(output)
-            else:
-                content += output
-        delta.content = content or None
-        delta.tool_calls = [
-            ChoiceDeltaToolCall(
-                index=0,
-                id=x.id,
-                function=ChoiceDeltaToolCallFunction(
-                    name=x.function.name,
-                    arguments=x.function.arguments,
-                ),
-                type=x.type,
-            )
-            for x in tool_calls
-        ] or None
-        return delta
+            output_content += output
+    message.content = output_content
+    if reasoning:
+        # Not a field of ChatCompletionMessage: kept as an extra, as providers send it
+        message.reasoning_content = (  # type: ignore[attr-defined]
+            getattr(message, "reasoning_content", None) or ""
+        ) + reasoning
+    if tool_calls:
+        message.tool_calls = tool_calls
+
+
+def _apply_delta_outputs(
+    delta: ChoiceDelta, outputs: Iterable[StreamOutputType]
+) -> ChoiceDelta:
+    tool_calls: list[ChatCompletionMessageToolCall] = []
+    content = ""
+    reasoning = ""
+    for output in outputs:
+        if isinstance(output, ChatCompletionMessageToolCall):
+            tool_calls.append(output)
+        elif isinstance(output, ReasoningText):
+            reasoning += output
+        else:
+            content += output
+    delta.content = content or None
+    if reasoning:
+        delta.reasoning_content = (  # type: ignore[attr-defined]
+            getattr(delta, "reasoning_content", None) or ""
+        ) + reasoning
+    delta.tool_calls = [
+        ChoiceDeltaToolCall(
+            index=0,
+            id=x.id,
+            function=ChoiceDeltaToolCallFunction(
+                name=x.function.name,
+                arguments=x.function.arguments,
+            ),
+            type=x.type,
+        )
+        for x in tool_calls
+    ] or delta.tool_calls
+    return delta
+
+
+def untransform_jsonl(
+    src: BinaryIO,
+    dst: BinaryIO,
+    transformation: HermesTransformation | None = None,
+) -> int:
+    """Bulk version of HermesTransformation.untransform_messages over a JSONL stream.
+
+    Each line holds a list of messages or an object with a "messages" list, whose other
+    fields are kept. When an object has no "tools", they are recovered from the injected
+    tool prompt. Lines without any markup of the transformation (Hermes by default, or
+    e.g. CompactTransformation) are copied through without being parsed.
+    Returns the number of lines written.
+    """
+    if transformation is None:
+        transformation = HermesTransformation()
+    # Logged requests mostly share a few tool catalogs
+    catalogs: dict[str, list[dict]] = {}
+    count = 0
+    markers = transformation.transformed_markers
+    for line in src:
+        count += 1
+        if not any(marker in line for marker in markers):
+            dst.write(line if line.endswith(b"\n") else line + b"\n")
+            continue
+        record = json.loads(line)
+        messages = record if isinstance(record, list) else record["messages"]
+        native = transformation.untransform_messages(messages)
+        if isinstance(record, list):
+            record = native
+        else:
+            if "tools" not in record:
+                for message in messages:
+                    if message["role"] != "system":
+                        continue
+                    content = content_text(message.get("content"))
+                    tools = catalogs.get(content)
+                    if tools is None:
+                        tools = transformation.parse_tools_prompt(content)
+                        if tools is None:
+                            continue
+                        catalogs[content] = tools
+                    record["tools"] = tools
+                    break
+            record["messages"] = native
+        dst.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+    return count
@@ -0,0 +1,216 @@
+"""Client-side admission control for upstream requests.
+
+A Scheduler holds requests back before they reach the upstream, so bursts queue in the
+client instead of turning into 429s and retry backoff. It enforces a concurrency cap and
+requests/tokens per minute limits. Waiting requests are served by priority, and
+requests of the same priority are shared fairly between tenants by the tokens each
+tenant has been served.
+"""
+
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Hashable
+
+import anyio
+
+
+@dataclass
+class SchedulerStats:
+    """Counters of a Scheduler, since it was created.
+
+    Attributes:
+        admitted: Requests let through.
+        queued: Requests that had to wait.
+        max_queue_depth: Most requests waiting at once.
+        total_wait: Seconds waited, summed over all admitted requests.
+        max_wait: Longest wait of an admitted request, in seconds.
+    """
+
+    admitted: int = 0
+    queued: int = 0
+    max_queue_depth: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.admitted if self.admitted else 0.0
+
+
+@dataclass(eq=False)
+class _Waiter:
+    priority: int
+    tenant: Hashable
+    tokens: int
+    seq: int
+    enqueued: float
+    event: anyio.Event = field(default_factory=anyio.Event)
+    admitted: bool = False
+
+
+class Scheduler:
+    """Admit upstream requests within concurrency and rate limits.
+
+    Pass it as `ToolUser(client, scheduler=Scheduler(...))`; `create()` then takes two
+    more keyword arguments, `priority` (higher first, default 0) and `tenant` (any
+    hashable, default None). A stream holds its slot until it ends or is closed.
+
+    Args:
+        max_concurrency: Most requests in flight at once. Default to no limit.
+        requests_per_minute: Most requests admitted per window. Default to no limit.
+        tokens_per_minute: Most estimated tokens (prompt plus `max_tokens`) admitted per
+            window. A request larger than the limit is admitted alone. Default to no limit.
+        window: Length of the rate limit window in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int | None = None,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        window: float = 60.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self.stats = SchedulerStats()
+        self.active = 0
+        self._waiters: list[_Waiter] = []
+        # (admission time, tokens) of the requests admitted in the current window
+        self._admitted: deque[tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._served: dict[Hashable, int] = {}
+        self._seq = itertools.count()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting now."""
+        return len(self._waiters)
+
+    async def acquire(
+        self, tokens: int = 0, *, priority: int = 0, tenant: Hashable = None
+    ) -> None:
+        """Wait until a request of `tokens` estimated tokens may be sent; pair with `release()`."""
+        waiter = _Waiter(
+            priority, tenant, tokens, next(self._seq), anyio.current_time()
+        )
+        # A tenant that starts waiting is not owed the service it missed while idle
+        floor = min((self._served.get(w.tenant, 0) for w in self._waiters), default=0)
+        self._served[tenant] = max(self._served.get(tenant, 0), floor)
+        self._waiters.append(waiter)
+        queued = False
+        try:
+            while True:
+                retry_after = self._dispatch()
+                if waiter.admitted:
+                    break
+                if not queued:
+                    queued = True
+                    self.stats.queued += 1
+                    self.stats.max_queue_depth = max(
+                        self.stats.max_queue_depth, len(self._waiters)
+                    )
+                next_waiter = self._next()
+                if next_waiter is not waiter and retry_after is not None:
+                    # Only the next request in line waits for the rate limit window
+                    next_waiter.event.set()
+                with anyio.move_on_after(
+                    retry_after if next_waiter is waiter else None
+                ):
+                    await waiter.event.wait()
+                waiter.event = anyio.Event()
+        except BaseException:
+            if waiter.admitted:
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                self._dispatch()
+                self._wake_next()
+            raise
+        # Requests admitted along with this one may have left the next one rate-limited
+        self._wake_next()
+        wait = anyio.current_time() - waiter.enqueued
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+
+    @asynccontextmanager
+    async def slot(
+        self, tokens: int = 0, *, priority: int = 0, tenant: Hashable = None
+    ) -> AsyncIterator[None]:
+        """`acquire()` and `release()` around a block."""
+        await self.acquire(tokens, priority=priority, tenant=tenant)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        """Free the slot of a request that has completed."""
+        self.active -= 1
+        self._dispatch()
+        self._wake_next()
+
+    def _next(self) -> _Waiter:
+        return min(
+            self._waiters,
+            key=lambda w: (-w.priority, self._served[w.tenant], w.seq),
+        )
+
+    def _wake_next(self) -> None:
+        # So that it waits for the rate limit window if that is what holds it back
+        if self._waiters:
+            self._next().event.set()
+
+    def _dispatch(self) -> float | None:
+        """Admit waiting requests in order while the limits allow.
+
+        Returns the seconds until the rate limits could admit the next one, or None."""
+        now = anyio.current_time()
+        while self._admitted and self._admitted[0][0] <= now - self.window:
+            self._window_tokens -= self._admitted.popleft()[1]
+        while self._waiters:
+            if self.max_concurrency is not None and self.active >= self.max_concurrency:
+                return None
+            waiter = self._next()
+            delay = self._rate_delay(waiter.tokens, now)
+            if delay:
+                return delay
+            self._waiters.remove(waiter)
+            self.active += 1
+            self.stats.admitted += 1
+            self._served[waiter.tenant] += max(waiter.tokens, 1)
+            if (
+                self.requests_per_minute is not None
+                or self.tokens_per_minute is not None
+            ):
+                self._admitted.append((now, waiter.tokens))
+                self._window_tokens += waiter.tokens
+            waiter.admitted = True
+            waiter.event.set()
+        self._served.clear()
+        return None
+
+    def _rate_delay(self, tokens: int, now: float) -> float:
+        admitted = self._admitted
+        if (
+            self.requests_per_minute is not None
+            and len(admitted) >= self.requests_per_minute
+        ):
+            return max(admitted[0][0] + self.window - now, 1e-3)
+        if (
+            self.tokens_per_minute is not None
+            and admitted
+            and self._window_tokens + tokens > self.tokens_per_minute
+        ):
+            excess = self._window_tokens + tokens - self.tokens_per_minute
+            for admitted_at, admitted_tokens in admitted:
+                excess -= admitted_tokens
+                if excess <= 0:
+                    return max(admitted_at + self.window - now, 1e-3)
+            # Larger than the limit itself: wait for the window to empty
+            return max(admitted[-1][0] + self.window - now, 1e-3)
+        return 0.0
@@ -0,0 +1,252 @@
+"""Compile JSON schemas of tool parameters into fast validation functions.
+
+Covers the subset of JSON Schema used in function definitions: `type`, `enum`,
+`const`, `properties`, `required`, `additionalProperties`, `items`, the length,
+size and range bounds, and `anyOf` / `oneOf` / `allOf`. Other keywords (`$ref`,
+`format`, `pattern`, ...) are accepted without being checked, so a schema never
+rejects arguments it does not understand.
+"""
+
+from typing import Any, Callable
+
+# Appends "<path>: <message>" strings to the error list for each problem found
+Validator = Callable[[Any, str, list[str]], None]
+
+_PLAIN_TYPES: dict[str, type | tuple[type, ...]] = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _type_check(type_names: list[str]) -> Callable[[Any], bool] | None:
+    """A predicate for a list of JSON types, using one isinstance call where possible."""
+    plain = tuple(_PLAIN_TYPES[t] for t in type_names if t in _PLAIN_TYPES)
+    number = "number" in type_names
+    integer = "integer" in type_names and not number
+    if not plain and not number and not integer:
+        return None
+    if not number and not integer:
+        return lambda v: isinstance(v, plain)
+
+    def check(v):
+        if isinstance(v, plain):
+            return True
+        if isinstance(v, bool):
+            return False
+        if isinstance(v, int):
+            return True
+        return isinstance(v, float) and (number or v.is_integer())
+
+    return check
+
+
+def compile_schema(schema: Any) -> Callable[[Any], list[str]]:
+    """Compile a schema once; the returned function lists the errors of a value."""
+    validator = _compile(schema)
+
+    def validate(value: Any) -> list[str]:
+        errors: list[str] = []
+        validator(value, "$", errors)
+        return errors
+
+    return validate
+
+
+def _noop(value: Any, path: str, errors: list[str]) -> None:
+    return None
+
+
+def _compile(schema: Any) -> Validator:
+    if schema is False:
+        return lambda value, path, errors: errors.append(f"{path}: not allowed")
+    if not isinstance(schema, dict) or not schema:
+        return _noop
+
+    checks: list[Validator] = []
+
+    types = schema.get("type")
+    if types is not None:
+        type_names = [types] if isinstance(types, str) else list(types)
+        if schema.get("nullable"):
+            type_names.append("null")
+        type_check = _type_check(type_names)
+        if type_check is not None:
+            expected = " or ".join(type_names)
+
+            def check_type(value, path, errors):
+                if not type_check(value):
+                    errors.append(f"{path}: expected {expected}")
+
+            checks.append(check_type)
+
+    if "enum" in schema:
+        options = schema["enum"]
+
+        def check_enum(value, path, errors):
+            if value not in options:
+                errors.append(f"{path}: must be one of {options!r}")
+
+        checks.append(check_enum)
+
+    if "const" in schema:
+        constant = schema["const"]
+
+        def check_const(value, path, errors):
+            if value != constant:
+                errors.append(f"{path}: must be {constant!r}")
+
+        checks.append(check_const)
+
+    checks.extend(_compile_object(schema))
+    checks.extend(_compile_array(schema))
+    checks.extend(_compile_bounds(schema))
+    checks.extend(_compile_combinators(schema))
+
+    if not checks:
+        return _noop
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate_all(value, path, errors):
+        for check in checks:
+            check(value, path, errors)
+
+    return validate_all
+
+
+def _compile_object(schema: dict) -> list[Validator]:
+    checks: list[Validator] = []
+    properties = {
+        name: _compile(sub) for name, sub in (schema.get("properties") or {}).items()
+    }
+    required = list(schema.get("required") or [])
+    additional = schema.get("additionalProperties", True)
+    additional_check = None if additional is True else _compile(additional)
+
+    if properties or additional_check is not None:
+
+        def check_properties(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name, item in value.items():
+                check = properties.get(name)
+                if check is not None:
+                    check(item, f"{path}.{name}", errors)
+                elif additional is False:
+                    errors.append(f"{path}: unexpected property {name!r}")
+                elif additional_check is not None:
+                    additional_check(item, f"{path}.{name}", errors)
+
+        checks.append(check_properties)
+
+    if required:
+
+        def check_required(value, path, errors):
+            if isinstance(value, dict):
+                for name in required:
+                    if name not in value:
+                        errors.append(f"{path}: missing required property {name!r}")
+
+        checks.append(check_required)
+    return checks
+
+
+def _compile_array(schema: dict) -> list[Validator]:
+    checks: list[Validator] = []
+    if isinstance(schema.get("items"), dict):
+        item_check = _compile(schema["items"])
+        if item_check is not _noop:
+
+            def check_items(value, path, errors):
+                if isinstance(value, list):
+                    for i, item in enumerate(value):
+                        item_check(item, f"{path}[{i}]", errors)
+
+            checks.append(check_items)
+    return checks
+
+
+def _compile_bounds(schema: dict) -> list[Validator]:
+    checks: list[Validator] = []
+    sized = (
+        ("minLength", "maxLength", str),
+        ("minItems", "maxItems", list),
+        ("minProperties", "maxProperties", dict),
+    )
+    for min_key, max_key, kind in sized:
+        low, high = schema.get(min_key), schema.get(max_key)
+        if low is not None or high is not None:
+            checks.append(_size_check(low, high, kind))
+
+    bounds = [
+        bound
+        if isinstance(bound, (int, float)) and not isinstance(bound, bool)
+        else None
+        for bound in (
+            schema.get("minimum"),
+            schema.get("maximum"),
+            schema.get("exclusiveMinimum"),
+            schema.get("exclusiveMaximum"),
+        )
+    ]
+    if any(bound is not None for bound in bounds):
+        checks.append(_range_check(*bounds))
+    return checks
+
+
+def _range_check(
+    minimum: float | None,
+    maximum: float | None,
+    exclusive_minimum: float | None,
+    exclusive_maximum: float | None,
+) -> Validator:
+    def check_range(value, path, errors):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return
+        if minimum is not None and value < minimum:
+            errors.append(f"{path}: less than {minimum}")
+        if maximum is not None and value > maximum:
+            errors.append(f"{path}: greater than {maximum}")
+        if exclusive_minimum is not None and value <= exclusive_minimum:
+            errors.append(f"{path}: not greater than {exclusive_minimum}")
+        if exclusive_maximum is not None and value >= exclusive_maximum:
+            errors.append(f"{path}: not less than {exclusive_maximum}")
+
+    return check_range
+
+
+def _size_check(low: int | None, high: int | None, kind: type) -> Validator:
+    def check_size(value, path, errors):
+        if isinstance(value, kind):
+            if low is not None and len(value) < low:
+                errors.append(f"{path}: shorter than {low}")
+            if high is not None and len(value) > high:
+                errors.append(f"{path}: longer than {high}")
+
+    return check_size
+
+
+def _compile_combinators(schema: dict) -> list[Validator]:
+    checks: list[Validator] = []
+    for sub in schema.get("allOf") or []:
+        checks.append(_compile(sub))
+    for key in ("anyOf", "oneOf"):
+        options = [_compile(sub) for sub in schema.get(key) or []]
+        if not options:
+            continue
+
+        def check_options(value, path, errors, options=options, key=key):
+            matches = 0
+            for option in options:
+                option_errors: list[str] = []
+                option(value, path, option_errors)
+                if not option_errors:
+                    matches += 1
+            if matches == 0 or (key == "oneOf" and matches > 1):
+                errors.append(f"{path}: does not match {key}")
+
+        checks.append(check_options)
+    return checks
@@ -0,0 +1,326 @@
+"""OpenAI-compatible proxy server that adds tool use to any upstream.
+
+Non-Python services can point their OpenAI SDK at this server instead of the
+upstream. Requests to `/v1/chat/completions` are transformed with a
+`Transformation` (Hermes by default), forwarded through one pooled keep-alive
+`AsyncOpenAI` client per worker, and the JSON or SSE response is transformed back.
+"""
+
+import asyncio
+import inspect
+import json
+import multiprocessing
+import signal
+import socket
+from typing import Any
+
+import openai
+from openai import AsyncOpenAI
+from openai.resources.chat.completions import AsyncCompletions
+
+from tooluser._http import (
+    ChunkedResponse,
+    HttpError,
+    HttpRequest,
+    read_request,
+    sse_event,
+    write_error,
+    write_json,
+)
+from tooluser.tool_user import DISCONNECT_ERRORS, StreamTimeoutError, make_tool_user
+from tooluser.transform import Transformation
+
+# Body fields that map onto keyword arguments of `create()`, everything else
+# is forwarded untouched through `extra_body`.
+_CREATE_PARAMS = frozenset(inspect.signature(AsyncCompletions.create).parameters) - {
+    "self",
+    "extra_headers",
+    "extra_query",
+    "extra_body",
+    "timeout",
+}
+# Request headers forwarded to the upstream
+_FORWARDED_HEADERS = ("authorization", "openai-organization", "openai-project")
+
+
+class ToolUserServer:
+    """Serve `/v1/chat/completions` on top of an upstream OpenAI-compatible API.
+
+    Args:
+        upstream: Base URL of the upstream API, e.g. `https://openrouter.ai/api/v1`.
+        api_key: API key used when the incoming request has no `Authorization` header.
+        transformation: The transformation to apply. Default to HermesTransformation.
+        enable_raw_json_detection: Whether to detect raw JSON without <tool_call> tag. Default to True.
+        timeout: Upstream request timeout in seconds.
+        max_body_size: Largest request body accepted, in bytes. Larger ones get a 413.
+        **options: Further options of ToolUser, e.g. `stream_idle_timeout`.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        api_key: str | None = None,
+        transformation: Transformation | None = None,
+        enable_raw_json_detection: bool = True,
+        timeout: float = 600.0,
+        *,
+        max_body_size: int | None = 32 * 1024 * 1024,
+        **options: Any,
+    ):
+        self.upstream = upstream
+        self.api_key = api_key
+        self.transformation = transformation
+        self.enable_raw_json_detection = enable_raw_json_detection
+        self.timeout = timeout
+        self.max_body_size = max_body_size
+        self.options = options
+        self._client: AsyncOpenAI | None = None
+        self._server: asyncio.Server | None = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        # Created lazily so that each worker process owns its own connection pool
+        if self._client is None:
+            self._client = make_tool_user(
+                AsyncOpenAI(
+                    base_url=self.upstream,
+                    api_key=self.api_key or "tooluser",
+                    timeout=self.timeout,
+                    max_retries=0,
+                ),
+                transformation=self.transformation,
+                enable_raw_json_detection=self.enable_raw_json_detection,
+                **self.options,
+            )
+        return self._client
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            raise RuntimeError("ToolUserServer is not started")
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0, sock: socket.socket | None = None
+    ) -> asyncio.Server:
+        if sock is not None:
+            self._server = await asyncio.start_server(self.handle, sock=sock)
+        else:
+            self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_size)
+                    if request is None:
+                        break
+                    await self._dispatch(request, writer)
+                except HttpError as e:
+                    await write_error(writer, e.status, e.message, keep_alive=False)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    await write_error(
+                        writer, 500, f"{type(e).__name__}: {e}", keep_alive=False
+                    )
+                    break
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        if request.method == "GET" and request.path in ("/health", "/v1/health"):
+            await write_json(writer, 200, {"status": "ok"}, request.keep_alive)
+        elif request.method == "POST" and request.path in (
+            "/v1/chat/completions",
+            "/chat/completions",
+        ):
+            await self._chat_completions(request, writer)
+        else:
+            raise HttpError(404, f"No route for {request.method} {request.path}")
+
+    async def _chat_completions(
+        self, request: HttpRequest, writer: asyncio.StreamWriter
+    ) -> None:
+        body = request.json()
+        if not isinstance(body, dict):
+            raise HttpError(400, "Request body must be a JSON object")
+        for field in ("messages", "tools"):
+            items = body.get(field)
+            if items is not None and not (
+                isinstance(items, list) and all(isinstance(i, dict) for i in items)
+            ):
+                raise HttpError(400, f"'{field}' must be a list of JSON objects")
+        kwargs: dict[str, Any] = {k: v for k, v in body.items() if k in _CREATE_PARAMS}
+        extra_body = {k: v for k, v in body.items() if k not in _CREATE_PARAMS}
+        if extra_body:
+            kwargs["extra_body"] = extra_body
+        headers = {
+            name: request.headers[name]
+            for name in _FORWARDED_HEADERS
+            if name in request.headers
+        }
+        if headers:
+            kwargs["extra_headers"] = headers
+
+        try:
+            response = await self.client.chat.completions.create(**kwargs)
+        except openai.APIStatusError as e:
+            await _write_upstream_error(writer, e, request.keep_alive)
+            return
+        except openai.APIConnectionError as e:
+            await write_error(writer, 502, str(e), request.keep_alive)
+            return
+        except KeyError as e:
+            # A message or tool without a required field, e.g. "role"
+            await write_error(writer, 400, f"Missing field {e}", request.keep_alive)
+            return
+        except (TypeError, ValueError) as e:
+            await write_error(writer, 400, str(e), request.keep_alive)
+            return
+
+        if not body.get("stream"):
+            await write_json(
+                writer, 200, response.to_dict(mode="json"), request.keep_alive
+            )
+            return
+
+        sse = ChunkedResponse(writer, keep_alive=request.keep_alive)
+        await sse.start()
+        try:
+            async for chunk in response:
+                await sse.write(sse_event(chunk.to_json(indent=None)))
+        except (openai.APIError, *DISCONNECT_ERRORS) as e:
+            await sse.write(
+                sse_event(json.dumps({"error": {"message": str(e), "code": 502}}))
+            )
+        except StreamTimeoutError as e:
+            await sse.write(
+                sse_event(json.dumps({"error": {"message": str(e), "code": 504}}))
+            )
+        except ConnectionError:
+            # Our client went away
+            raise
+        except Exception as e:
+            # The response has started, so the error can only be reported as an event
+            message = f"{type(e).__name__}: {e}"
+            await sse.write(
+                sse_event(json.dumps({"error": {"message": message, "code": 500}}))
+            )
+        finally:
+            # Release the upstream connection when our client disconnects mid-stream
+            await response.close()
+        await sse.write(sse_event("[DONE]"))
+        await sse.end()
+
+
+async def _write_upstream_error(
+    writer: asyncio.StreamWriter, error: openai.APIStatusError, keep_alive: bool
+) -> None:
+    try:
+        body = error.response.json()
+    except ValueError:
+        body = {"error": {"message": error.message, "code": error.status_code}}
+    await write_json(writer, error.status_code, body, keep_alive)
+
+
+def _bind(host: str, port: int, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(
+        socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM
+    )
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+async def _serve_forever(
+    host: str, port: int, reuse_port: bool, options: dict[str, Any]
+) -> None:
+    server = ToolUserServer(**options)
+    try:
+        await server.start(sock=_bind(host, port, reuse_port))
+        assert server._server is not None
+        await server._server.serve_forever()
+    finally:
+        await server.close()
+
+
+def _worker_main(host: str, port: int, options: dict[str, Any]) -> None:
+    try:
+        asyncio.run(_serve_forever(host, port, True, options))
+    except KeyboardInterrupt:
+        pass
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(
+    upstream: str,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    workers: int = 1,
+    **options: Any,
+) -> None:
+    """Run the proxy server until interrupted.
+
+    With `workers > 1`, each worker is a separate process with its own event loop
+    and connection pool, all bound to the same port with `SO_REUSEPORT` so the
+    kernel balances incoming connections across them.
+
+    Args:
+        upstream: Base URL of the upstream API.
+        host: Interface to listen on.
+        port: Port to listen on.
+        workers: Number of worker processes.
+        **options: Forwarded to ToolUserServer.
+    """
+    options["upstream"] = upstream
+    if workers <= 1:
+        try:
+            asyncio.run(_serve_forever(host, port, False, options))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("Multiple workers require SO_REUSEPORT support")
+    processes = [
+        multiprocessing.Process(
+            target=_worker_main, args=(host, port, options), daemon=True
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Shut the workers down too when the supervisor is terminated
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
@@ -0,0 +1,156 @@
+"""Single-flight deduplication of identical in-flight requests.
+
+Concurrent requests with the same key share one upstream call, run in its own asyncio
+task: a waiter that is cancelled or stops reading leaves the others untouched, and the
+call is only cancelled once nobody waits for it anymore. Requires an asyncio event loop.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Generic, TypeVar
+
+_T = TypeVar("_T")
+
+
+class _Flight(Generic[_T]):
+    """One shared call, the items it has produced so far and the callers waiting on it."""
+
+    def __init__(self):
+        self.task: asyncio.Task | None = None
+        self.opened: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.items: list[_T] = []
+        self.changed = asyncio.Event()
+        self.done = False
+        self.error: BaseException | None = None
+        self.waiters = 0
+        # Set when the last waiter left: new requests must not join a cancelled call
+        self.abandoned = False
+
+    def leave(self) -> None:
+        self.waiters -= 1
+        if self.waiters == 0 and self.task is not None and not self.task.done():
+            self.abandoned = True
+            self.task.cancel()
+
+    def publish(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """Share one upstream call between concurrent identical requests.
+
+    Pass it as `ToolUser(client, single_flight=SingleFlight())`. Requests are identical
+    when their transformed parameters are (see `tooluser.cache.request_key`). Plain
+    callers each get a copy of the parsed `ChatCompletion`; stream callers each get
+    their own replay of the shared chunks, whose tool calls are parsed once.
+
+    Attributes:
+        calls: Number of upstream calls made.
+        joined: Number of requests that joined a call already in flight.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.joined = 0
+        self._flights: dict[str, _Flight] = {}
+
+    def _join(self, key: str, run: Callable[[_Flight], Awaitable[Any]]) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is None or flight.abandoned:
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+            flight.task = asyncio.ensure_future(run(flight))
+
+            def forget(_: asyncio.Task) -> None:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+            flight.task.add_done_callback(forget)
+        else:
+            self.joined += 1
+        flight.waiters += 1
+        return flight
+
+    async def call(self, key: str, fetch: Callable[[], Awaitable[_T]]) -> _T:
+        """The result of `fetch()`, shared with the concurrent calls of the same key."""
+
+        async def run(flight: _Flight) -> _T:
+            return await fetch()
+
+        flight = self._join(key, run)
+        try:
+            return await asyncio.shield(flight.task)  # type: ignore[arg-type]
+        finally:
+            flight.leave()
+
+    async def stream(
+        self, key: str, open_stream: Callable[[], Awaitable[Any]]
+    ) -> AsyncIterator[Any]:
+        """A replay of the stream of `open_stream()`, shared with the concurrent calls of the same key.
+
+        Returns once the shared stream is open, raising its error if it could not be opened.
+        Each item is yielded as a deep copy, so callers may modify what they receive."""
+
+        async def run(flight: _Flight) -> None:
+            try:
+                stream = await open_stream()
+            except asyncio.CancelledError:
+                flight.opened.cancel()
+                raise
+            except Exception as e:
+                flight.opened.set_exception(e)
+                return
+            flight.opened.set_result(None)
+            try:
+                async for item in stream:
+                    flight.items.append(item)
+                    flight.publish()
+            except Exception as e:
+                # Raised to every reader once it has replayed the items before it
+                flight.error = e
+            finally:
+                flight.done = True
+                flight.publish()
+                await stream.close()
+
+        flight = self._join(key, run)
+        try:
+            await asyncio.shield(flight.opened)
+        except BaseException:
+            flight.leave()
+            raise
+        return _Replay(flight)
+
+
+class _Replay:
+    """One reader of a shared stream. Closing it, or cancelling a read, leaves the flight."""
+
+    def __init__(self, flight: _Flight):
+        self._flight = flight
+        self._next = 0
+        self._left = False
+
+    def __aiter__(self) -> "_Replay":
+        return self
+
+    async def __anext__(self) -> Any:
+        flight = self._flight
+        try:
+            while self._next == len(flight.items):
+                if flight.done or self._left:
+                    await self.aclose()
+                    if flight.error is not None:
+                        raise flight.error
+                    raise StopAsyncIteration
+                await flight.changed.wait()
+        except asyncio.CancelledError:
+            await self.aclose()
+            raise
+        item = flight.items[self._next]
+        self._next += 1
+        return item.model_copy(deep=True)
+
+    async def aclose(self) -> None:
+        if not self._left:
+            self._left = True
+            self._flight.leave()
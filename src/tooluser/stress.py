@@ -0,0 +1,339 @@
+"""Stress harness for the streaming path of `make_tool_user`.
+
+A local fake upstream (`tooluser.testing.FakeUpstream`, in its own process by
+default) streams scripted replies at a configurable token rate, with a given share
+of replies ending in tool calls. For each concurrency level, the same streams are
+run through the native client (the baseline) and through the ToolUser wrapper, and
+the harness reports throughput, the latency the wrapper adds, event loop lag, CPU
+time per stream and resident memory.
+
+    tooluser stress --concurrency 100,500,1000 --streams 2000 --token-rate 50
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from openai import APIError, AsyncOpenAI
+
+from tooluser.testing import FakeUpstream
+from tooluser.tool_user import ToolUser
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "read_file",
+            "description": "Read a file of the repository",
+            "parameters": {
+                "type": "object",
+                "properties": {"path": {"type": "string"}},
+                "required": ["path"],
+            },
+        },
+    }
+]
+MESSAGES = [{"role": "user", "content": "Look at the sources and explain them."}]
+_WORDS = (
+    "the",
+    "model",
+    "reads",
+    "each",
+    "file",
+    "and",
+    "explains",
+    "what",
+    "it",
+    "does",
+)
+
+
+class ReplyMix:
+    """Content factory for FakeUpstream: `tool_call_ratio` of the replies end with tool calls.
+
+    Replies have `reply_tokens` words of text; the mix is spread evenly over the
+    requests rather than drawn at random, so runs are reproducible."""
+
+    def __init__(self, reply_tokens: int, tool_call_ratio: float, tool_calls: int):
+        self.text = " ".join(_WORDS[i % len(_WORDS)] for i in range(reply_tokens))
+        self.tool_call_ratio = tool_call_ratio
+        self.tool_calls = "".join(
+            "\n<tool_call>\n"
+            + json.dumps(
+                {"name": "read_file", "arguments": {"path": f"src/module_{i}.py"}}
+            )
+            + "\n</tool_call>"
+            for i in range(tool_calls)
+        )
+        self.count = 0
+
+    def __call__(self, body: dict) -> str:
+        self.count += 1
+        # Bresenham-style: the number of tool replies so far tracks count * ratio
+        if int(self.count * self.tool_call_ratio) > int(
+            (self.count - 1) * self.tool_call_ratio
+        ):
+            return self.text + self.tool_calls
+        return self.text
+
+
+@dataclass
+class StressResult:
+    """Measurements of one concurrency level."""
+
+    concurrency: int
+    streams: int
+    errors: int
+    streams_per_s: float
+    chunks_per_s: float
+    p50_added_ms: float
+    p99_added_ms: float
+    loop_lag_p99_ms: float
+    loop_lag_max_ms: float
+    cpu_ms_per_stream: float
+    rss_mb: float
+    rss_kb_per_stream: float
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process (peak size where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class _Monitor:
+    """Samples event loop lag and RSS while a level runs."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: list[float] = []
+        self.peak_rss = 0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+
+    def __enter__(self) -> "_Monitor":
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:  # noqa: PLR2004
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+@dataclass
+class _Run:
+    latencies: list[float]
+    chunks: int
+    errors: int
+    elapsed: float
+
+
+async def _run_streams(
+    client: AsyncOpenAI, tool_user: ToolUser | None, streams: int, concurrency: int
+) -> _Run:
+    """Run `streams` streams, `concurrency` at a time."""
+    run = _Run([], 0, 0, 0.0)
+    remaining = iter(range(streams))
+
+    async def one() -> None:
+        start = time.perf_counter()
+        try:
+            await consume()
+        except APIError:
+            # e.g. connect timeouts once the upstream's accept queue is full
+            run.errors += 1
+            return
+        run.latencies.append(time.perf_counter() - start)
+
+    async def consume() -> None:
+        if tool_user is None:
+            stream = await client.chat.completions.create(
+                model="fake",
+                messages=MESSAGES,  # type: ignore
+                stream=True,
+            )
+        else:
+            stream = await tool_user.chat.completions.create(
+                model="fake",
+                messages=MESSAGES,  # type: ignore
+                tools=TOOLS,  # type: ignore
+                stream=True,
+            )
+        async with stream:  # type: ignore
+            async for _ in stream:  # type: ignore
+                run.chunks += 1
+
+    async def worker() -> None:
+        for _ in remaining:
+            await one()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    run.elapsed = time.perf_counter() - start
+    return run
+
+
+async def run_level(base_url: str, concurrency: int, streams: int) -> StressResult:
+    """Measure one concurrency level against an upstream serving ReplyMix replies."""
+    client = AsyncOpenAI(base_url=base_url, api_key="stress", max_retries=0)
+    tool_user = ToolUser(client)
+    try:
+        direct = await _run_streams(client, None, streams, concurrency)
+        rss_before = rss_bytes()
+        cpu_before = time.process_time()
+        with _Monitor() as monitor:
+            wrapped = await _run_streams(client, tool_user, streams, concurrency)
+        cpu = time.process_time() - cpu_before
+    finally:
+        await client.close()
+    completed = len(wrapped.latencies)
+    return StressResult(
+        concurrency=concurrency,
+        streams=streams,
+        errors=wrapped.errors,
+        streams_per_s=round(completed / wrapped.elapsed, 1),
+        chunks_per_s=round(wrapped.chunks / wrapped.elapsed, 1),
+        p50_added_ms=round(
+            (_percentile(wrapped.latencies, 50) - _percentile(direct.latencies, 50))
+            * 1000,
+            2,
+        ),
+        p99_added_ms=round(
+            (_percentile(wrapped.latencies, 99) - _percentile(direct.latencies, 99))
+            * 1000,
+            2,
+        ),
+        loop_lag_p99_ms=round(_percentile(monitor.lags, 99) * 1000, 2),
+        loop_lag_max_ms=round(max(monitor.lags, default=0.0) * 1000, 2),
+        cpu_ms_per_stream=round(cpu / max(completed, 1) * 1000, 3),
+        rss_mb=round(max(monitor.peak_rss, rss_bytes()) / 2**20, 1),
+        rss_kb_per_stream=round(
+            max(0, monitor.peak_rss - rss_before) / concurrency / 1024, 2
+        ),
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _run_upstream(port: int, options: dict[str, Any]) -> None:
+    async def main() -> None:
+        upstream = await FakeUpstream(**options).start(port=port)
+        assert upstream._server is not None
+        await upstream._server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+async def _wait_ready(port: int) -> None:
+    for _ in range(200):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+async def stress(
+    concurrency: list[int],
+    streams: int,
+    *,
+    token_rate: float = 50.0,
+    chars_per_token: int = 4,
+    reply_tokens: int = 200,
+    tool_call_ratio: float = 0.5,
+    tool_calls: int = 1,
+    upstream_process: bool = True,
+) -> list[StressResult]:
+    """Ramp through the concurrency levels and measure each one.
+
+    Args:
+        concurrency: Concurrency levels, run in order.
+        streams: Streams per level and path; raised to the concurrency if lower.
+        token_rate: Tokens per second of each upstream stream, one token per chunk. 0 for no delay.
+        chars_per_token: Characters per streamed chunk.
+        reply_tokens: Words of text in each reply.
+        tool_call_ratio: Share of the replies that end with tool calls.
+        tool_calls: Number of tool calls in those replies.
+        upstream_process: Run the fake upstream in its own process, so its CPU use is not
+            counted as the wrapper's. Otherwise it shares this event loop.
+    """
+    options = {
+        "content": ReplyMix(reply_tokens, tool_call_ratio, tool_calls),
+        "chunk_size": chars_per_token,
+        "chunk_delay": 1 / token_rate if token_rate else 0.0,
+    }
+    results = []
+    if not upstream_process:
+        async with FakeUpstream(**options) as upstream:  # type: ignore
+            for level in concurrency:
+                results.append(
+                    await run_level(upstream.base_url, level, max(streams, level))
+                )
+        return results
+
+    port = _free_port()
+    process = multiprocessing.Process(
+        target=_run_upstream, args=(port, options), daemon=True
+    )
+    process.start()
+    try:
+        await _wait_ready(port)
+        for level in concurrency:
+            results.append(
+                await run_level(
+                    f"http://127.0.0.1:{port}/v1", level, max(streams, level)
+                )
+            )
+    finally:
+        process.terminate()
+        process.join()
+    return results
+
+
+def format_results(results: list[StressResult]) -> str:
+    """The results as a markdown table."""
+    columns = list(StressResult.__dataclass_fields__)
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "|" + "|".join("-" * (len(column) + 2) for column in columns) + "|",
+    ]
+    for result in results:
+        values = asdict(result)
+        lines.append("| " + " | ".join(str(values[c]) for c in columns) + " |")
+    return "\n".join(lines)
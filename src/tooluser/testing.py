@@ -0,0 +1,258 @@
+"""A local OpenAI-compatible fake upstream for tests, benchmarks and load tests.
+
+It answers `/v1/chat/completions` with a scripted assistant reply, either as one
+JSON `ChatCompletion` or as a server-sent event stream of `ChatCompletionChunk`s,
+ending with a usage chunk when `stream_options` asks for it.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable
+
+from tooluser._http import (
+    ChunkedResponse,
+    HttpError,
+    HttpRequest,
+    read_request,
+    sse_event,
+    write_error,
+    write_json,
+)
+
+ContentFactory = Callable[[dict], str]
+_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+class FakeUpstream:
+    """Serve scripted chat completions on a local port.
+
+    Args:
+        content: The assistant reply, or a callable computing it from the request body.
+        chunk_size: Number of characters per streamed chunk.
+        chunk_delay: Seconds to wait between streamed chunks.
+        latency: Seconds to wait before the response (or first chunk) is sent, or a callable computing it from the request body.
+        stall_after: Stop sending a stream, keeping the connection open, after this many chunks.
+        drop_after: Reset the connection of a stream after this many chunks, or a callable computing it (or None) from the request body.
+        model: The model name reported in responses.
+        max_concurrent_requests: Answer 429 to requests beyond this many in progress.
+        requests_per_minute: Answer 429 to requests beyond this many per `rate_window` seconds.
+        rate_window: Length of the `requests_per_minute` window in seconds.
+    """
+
+    def __init__(
+        self,
+        content: str | ContentFactory = "Hello from the fake upstream.",
+        *,
+        chunk_size: int = 8,
+        chunk_delay: float = 0.0,
+        latency: float | Callable[[dict], float] = 0.0,
+        stall_after: int | None = None,
+        drop_after: int | Callable[[dict], int | None] | None = None,
+        model: str = "fake-model",
+        max_concurrent_requests: int | None = None,
+        requests_per_minute: int | None = None,
+        rate_window: float = 60.0,
+    ):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.latency = latency
+        self.stall_after = stall_after
+        self.drop_after = drop_after
+        self.model = model
+        self.max_concurrent_requests = max_concurrent_requests
+        self.requests_per_minute = requests_per_minute
+        self.rate_window = rate_window
+        self.requests: list[dict] = []
+        self.rejected = 0
+        self.active_requests = 0
+        self.peak_requests = 0
+        self._accepted_at: deque[float] = deque()
+        self.open_connections = 0
+        self.total_connections = 0
+        self._server: asyncio.Server | None = None
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            raise RuntimeError("FakeUpstream is not started")
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeUpstream":
+        # A deep accept backlog, for load tests opening thousands of connections at once
+        self._server = await asyncio.start_server(
+            self._handle, host, port, backlog=4096
+        )
+        return self
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def __aenter__(self) -> "FakeUpstream":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def reply_for(self, body: dict) -> str:
+        if callable(self.content):
+            return self.content(body)
+        return self.content
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.open_connections += 1
+        self.total_connections += 1
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HttpError as e:
+                    await write_error(writer, e.status, e.message, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                await self._respond(request, reader, writer)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+    async def _respond(
+        self,
+        request: HttpRequest,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        if request.method != "POST" or not request.path.endswith("/chat/completions"):
+            await write_error(writer, 404, f"No route for {request.path}")
+            return
+        body = request.json()
+        if self._over_limit():
+            self.rejected += 1
+            await write_error(writer, 429, "Rate limit exceeded")
+            return
+        self.requests.append(body)
+        self.active_requests += 1
+        self.peak_requests = max(self.peak_requests, self.active_requests)
+        try:
+            content = self.reply_for(body)
+            latency = self.latency(body) if callable(self.latency) else self.latency
+            if latency:
+                await asyncio.sleep(latency)
+            if body.get("stream"):
+                await self._respond_stream(
+                    body, content, reader, writer, request.keep_alive
+                )
+            else:
+                await write_json(
+                    writer,
+                    200,
+                    self._completion(body, content),
+                    keep_alive=request.keep_alive,
+                )
+        finally:
+            self.active_requests -= 1
+
+    def _over_limit(self) -> bool:
+        if (
+            self.max_concurrent_requests is not None
+            and self.active_requests >= self.max_concurrent_requests
+        ):
+            return True
+        if self.requests_per_minute is not None:
+            now = time.monotonic()
+            while self._accepted_at and self._accepted_at[0] <= now - self.rate_window:
+                self._accepted_at.popleft()
+            if len(self._accepted_at) >= self.requests_per_minute:
+                return True
+            self._accepted_at.append(now)
+        return False
+
+    async def _respond_stream(
+        self,
+        body: dict,
+        content: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        keep_alive: bool,
+    ) -> None:
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        drop_after = (
+            self.drop_after(body) if callable(self.drop_after) else self.drop_after
+        )
+        response = ChunkedResponse(writer, keep_alive=keep_alive)
+        await response.start()
+        for n, i in enumerate(range(0, len(content), self.chunk_size)):
+            if n == self.stall_after:
+                # Like a hung upstream: the client only notices when it gives up
+                await reader.read()
+                return
+            if n == drop_after:
+                # Like a connection reset in the middle of the body
+                writer.transport.abort()
+                return
+            if i and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            await response.write(
+                sse_event(
+                    json.dumps(
+                        self._chunk(
+                            body,
+                            completion_id,
+                            {"content": content[i : i + self.chunk_size]},
+                            None,
+                        )
+                    )
+                )
+            )
+        await response.write(
+            sse_event(json.dumps(self._chunk(body, completion_id, {}, "stop")))
+        )
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = self._chunk(body, completion_id, {}, None)
+            usage_chunk["choices"] = []
+            usage_chunk["usage"] = _USAGE
+            await response.write(sse_event(json.dumps(usage_chunk)))
+        await response.write(sse_event("[DONE]"))
+        await response.end()
+
+    def _completion(self, body: dict, content: str) -> dict[str, Any]:
+        return {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", self.model),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": _USAGE,
+        }
+
+    def _chunk(
+        self, body: dict, completion_id: str, delta: dict, finish_reason: str | None
+    ) -> dict[str, Any]:
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", self.model),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
@@ -1,26 +1,111 @@
-from functools import wraps
+import inspect
+import json
+from contextlib import nullcontext
+from functools import partial, wraps
 from typing import (
+    Any,
     AsyncIterable,
     AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Literal,
+    Sequence,
+    TypeVar,
 )
 
-from openai import AsyncOpenAI
-from openai._streaming import AsyncStream
+import anyio
+from openai import APIConnectionError, APIError, AsyncOpenAI
+from openai._response import async_to_streamed_response_wrapper
+from openai._streaming import AsyncStream, ServerSentEvent
 from openai.resources.chat.completions import AsyncCompletions
+from openai.types.chat import (
+    ChatCompletionMessage,
+    ChatCompletionMessageToolCall,
+    ChatCompletionToolChoiceOptionParam,
+    ChatCompletionToolParam,
+)
 from openai.types.chat.chat_completion import ChatCompletion
-from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import (
+    ChatCompletionChunk,
+    Choice,
+    ChoiceDelta,
+    ChoiceDeltaToolCall,
+)
 from typing_extensions import Self
 
-from tooluser.hermes_transform import HermesTransformation
-from tooluser.transform import StreamProcessor, Transformation
+from tooluser.cache import ResponseCache, request_key
+from tooluser.catalog import InvalidToolCall, ToolCatalog
+from tooluser.events import (
+    Finish,
+    ReasoningDelta,
+    StreamEvent,
+    TextDelta,
+    ToolCallArgsDelta,
+    ToolCallEnd,
+    ToolCallStart,
+)
+from tooluser.hedging import Hedging
+from tooluser.hermes_transform import (
+    HermesStreamProcessor,
+    HermesTransformation,
+    chosen_function,
+)
+from tooluser.scheduler import Scheduler
+from tooluser.single_flight import SingleFlight
+from tooluser.transform import (
+    PromptOverhead,
+    ReasoningText,
+    RepairOffload,
+    StreamOutputType,
+    StreamProcessor,
+    Tokenizer,
+    Transformation,
+    approximate_tokens,
+    aresolve_outputs,
+    content_text,
+)
+
+
+class StreamTimeoutError(TimeoutError):
+    """Raised by a wrapped stream when the upstream stalls.
+
+    Attributes:
+        kind: "idle" when no chunk arrived within `stream_idle_timeout`, "deadline" when the
+            whole stream took longer than `stream_deadline`.
+        timeout: The limit that expired, in seconds.
+    """
+
+    def __init__(self, kind: Literal["idle", "deadline"], timeout: float):
+        self.kind = kind
+        self.timeout = timeout
+        if kind == "idle":
+            message = f"No chunk received from the upstream for {timeout}s"
+        else:
+            message = f"Stream did not complete within its {timeout}s deadline"
+        super().__init__(message)
 
 
 class _AsyncStreamLike(AsyncStream[ChatCompletionChunk]):
-    """Wrapper that provides the same interface as OpenAI's AsyncStream"""
+    """Wrapper that provides the same interface as OpenAI's AsyncStream
 
-    def __init__(self, stream: AsyncIterable[ChatCompletionChunk]):
+    Closing it (`close()`, `aclose()` or leaving `async with`) closes the wrapped
+    generator and then the upstream stream, releasing its pooled connection at once."""
+
+    def __init__(
+        self,
+        stream: AsyncIterable[ChatCompletionChunk],
+        upstream: AsyncIterable[ChatCompletionChunk] | None = None,
+        on_close: Callable[[], None] | None = None,
+    ):
         # Store the wrapped stream
         self._iterator = aiter(stream)
+        self._upstream = upstream
+        self._on_close = on_close
+        if hasattr(upstream, "response"):
+            self.response = upstream.response  # type: ignore
 
     async def __anext__(self) -> ChatCompletionChunk:
         return await self._iterator.__anext__()
@@ -33,90 +118,925 @@ class _AsyncStreamLike(AsyncStream[ChatCompletionChunk]):
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        return None
+        await self.close()
 
+    async def close(self) -> None:
+        """Stop the stream and release the upstream connection. Safe to call twice."""
+        aclose = getattr(self._iterator, "aclose", None)
+        try:
+            if aclose is not None:
+                await aclose()
+        finally:
+            if self._upstream is not None:
+                await _close_stream(self._upstream)
+            if self._on_close is not None:
+                self._on_close()
 
-def make_tool_user(
-    client: AsyncOpenAI,
-    transformation: Transformation | None = None,
-    enable_raw_json_detection: bool = True,
-):
-    """This function is a wrapper around the AsyncOpenAI client that adds tool use support.
-    It replaces the chat.completions.create method with a new method that applies the transformation to the messages and tools.
+    async def aclose(self) -> None:
+        """Alias for `close()`."""
+        await self.close()
 
-    Args:
-        client: The AsyncOpenAI client to wrap.
-        transformation: The transformation to apply to the messages and tools. Default to HermesTransformation.
-        enable_raw_json_detection: Whether to detect raw JSON without <tool_call> tag at the end of the response. Default to True.
-    """
-    if transformation is None:
-        transformation = HermesTransformation(
-            enable_raw_json_detection=enable_raw_json_detection
+
+async def _close_stream(stream: AsyncIterable[Any]) -> None:
+    """Close an upstream stream, be it an AsyncStream or a plain async generator."""
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close is not None:
+        await close()
+
+
+try:
+    import httpx
+
+    DISCONNECT_ERRORS: tuple[type[Exception], ...] = (
+        APIConnectionError,
+        httpx.TransportError,
+    )
+except ImportError:
+    # openai releases built on httpx2 wrap transport errors in APIConnectionError
+    DISCONNECT_ERRORS = (APIConnectionError,)
+"""The errors an upstream stream raises when its connection drops mid-stream."""
+
+_T = TypeVar("_T")
+
+
+def _accepts_overhead(transformation: Transformation) -> bool:
+    """Whether a custom transformation's trans_param_messages takes `overhead`, which the
+    Transformation protocol does not require."""
+    try:
+        parameters = inspect.signature(transformation.trans_param_messages).parameters
+    except (TypeError, ValueError):
+        return False
+    return "overhead" in parameters or any(
+        p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters.values()
+    )
+
+
+def _once(func: Callable[[], None]) -> Callable[[], None]:
+    """A wrapper of `func` that only calls it the first time."""
+    called = False
+
+    def call() -> None:
+        nonlocal called
+        if not called:
+            called = True
+            func()
+
+    return call
+
+
+def _estimate_tokens(kwargs: dict[str, Any], tokenizer: Tokenizer) -> int:
+    """Tokens of a prepared request for rate limiting: its messages plus the completion budget."""
+    tokens = 0
+    for message in kwargs.get("messages", ()):
+        content = (
+            message.get("content")
+            if isinstance(message, dict)
+            else getattr(message, "content", None)
         )
+        tokens += tokenizer(content_text(content))
+    budget = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens")
+    return tokens + (budget if isinstance(budget, int) else 0)
 
-    class ProxyAsyncCompletions(AsyncCompletions):
-        def __init__(self, client):
-            # Copy all attributes from the parent AsyncCompletions instance
-            self._client = client
-            super().__init__(client)
-
-        @wraps(AsyncCompletions.create)
-        async def create(self, *args, **kwargs) -> ChatCompletion | _AsyncStreamLike:
-            messages = kwargs.get("messages", [])
-            tools = kwargs.pop("tools", [])
-            stream = kwargs.get("stream", False)
-            if tools:
-                kwargs["messages"] = transformation.trans_param_messages(
-                    messages, tools
-                )
-            if not stream:
-                response: ChatCompletion = await super().create(*args, **kwargs)
-                for choice in response.choices:
-                    choice.message = transformation.trans_completion_message(
-                        choice.message
+
+async def _timed_chunks(
+    stream: AsyncIterable[_T],
+    idle_timeout: float | None,
+    deadline: float | None,
+    deadline_at: float,
+) -> AsyncIterator[_T]:
+    """Iterate over a stream, raising StreamTimeoutError when the upstream stalls."""
+    iterator = aiter(stream)
+    while True:
+        timeout, kind = idle_timeout, "idle"
+        if deadline is not None:
+            remaining = deadline_at - anyio.current_time()
+            if remaining <= 0:
+                raise StreamTimeoutError("deadline", deadline)
+            if timeout is None or remaining < timeout:
+                timeout, kind = remaining, "deadline"
+        try:
+            with anyio.fail_after(timeout):
+                chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        except TimeoutError as e:
+            raise StreamTimeoutError(  # type: ignore[arg-type]
+                kind, timeout if kind == "idle" else deadline
+            ) from e
+        yield chunk
+
+
+async def _replay_chunks(chunks: list[dict]) -> AsyncIterator[ChatCompletionChunk]:
+    """Replay the chunks of a cached stream."""
+    for chunk in chunks:
+        yield ChatCompletionChunk.model_validate(chunk)
+
+
+async def _open_stream(
+    create: Callable[[], Awaitable[AsyncIterable[_T]]],
+) -> tuple[AsyncIterable[_T], _T | None]:
+    """Open a stream and wait for its first chunk, closing it if that is cancelled."""
+    stream = await create()
+    try:
+        first = await aiter(stream).__anext__()
+    except StopAsyncIteration:
+        return stream, None
+    except BaseException:
+        with anyio.CancelScope(shield=True):
+            await _close_stream(stream)
+        raise
+    return stream, first
+
+
+async def _in_slot(
+    scheduler: Scheduler,
+    tokens: int,
+    priority: int,
+    tenant: Hashable,
+    fetch: Callable[[], Awaitable[_T]],
+) -> _T:
+    """`fetch()` in a scheduler slot of its own, released once it returns."""
+    async with scheduler.slot(tokens, priority=priority, tenant=tenant):
+        return await fetch()
+
+
+async def _prepend_chunk(
+    first: _T | None, stream: AsyncIterable[_T]
+) -> AsyncIterator[_T]:
+    try:
+        if first is not None:
+            yield first
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await _close_stream(stream)
+
+
+async def _resumed_chunks(
+    stream: AsyncIterable[ChatCompletionChunk],
+    resume: Callable[[str], Awaitable[AsyncIterable[ChatCompletionChunk]]],
+    attempts: int,
+    text: str = "",
+) -> AsyncIterator[ChatCompletionChunk]:
+    """The chunks of `stream`, continued when a connection error cuts it off by the stream
+    `resume` opens for the text received so far, after the prefill `text`."""
+    try:
+        while True:
+            try:
+                async for chunk in stream:
+                    for choice in chunk.choices:
+                        if (
+                            choice.index
+                            or choice.delta.tool_calls
+                            or choice.finish_reason
+                        ):
+                            # Only the text of a single, unfinished reply can be continued
+                            attempts = 0
+                        elif choice.delta.content:
+                            text += choice.delta.content
+                    yield chunk
+                return
+            except DISCONNECT_ERRORS:
+                if attempts <= 0:
+                    raise
+                attempts -= 1
+                await _close_stream(stream)
+                stream = await resume(text)
+    finally:
+        await _close_stream(stream)
+
+
+def _chosen_tools(
+    tools: list[ChatCompletionToolParam],
+    tool_choice: ChatCompletionToolChoiceOptionParam | None,
+) -> list[ChatCompletionToolParam]:
+    """The tools the model may call under `tool_choice`."""
+    name = chosen_function(tool_choice)
+    if name is None:
+        return tools
+    chosen = [tool for tool in tools if tool["function"]["name"] == name]
+    if not chosen:
+        raise ValueError(f"tool_choice names a function that is not in tools: {name}")
+    return chosen
+
+
+def _native_call_events(
+    idx: int, tool_calls: list[dict] | None, calls: dict[int, str]
+) -> Iterator[StreamEvent]:
+    """Events of the native tool call deltas of one chunk; `calls` maps their index to id."""
+    for tool_call in tool_calls or ():
+        function = tool_call.get("function") or {}
+        call_index = tool_call.get("index", 0)
+        call_id = calls.get(call_index)
+        if call_id is None:
+            call_id = calls[call_index] = tool_call.get("id") or ""
+            yield ToolCallStart(idx, call_id, function.get("name") or "")
+        if function.get("arguments"):
+            yield ToolCallArgsDelta(idx, call_id, function["arguments"])
+
+
+class ProxyAsyncCompletions(AsyncCompletions):
+    """`chat.completions` resource that applies a ToolUser's transformation around `create()`.
+
+    It only holds references to the client and the ToolUser, so it shares the
+    client's HTTP connection pool and is cheap to create."""
+
+    def __init__(self, client: AsyncOpenAI, tool_user: "ToolUser"):
+        super().__init__(client)
+        self._tool_user = tool_user
+
+    def _prepare(
+        self, kwargs: dict[str, Any]
+    ) -> tuple[ToolCatalog | None, str, int | None]:
+        """Move the tools of the request parameters into the messages.
+
+        Returns the catalog of the tools when the parsed tool calls are validated or raw
+        JSON calls are detected, which then only accepts the names of these tools, the
+        text the assistant reply is prefilled with ("" if it is not), and the UTF-8 bytes
+        that the deduplication of tool results saved (None if it is off)."""
+        tool_user = self._tool_user
+        transformation = tool_user.transformation
+        messages = kwargs.get("messages", [])
+        tools = kwargs.pop("tools", [])
+        if not tools:
+            return None, "", None
+        # Honored in the prompt, the upstream does not see the tools
+        tool_choice = kwargs.pop("tool_choice", None)
+        parallel_tool_calls = kwargs.pop("parallel_tool_calls", None)
+        tools = _chosen_tools(tools, tool_choice)
+        catalog = None
+        if tool_user.on_invalid_arguments is not None or (
+            isinstance(transformation, HermesTransformation)
+            and transformation.enable_raw_json_detection
+        ):
+            catalog = ToolCatalog.of(tools)
+        dedup = (
+            isinstance(transformation, HermesTransformation)
+            and transformation.dedup_tool_results is not None
+        )
+        overhead = None
+        if tool_user.on_overhead is not None or dedup:
+            # Without a hook to report to, only the dedup savings are counted
+            overhead = PromptOverhead(
+                tokenizer=tool_user.tokenizer,
+                model=kwargs.get("model"),
+                breakdown=tool_user.on_overhead is not None,
+            )
+        prefill = ""
+        accounted = overhead is not None
+        if isinstance(transformation, HermesTransformation):
+            prefill = transformation.tool_choice_prefill(tool_choice)
+            kwargs["messages"] = transformation.trans_param_messages(
+                messages,
+                tools,
+                overhead=overhead,
+                tool_choice=tool_choice,
+                parallel_tool_calls=parallel_tool_calls,
+            )
+            extra_body: dict[str, Any] = {}
+            if tool_choice != "none":
+                extra_body.update(transformation.guided_constraint(tools))
+            if prefill:
+                extra_body.update(transformation.prefill_fields())
+            if extra_body:
+                kwargs["extra_body"] = {
+                    **(kwargs.get("extra_body") or {}),
+                    **extra_body,
+                }
+        elif overhead is not None and _accepts_overhead(transformation):
+            kwargs["messages"] = transformation.trans_param_messages(  # type: ignore[call-arg]
+                messages, tools, overhead=overhead
+            )
+        else:
+            # Nothing to report from a transformation that does not account for its prompt
+            accounted = False
+            kwargs["messages"] = transformation.trans_param_messages(messages, tools)
+        if accounted and tool_user.on_overhead is not None:
+            tool_user.on_overhead(overhead)
+        return catalog, prefill, overhead.dedup_saved_bytes if dedup else None  # type: ignore[union-attr]
+
+    @wraps(AsyncCompletions.create)
+    async def create(
+        self, *args, **kwargs
+    ) -> ChatCompletion | AsyncStream[ChatCompletionChunk]:
+        tool_user = self._tool_user
+        # Scheduling options of the ToolUser, not sent upstream
+        priority = kwargs.pop("priority", 0)
+        tenant = kwargs.pop("tenant", None)
+        transform = bool(kwargs.get("tools"))
+        if not transform and tool_user.passthrough:
+            kwargs.pop("tools", None)
+            # Nothing to transform: the SDK's own response or stream, untouched
+            return await AsyncCompletions.create(self, *args, **kwargs)
+        catalog, prefill, dedup_saved_bytes = self._prepare(kwargs)
+        single_flight = tool_user.single_flight
+        key = ""
+        if tool_user.cache is not None or single_flight is not None:
+            key = request_key(kwargs)
+        fetch = partial(
+            self._create,
+            args,
+            kwargs,
+            catalog,
+            key,
+            transform=transform,
+            prefill=prefill,
+            dedup_saved_bytes=dedup_saved_bytes,
+            priority=priority,
+            tenant=tenant,
+        )
+        if single_flight is None:
+            return await fetch()
+        if kwargs.get("stream", False):
+            return _AsyncStreamLike(await single_flight.stream(key, fetch))
+        response = await single_flight.call(key, fetch)
+        return response.model_copy(deep=True)  # type: ignore[union-attr]
+
+    async def _create(
+        self,
+        args: tuple,
+        kwargs: dict[str, Any],
+        catalog: ToolCatalog | None,
+        key: str,
+        *,
+        transform: bool = True,
+        prefill: str = "",
+        dedup_saved_bytes: int | None = None,
+        priority: int = 0,
+        tenant: Hashable = None,
+    ) -> ChatCompletion | _AsyncStreamLike:
+        """Send a prepared request and transform its response, or replay it from the cache."""
+        tool_user = self._tool_user
+        stream = kwargs.get("stream", False)
+        cache = tool_user.cache
+        cached = await cache.aget(key) if cache is not None else None
+        scheduler = tool_user.scheduler
+        release: Callable[[], None] | None = None
+        if scheduler is not None and cached is None:
+            await scheduler.acquire(
+                _estimate_tokens(kwargs, tool_user.tokenizer),
+                priority=priority,
+                tenant=tenant,
+            )
+            release = _once(scheduler.release)
+        if not stream:
+            if cached is not None:
+                response = ChatCompletion.model_validate(cached)
+            else:
+                try:
+                    response = await self._send(args, kwargs, priority, tenant)
+                finally:
+                    if release is not None:
+                        release()
+                if cache is not None:
+                    # Stored before the transformation, so a hit is parsed like a fresh reply
+                    await cache.aset(
+                        key, response.model_dump(mode="json", exclude_unset=True)
                     )
-                return response
+            for choice in response.choices if transform else ():
+                choice.message = await self._trans_message(
+                    choice.message, catalog, prefill
+                )
+                if catalog is not None and choice.message.tool_calls:
+                    self._check_arguments(catalog, choice.message.tool_calls)
+            if dedup_saved_bytes is not None and response.usage is not None:
+                # Not a field of CompletionUsage: kept as an extra
+                response.usage.dedup_saved_bytes = dedup_saved_bytes  # type: ignore[attr-defined]
+            return response
+        else:
+            started_at = anyio.current_time()
+            response_stream: AsyncIterable[ChatCompletionChunk]
+            if cached is not None:
+                response_stream = _replay_chunks(cached)
             else:
-                response_stream: AsyncIterable[
-                    ChatCompletionChunk
-                ] = await super().create(*args, **kwargs)  # type: ignore
+                try:
+                    response_stream = await self._send(args, kwargs, priority, tenant)
+                except BaseException:
+                    if release is not None:
+                        release()
+                    raise
+                transformation = tool_user.transformation
+                if (
+                    tool_user.stream_resumes
+                    and isinstance(transformation, HermesTransformation)
+                    and transformation.prefill is not None
+                ):
+                    response_stream = _resumed_chunks(
+                        response_stream,
+                        partial(
+                            self._resume,
+                            transformation,
+                            args,
+                            kwargs,
+                            prefill,
+                            priority=priority,
+                            tenant=tenant,
+                        ),
+                        tool_user.stream_resumes,
+                        prefill,
+                    )
+            # The upstream chunks of a fresh stream, stored once it completes
+            recorded: list[dict] | None = (
+                [] if cache is not None and cached is None else None
+            )
 
-                async def _wrapped():
-                    processors: dict[int, StreamProcessor] = {}
-                    async for chunk in response_stream:
+            chunks = response_stream
+            idle_timeout = tool_user.stream_idle_timeout
+            deadline = tool_user.stream_deadline
+            if idle_timeout is not None or deadline is not None:
+                chunks = _timed_chunks(
+                    response_stream,
+                    idle_timeout,
+                    deadline,
+                    started_at + (deadline or 0),
+                )
+
+            async def _wrapped():
+                processors: dict[int, StreamProcessor] = {}
+                finished: set[int] = set()
+                last_chunk = None
+                try:
+                    async for chunk in chunks:
+                        last_chunk = chunk
+                        if recorded is not None:
+                            recorded.append(
+                                chunk.model_dump(mode="json", exclude_unset=True)
+                            )
+                        if not transform:
+                            finished.update(
+                                idx
+                                for idx, choice in enumerate(chunk.choices)
+                                if choice.finish_reason is not None
+                            )
+                            yield chunk
+                            continue
+                        if not chunk.choices:
+                            # The usage chunk of `stream_options={"include_usage": True}`
+                            if chunk.usage is not None:
+                                if dedup_saved_bytes is not None:
+                                    chunk.usage.dedup_saved_bytes = dedup_saved_bytes  # type: ignore[attr-defined]
+                                yield chunk
+                            continue
                         for idx, choice in enumerate(chunk.choices):
                             if idx not in processors:
-                                processors[idx] = (
-                                    transformation.create_stream_processor()
+                                processors[idx] = self._new_processor(catalog, prefill)
+                            native_tool_calls = choice.delta.tool_calls
+                            if choice.finish_reason is not None:
+                                # Flush the held-back buffer even if the final chunk has no content
+                                finished.add(idx)
+                                choice.delta = await self._trans_delta(
+                                    processors[idx], choice.delta, finalize=True
+                                )
+                            elif choice.delta.content is not None:
+                                choice.delta = await self._trans_delta(
+                                    processors[idx], choice.delta
                                 )
-                            if choice.delta.content is not None:
-                                if choice.finish_reason is None:
-                                    choice.delta = (
-                                        transformation.trans_completion_message_stream(
-                                            processors[idx], delta=choice.delta
-                                        )
-                                    )
-                                else:
-                                    choice.delta = (
-                                        transformation.trans_completion_message_stream(
-                                            processors[idx],
-                                            delta=choice.delta,
-                                            finalize=True,
-                                        )
-                                    )
+                            if (
+                                catalog is not None
+                                and choice.delta.tool_calls
+                                and choice.delta.tool_calls is not native_tool_calls
+                            ):
+                                self._check_arguments(catalog, choice.delta.tool_calls)
                         for choice in chunk.choices:
                             # Omit empty chunk
                             if (
                                 (choice.finish_reason is None)
                                 and (not choice.delta.content)
                                 and (not choice.delta.tool_calls)
+                                and (
+                                    not getattr(choice.delta, "reasoning_content", None)
+                                )
                             ):
                                 pass
                             else:
                                 yield chunk
                                 break
+                    if (
+                        cache is not None
+                        and recorded is not None
+                        and finished
+                        and finished >= processors.keys()
+                    ):
+                        await cache.aset(key, recorded)
+                except StreamTimeoutError:
+                    # Hand over what was received before the upstream stalled
+                    if last_chunk is not None:
+                        interrupted = self._interrupt(
+                            last_chunk,
+                            {
+                                idx: processor
+                                for idx, processor in processors.items()
+                                if idx not in finished
+                            },
+                            catalog,
+                        )
+                        if interrupted is not None:
+                            yield interrupted
+                    raise
+                finally:
+                    # Also reached on cancellation and when the consumer stops early
+                    if chunks is not response_stream:
+                        await chunks.aclose()  # type: ignore[attr-defined]
+                    await _close_stream(response_stream)
+                    if release is not None:
+                        release()
+
+            return _AsyncStreamLike(_wrapped(), response_stream, on_close=release)
+
+    async def _resume(
+        self,
+        transformation: HermesTransformation,
+        args: tuple,
+        kwargs: dict[str, Any],
+        prefill: str,
+        text: str,
+        *,
+        priority: int = 0,
+        tenant: Hashable = None,
+    ) -> Any:
+        """Send a streamed request again, for the reply to continue from `text`."""
+        if not text:
+            return await self._send(args, kwargs, priority, tenant)
+        messages = list(kwargs["messages"])
+        if prefill:
+            # The text received so far starts with the prefill
+            messages.pop()
+        messages.append(transformation.prefill_message(text))
+        resumed = {**kwargs, "messages": messages}
+        fields = transformation.prefill_fields()
+        if fields:
+            resumed["extra_body"] = {**(kwargs.get("extra_body") or {}), **fields}
+        return await self._send(args, resumed, priority, tenant)
+
+    async def _send(
+        self,
+        args: tuple,
+        kwargs: dict[str, Any],
+        priority: int = 0,
+        tenant: Hashable = None,
+    ) -> Any:
+        """Send a prepared request upstream, hedged if enabled.
+
+        The caller holds the scheduler slot of the request. A hedged duplicate takes
+        another one while it is in flight, so it counts against the limits too."""
+        tool_user = self._tool_user
+        hedging = tool_user.hedging
+        if hedging is None:
+            return await AsyncCompletions.create(self, *args, **kwargs)
+        backup_kwargs = kwargs
+        if hedging.model is not None:
+            backup_kwargs = {**kwargs, "model": hedging.model}
+        backup_completions = (
+            self if hedging.client is None else AsyncCompletions(hedging.client)
+        )
+        primary: Callable[[], Awaitable[Any]] = partial(
+            AsyncCompletions.create, self, *args, **kwargs
+        )
+        backup: Callable[[], Awaitable[Any]] = partial(
+            AsyncCompletions.create, backup_completions, *args, **backup_kwargs
+        )
+        stream = kwargs.get("stream", False)
+        if stream:
+            # A stream answers with its first chunk
+            primary = partial(_open_stream, primary)
+            backup = partial(_open_stream, backup)
+        if tool_user.scheduler is not None:
+            # Released once the race is decided: the loser is cancelled, and the
+            # winner goes on in the slot of the request
+            backup = partial(
+                _in_slot,
+                tool_user.scheduler,
+                _estimate_tokens(backup_kwargs, tool_user.tokenizer),
+                priority,
+                tenant,
+                backup,
+            )
+        if not stream:
+            return await hedging.race(primary, backup)
+        opened, first = await hedging.race(
+            primary,
+            backup,
+            discard=lambda opened: _close_stream(opened[0]),
+        )
+        return _prepend_chunk(first, opened)
+
+    async def stream_events(self, *args, **kwargs) -> AsyncIterator[StreamEvent]:
+        """Stream a completion as lightweight events instead of `ChatCompletionChunk`s.
+
+        Takes the arguments of `create()` (`stream` is implied). The upstream's server-sent
+        events are decoded with `json.loads` and fed to the stream processor directly, so
+        no pydantic object is built per chunk. Close the generator (e.g. with
+        `contextlib.aclosing`) when you stop reading early, to release the connection.
+        """
+        tool_user = self._tool_user
+        offload = tool_user.repair_offload
+        priority = kwargs.pop("priority", 0)
+        tenant = kwargs.pop("tenant", None)
+        catalog, prefill, _ = self._prepare(kwargs)
+        kwargs["stream"] = True
+        started_at = anyio.current_time()
+        request = async_to_streamed_response_wrapper(
+            partial(AsyncCompletions.create, self)
+        )
+        scheduler = tool_user.scheduler
+        slot = (
+            scheduler.slot(
+                _estimate_tokens(kwargs, tool_user.tokenizer),
+                priority=priority,
+                tenant=tenant,
+            )
+            if scheduler is not None
+            else nullcontext()
+        )
+        async with slot, request(*args, **kwargs) as response:
+            decoder = self._client._make_sse_decoder()
+            events: AsyncIterable[ServerSentEvent] = decoder.aiter_bytes(
+                response.http_response.aiter_bytes()
+            )
+            idle_timeout = tool_user.stream_idle_timeout
+            deadline = tool_user.stream_deadline
+            if idle_timeout is not None or deadline is not None:
+                events = _timed_chunks(
+                    events, idle_timeout, deadline, started_at + (deadline or 0)
+                )
+            processors: dict[int, StreamProcessor] = {}
+            # Native tool calls of the upstream that are not ended yet, per choice
+            native_calls: dict[int, dict[int, str]] = {}
+            try:
+                async for sse in events:
+                    if sse.data.startswith("[DONE]"):
+                        break
+                    data = json.loads(sse.data)
+                    if data.get("error"):
+                        raise APIError(
+                            message=data["error"].get("message", "An error occurred"),
+                            request=response.http_response.request,
+                            body=data["error"],
+                        )
+                    for choice in data.get("choices") or ():
+                        idx = choice.get("index", 0)
+                        processor = processors.get(idx)
+                        if processor is None:
+                            processor = processors[idx] = self._new_processor(
+                                catalog, prefill
+                            )
+                            if offload is not None and isinstance(
+                                processor, HermesStreamProcessor
+                            ):
+                                processor.offload_size = offload.min_size
+                        delta = choice.get("delta") or {}
+                        reasoning = delta.get("reasoning_content")
+                        if reasoning:
+                            yield ReasoningDelta(idx, reasoning)
+                        content = delta.get("content")
+                        outputs = processor.process(content) if content else []
+                        finish_reason = choice.get("finish_reason")
+                        if finish_reason is not None:
+                            outputs.extend(processor.finalize())
+                        if offload is not None:
+                            outputs = await aresolve_outputs(outputs, offload)
+                        for event in self._output_events(idx, outputs, catalog):
+                            yield event
+                        calls = native_calls.setdefault(idx, {})
+                        for event in _native_call_events(
+                            idx, delta.get("tool_calls"), calls
+                        ):
+                            yield event
+                        if finish_reason is not None:
+                            for call_id in calls.values():
+                                yield ToolCallEnd(idx, call_id)
+                            calls.clear()
+                            del processors[idx]
+                            yield Finish(idx, finish_reason)
+            except StreamTimeoutError:
+                # Hand over what was received before the upstream stalled
+                for idx, processor in processors.items():
+                    if isinstance(processor, HermesStreamProcessor):
+                        processor.truncated = True
+                    for event in self._output_events(
+                        idx, processor.finalize(), catalog
+                    ):
+                        yield event
+                raise
+            finally:
+                aclose = getattr(events, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+    def _new_processor(
+        self, catalog: ToolCatalog | None, prefill: str = ""
+    ) -> StreamProcessor:
+        transformation = self._tool_user.transformation
+        if isinstance(transformation, HermesTransformation):
+            processor = transformation.create_stream_processor(catalog)
+            # The prefill opens a tool call, so it yields no output of its own
+            processor.process(prefill)
+            return processor
+        return transformation.create_stream_processor()
+
+    async def _trans_message(
+        self,
+        message: ChatCompletionMessage,
+        catalog: ToolCatalog | None,
+        prefill: str = "",
+    ) -> ChatCompletionMessage:
+        transformation = self._tool_user.transformation
+        offload = self._tool_user.repair_offload
+        if isinstance(transformation, HermesTransformation):
+            if prefill:
+                # The upstream returns what follows the prefill
+                message.content = prefill + (message.content or "")
+            if offload is not None:
+                return await transformation.atrans_completion_message(
+                    message, offload, catalog
+                )
+            return transformation.trans_completion_message(message, catalog)
+        return transformation.trans_completion_message(message)
+
+    async def _trans_delta(
+        self, processor: StreamProcessor, delta: ChoiceDelta, finalize: bool = False
+    ) -> ChoiceDelta:
+        transformation = self._tool_user.transformation
+        offload = self._tool_user.repair_offload
+        if offload is not None and isinstance(transformation, HermesTransformation):
+            return await transformation.atrans_completion_message_stream(
+                processor, delta, offload, finalize=finalize
+            )
+        return transformation.trans_completion_message_stream(
+            processor, delta=delta, finalize=finalize
+        )
 
-                return _AsyncStreamLike(_wrapped())
+    def _output_events(
+        self,
+        idx: int,
+        outputs: Iterable[StreamOutputType],
+        catalog: ToolCatalog | None,
+    ) -> Iterator[StreamEvent]:
+        for output in outputs:
+            if isinstance(output, ReasoningText):
+                yield ReasoningDelta(idx, output)
+                continue
+            if isinstance(output, str):
+                if output:
+                    yield TextDelta(idx, output)
+                continue
+            function = output.function
+            if catalog is not None:
+                self._check_arguments(catalog, [output])
+            yield ToolCallStart(idx, output.id, function.name)
+            yield ToolCallArgsDelta(idx, output.id, function.arguments)
+            yield ToolCallEnd(idx, output.id)
 
-    client.chat.completions = ProxyAsyncCompletions(client=client)  # type: ignore
+    def _interrupt(
+        self,
+        last_chunk: ChatCompletionChunk,
+        processors: dict[int, StreamProcessor],
+        catalog: ToolCatalog | None,
+    ) -> ChatCompletionChunk | None:
+        """Finalize the processors of a stream that stopped early, as one last chunk.
+
+        Unfinished tool calls are returned as text rather than repaired into calls."""
+        transformation = self._tool_user.transformation
+        choices = []
+        for idx, processor in processors.items():
+            if isinstance(processor, HermesStreamProcessor):
+                processor.truncated = True
+            delta = transformation.trans_completion_message_stream(
+                processor, delta=ChoiceDelta(), finalize=True
+            )
+            if delta.content or delta.tool_calls:
+                if catalog is not None and delta.tool_calls:
+                    self._check_arguments(catalog, delta.tool_calls)
+                choices.append(Choice(index=idx, delta=delta, finish_reason=None))
+        if not choices:
+            return None
+        return last_chunk.model_copy(update={"choices": choices, "usage": None})
+
+    def _check_arguments(
+        self,
+        catalog: ToolCatalog,
+        tool_calls: Sequence[ChatCompletionMessageToolCall | ChoiceDeltaToolCall],
+    ) -> None:
+        on_invalid_arguments = self._tool_user.on_invalid_arguments
+        if on_invalid_arguments is None:
+            return
+        for tool_call in tool_calls:
+            if tool_call.function is None:
+                continue
+            invalid = catalog.validate(
+                tool_call.id or "",
+                tool_call.function.name or "",
+                tool_call.function.arguments or "",
+            )
+            if invalid is not None:
+                on_invalid_arguments(invalid)
+
+
+class _ToolUserChat:
+    def __init__(self, completions: ProxyAsyncCompletions):
+        self.completions = completions
+
+
+class ToolUser:
+    """A tool-use view of an AsyncOpenAI client that leaves the client untouched.
+
+    `tool_user.chat.completions.create(...)` behaves like the one patched in by
+    `make_tool_user`, while `client.chat.completions` keeps the native behaviour.
+    Requests from both paths go through the client's single HTTP connection pool,
+    and a ToolUser is cheap enough to create per request or per tenant with its own
+    transformation settings.
+
+    Args:
+        client: The AsyncOpenAI client whose connection pool is used.
+        transformation: The transformation to apply to the messages and tools. Default to HermesTransformation.
+        enable_raw_json_detection: Whether to detect raw JSON without <tool_call> tag at the end of the response. Default to True.
+        on_overhead: Called with a PromptOverhead report for every request with tools, to account for the prompt text added by the transformation.
+        tokenizer: Counts the tokens of a text for the overhead report. Default to about 4 characters per token.
+        on_invalid_arguments: Enables validation of parsed tool call arguments against the `parameters` schema of the request's tools, and is called with an InvalidToolCall for each call that fails. Validators are compiled once per tool catalog and cached.
+        stream_idle_timeout: Seconds to wait for each upstream chunk of a stream. Default to no limit.
+        stream_deadline: Seconds a whole stream may take, counted from the request. Default to no limit.
+            When either expires, the text and tool calls received so far are emitted, the upstream is closed and StreamTimeoutError is raised.
+        repair_offload: Where to parse large tool call blocks that need `json_repair`, which can take seconds, so they do not block the event loop. Default to a worker thread for blocks of 64 KiB or more. None parses everything inline.
+        cache: A ResponseCache to answer repeated identical requests of `create()` from, streamed or not. Only complete responses are stored. `stream_events()` always calls the upstream.
+        single_flight: A SingleFlight to share one upstream call between concurrent identical requests of `create()`. Needs asyncio.
+        scheduler: A Scheduler to queue upstream requests within concurrency and rate limits. `create()` and `stream_events()` then take `priority` and `tenant` keyword arguments.
+        hedging: A Hedging policy to send a duplicate of the requests of `create()` that are slow to answer, and keep the first reply.
+        stream_resumes: How many times a stream of `create()` cut off by a connection error is resumed: the request is sent again with the text received so far as an assistant prefix, and the new stream continues the same one. Needs a HermesTransformation with `prefill` set, as the upstream must support prefix completion. Default to 0.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        transformation: Transformation | None = None,
+        enable_raw_json_detection: bool = True,
+        *,
+        on_overhead: Callable[[PromptOverhead], Any] | None = None,
+        tokenizer: Tokenizer = approximate_tokens,
+        on_invalid_arguments: Callable[[InvalidToolCall], Any] | None = None,
+        stream_idle_timeout: float | None = None,
+        stream_deadline: float | None = None,
+        repair_offload: RepairOffload | None = RepairOffload(),  # noqa: B008
+        cache: ResponseCache | None = None,
+        single_flight: SingleFlight | None = None,
+        scheduler: Scheduler | None = None,
+        hedging: Hedging | None = None,
+        stream_resumes: int = 0,
+    ):
+        if transformation is None:
+            transformation = HermesTransformation(
+                enable_raw_json_detection=enable_raw_json_detection
+            )
+        self.client = client
+        self.transformation = transformation
+        self.on_overhead = on_overhead
+        self.tokenizer = tokenizer
+        self.on_invalid_arguments = on_invalid_arguments
+        self.stream_idle_timeout = stream_idle_timeout
+        self.stream_deadline = stream_deadline
+        self.repair_offload = repair_offload
+        self.cache = cache
+        self.single_flight = single_flight
+        self.scheduler = scheduler
+        self.hedging = hedging
+        self.stream_resumes = stream_resumes
+        self.chat = _ToolUserChat(ProxyAsyncCompletions(client, self))
+
+    @property
+    def passthrough(self) -> bool:
+        """Whether requests without tools go straight to the client, their response or
+        stream returned as the SDK built it: no option that applies to them is set."""
+        return (
+            self.cache is None
+            and self.single_flight is None
+            and self.scheduler is None
+            and self.hedging is None
+            and self.stream_idle_timeout is None
+            and self.stream_deadline is None
+            and not self.stream_resumes
+        )
+
+
+def make_tool_user(
+    client: AsyncOpenAI,
+    transformation: Transformation | None = None,
+    enable_raw_json_detection: bool = True,
+    **options: Any,
+):
+    """This function is a wrapper around the AsyncOpenAI client that adds tool use support.
+    It replaces the chat.completions.create method with a new method that applies the transformation to the messages and tools.
+    Use `ToolUser` instead to keep the client's native `chat.completions` available.
+
+    Args:
+        client: The AsyncOpenAI client to wrap.
+        transformation: The transformation to apply to the messages and tools. Default to HermesTransformation.
+        enable_raw_json_detection: Whether to detect raw JSON without <tool_call> tag at the end of the response. Default to True.
+        **options: Further options of ToolUser, e.g. `on_overhead`.
+    """
+    tool_user = ToolUser(
+        client,
+        transformation=transformation,
+        enable_raw_json_detection=enable_raw_json_detection,
+        **options,
+    )
+    client.chat.completions = tool_user.chat.completions  # type: ignore
     return client
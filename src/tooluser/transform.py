@@ -1,5 +1,11 @@
-from typing import Iterable, Protocol, Sequence, Union
+import asyncio
+import json
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Iterable, Protocol, Sequence, Union
 
+import anyio
 from openai.types.chat import (
     ChatCompletionMessage,
     ChatCompletionMessageParam,
@@ -9,6 +15,184 @@ from openai.types.chat.chat_completion_chunk import ChoiceDelta
 from openai.types.shared_params.function_definition import FunctionDefinition
 
 StreamOutputType = Union[str, ChatCompletionMessageToolCall]
+Tokenizer = Callable[[str], int]
+
+
+class ReasoningText(str):
+    """Text of a reasoning block (e.g. `<think>...</think>`), as split out by a stream
+    processor. It goes to `reasoning_content` instead of `content`."""
+
+    __slots__ = ()
+
+
+class PendingToolCalls:
+    """Stands for a tool call block whose parsing a stream processor deferred.
+
+    Emitted in place of the tool calls, so the order of the outputs is kept while
+    the parsing runs elsewhere. `resolve()` gives what the processor would have
+    emitted inline: the tool calls, or the block as text if it is not a tool call.
+    `parse` is sent to the executor, so it must be picklable for a process pool;
+    `on_parsed` is called in the caller's process once the block parsed into calls."""
+
+    __slots__ = ("on_parsed", "parse", "text")
+
+    def __init__(
+        self,
+        parse: Callable[[str], Sequence[StreamOutputType]],
+        text: str,
+        on_parsed: Callable[[], None] | None = None,
+    ):
+        self.parse = parse
+        self.text = text
+        self.on_parsed = on_parsed
+
+    def resolve(self) -> list[StreamOutputType]:
+        return self._outputs(_parse_pending(self.parse, self.text))
+
+    async def aresolve(self, offload: "RepairOffload") -> list[StreamOutputType]:
+        """`resolve()`, with the parsing run by `offload`."""
+        return self._outputs(
+            await offload.run(partial(_parse_pending, self.parse, self.text))
+        )
+
+    def _outputs(self, calls: list[StreamOutputType] | None) -> list[StreamOutputType]:
+        if calls is None:
+            return [self.text]
+        if self.on_parsed is not None:
+            self.on_parsed()
+        return calls
+
+
+def _parse_pending(
+    parse: Callable[[str], Sequence[StreamOutputType]], text: str
+) -> list[StreamOutputType] | None:
+    """The outputs of `parse`, or None if the text is not a tool call."""
+    try:
+        return list(parse(text))
+    except Exception:
+        return None
+
+
+@dataclass(frozen=True)
+class RepairOffload:
+    """Policy for parsing tool call blocks that need repair off the event loop.
+
+    Blocks shorter than `min_size` characters, and blocks that are valid JSON, are
+    parsed inline. Larger blocks that need `json_repair` are parsed in `executor`,
+    or in a worker thread when it is None. A `ProcessPoolExecutor` keeps the repair
+    from holding the GIL of the event loop's process."""
+
+    min_size: int = 64 * 1024
+    executor: Executor | None = None
+
+    async def run(self, func: Callable[[], Any]) -> Any:
+        if self.executor is None:
+            return await anyio.to_thread.run_sync(func)
+        future = self.executor.submit(func)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on asyncio (e.g. trio): wait for the future in a worker thread
+            return await anyio.to_thread.run_sync(future.result)
+        # Awaited on the loop, so no worker thread is held while the executor works
+        return await asyncio.wrap_future(future)
+
+
+def resolve_outputs(outputs: Sequence[Any]) -> list[StreamOutputType]:
+    """Parse deferred tool calls inline."""
+    resolved: list[StreamOutputType] = []
+    for output in outputs:
+        if isinstance(output, PendingToolCalls):
+            resolved.extend(output.resolve())
+        else:
+            resolved.append(output)
+    return resolved
+
+
+async def aresolve_outputs(
+    outputs: Sequence[Any], offload: RepairOffload
+) -> list[StreamOutputType]:
+    """Parse deferred tool calls with the offload policy, keeping the output order."""
+    if not any(isinstance(output, PendingToolCalls) for output in outputs):
+        return list(outputs)
+    resolved: list[StreamOutputType] = []
+    for output in outputs:
+        if isinstance(output, PendingToolCalls):
+            resolved.extend(await output.aresolve(offload))
+        else:
+            resolved.append(output)
+    return resolved
+
+
+def repair_loads(text: str) -> Any:
+    """`json.loads`, falling back to json_repair for malformed JSON.
+
+    json_repair is imported on the first repair, so well-formed output never loads it."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        from json_repair import repair_json
+
+        return repair_json(text, return_objects=True)
+
+
+def approximate_tokens(text: str) -> int:
+    """Rough token estimate (about 4 characters per token), used when no tokenizer is given."""
+    return (len(text) + 3) // 4
+
+
+def content_text(content: Any) -> str:
+    """Text of a message content, whether it is a string, None or a list of content parts."""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content)
+
+
+@dataclass
+class PromptOverhead:
+    """How much prompt text a transformation adds to one request.
+
+    Pass an instance to `trans_param_messages` to have it filled in. Characters and
+    estimated tokens are broken down into the injected tool catalog prompt and the
+    serialized tool calls and tool results of the history, and compared with the
+    caller's original messages. `dedup_saved_bytes` is what the deduplication of
+    repeated tool results left out, in UTF-8 bytes. With `breakdown=False` only
+    `dedup_saved_bytes` is counted, and the tokenizer is never run.
+    """
+
+    tokenizer: Tokenizer = approximate_tokens
+    model: str | None = None
+    original_chars: int = 0
+    original_tokens: int = 0
+    transformed_chars: int = 0
+    transformed_tokens: int = 0
+    catalog_chars: int = 0
+    catalog_tokens: int = 0
+    tool_calls_chars: int = 0
+    tool_calls_tokens: int = 0
+    tool_results_chars: int = 0
+    tool_results_tokens: int = 0
+    dedup_saved_bytes: int = 0
+    breakdown: bool = True
+
+    def record(self, part: str, text: str) -> None:
+        """Add text to one of `original`, `transformed`, `catalog`, `tool_calls` or `tool_results`."""
+        setattr(self, f"{part}_chars", getattr(self, f"{part}_chars") + len(text))
+        setattr(
+            self,
+            f"{part}_tokens",
+            getattr(self, f"{part}_tokens") + self.tokenizer(text),
+        )
+
+    @property
+    def added_chars(self) -> int:
+        return self.transformed_chars - self.original_chars
+
+    @property
+    def added_tokens(self) -> int:
+        return self.transformed_tokens - self.original_tokens
 
 
 class StreamProcessor(Protocol):
@@ -0,0 +1,177 @@
+import threading
+
+import pytest
+from openai import AsyncOpenAI
+
+from tooluser import ResponseCache, ToolUser
+from tooluser.cache import request_key
+from tooluser.testing import FakeUpstream
+
+TOOLS = [{"type": "function", "function": {"name": "get_time"}}]
+MESSAGES = [{"role": "user", "content": "What's the time in Paris?"}]
+REPLY = (
+    "Let me check.\n"
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>'
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_request_key_is_canonical():
+    """Test that the key ignores parameter order and transport options"""
+    params = {"model": "m", "messages": MESSAGES, "temperature": 0}
+
+    assert request_key(params) == request_key(dict(reversed(params.items())))
+    assert request_key(params) == request_key({**params, "timeout": 30})
+    assert request_key(params) != request_key({**params, "temperature": 1})
+
+
+def test_memory_cache_lru_and_counters():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", {"n": 1})
+    cache.set("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}
+    cache.set("c", {"n": 3})
+
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == {"n": 3}
+    assert len(cache) == 2  # noqa: PLR2004
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_cache_byte_limit():
+    cache = ResponseCache(max_bytes=15)
+    cache.set("a", "x" * 8)
+    cache.set("b", "y" * 8)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 8
+
+
+@pytest.mark.parametrize("sqlite", [False, True])
+def test_cache_ttl(monkeypatch, tmp_path, sqlite):
+    now = [1000.0]
+    monkeypatch.setattr("tooluser.cache.time.time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "cache.db") if sqlite else None, ttl=60)
+    cache.set("a", [1, 2])
+
+    now[0] += 59
+    assert cache.get("a") == [1, 2]
+    now[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path, max_entries=2)
+    for key in "abc":
+        cache.set(key, {"key": key})
+    cache.close()
+
+    reopened = ResponseCache(path, max_entries=2)
+    assert len(reopened) == 2  # noqa: PLR2004
+    assert reopened.get("c") == {"key": "c"}
+    assert reopened.get("a") is None
+    reopened.set("d", {"key": "d"})
+    # "c" was read after "b" was stored, so "b" goes first
+    assert reopened.get("b") is None
+    assert reopened.get("c") == {"key": "c"}
+    reopened.close()
+
+    limited = ResponseCache(path, max_entries=None, max_bytes=30)
+    limited.set("f", {"key": "f"})
+    assert len(limited) == 2  # noqa: PLR2004
+    limited.close()
+
+
+@pytest.mark.anyio
+async def test_sqlite_cache_runs_off_the_event_loop(anyio_backend, tmp_path):
+    """Test that aget and aset query the SQLite database from a worker thread"""
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    threads = set()
+    db = cache._store._db  # type: ignore[attr-defined]
+
+    class Connection:
+        def execute(self, *args):
+            threads.add(threading.get_ident())
+            return db.execute(*args)
+
+        def close(self):
+            db.close()
+
+    cache._store._db = Connection()  # type: ignore[attr-defined]
+    await cache.aset("a", {"n": 1})
+    assert await cache.aget("a") == {"n": 1}
+    assert await cache.aget("b") is None
+    cache.close()
+
+    assert threads and threading.get_ident() not in threads
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_cache_replays_responses(anyio_backend, stream):
+    """Test that a repeated request is answered from the cache, tool calls included"""
+    cache = ResponseCache()
+    async with FakeUpstream(REPLY, chunk_size=5) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, cache=cache)
+        results = []
+        for _ in range(2):
+            res = await tool_user.chat.completions.create(
+                model="fake",
+                messages=MESSAGES,  # type: ignore
+                tools=TOOLS,  # type: ignore
+                temperature=0,
+                stream=stream,
+            )
+            if stream:
+                content, tool_calls = "", []
+                async with res:  # type: ignore
+                    async for chunk in res:  # type: ignore
+                        delta = chunk.choices[0].delta
+                        content += delta.content or ""
+                        tool_calls.extend(delta.tool_calls or [])
+            else:
+                message = res.choices[0].message  # type: ignore
+                content, tool_calls = message.content, message.tool_calls or []
+            results.append(
+                (
+                    content,
+                    [
+                        (call.function.name, call.function.arguments)  # type: ignore
+                        for call in tool_calls
+                    ],
+                )
+            )
+        await client.close()
+
+    assert len(upstream.requests) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert results[0] == results[1]
+    assert results[1][1] == [("get_time", '{"location": "Paris"}')]
+
+
+@pytest.mark.anyio
+async def test_unfinished_stream_is_not_cached(anyio_backend):
+    cache = ResponseCache()
+    async with FakeUpstream("tick " * 50, chunk_size=5) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, cache=cache)
+        stream = await tool_user.chat.completions.create(
+            model="fake",
+            messages=MESSAGES,  # type: ignore
+            stream=True,
+        )
+        async with stream:
+            async for _ in stream:
+                break
+        await client.close()
+
+    assert len(cache) == 0
@@ -0,0 +1,234 @@
+import io
+import json
+
+import pytest
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+
+from tooluser.compact_transform import (
+    CompactStreamProcessor,
+    CompactTransformation,
+    compact_tool_call_parse,
+    compact_tools_parse,
+    compact_tools_prompt,
+)
+from tooluser.formats import ToolCallDetector
+from tooluser.hermes_transform import HermesTransformation, untransform_jsonl
+from tooluser.transform import ReasoningText
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_weather",
+            "description": "Get the weather in a given location",
+            "parameters": {
+                "type": "object",
+                "properties": {"location": {"type": "string"}},
+            },
+        },
+    }
+]
+HISTORY = [
+    {"role": "user", "content": "Weather in Paris and Rome?"},
+    {
+        "role": "assistant",
+        "content": "Checking.",
+        "tool_calls": [
+            {
+                "id": "call_abc",
+                "type": "function",
+                "function": {
+                    "name": "get_weather",
+                    "arguments": '{"location": "Paris"}',
+                },
+            },
+            {
+                "id": "call_def",
+                "type": "function",
+                "function": {
+                    "name": "get_weather",
+                    "arguments": '{"location": "Rome"}',
+                },
+            },
+        ],
+    },
+    {"role": "tool", "tool_call_id": "call_abc", "content": "Sunny"},
+    {"role": "tool", "tool_call_id": "call_def", "content": "Rainy"},
+]
+
+
+def test_compact_tool_call_parse():
+    result = compact_tool_call_parse('<tc>get_weather\n{"location":"Paris"}</tc>')[-1]
+    assert isinstance(result, ChatCompletionMessageToolCall)
+    assert result.function.name == "get_weather"
+    assert json.loads(result.function.arguments) == {"location": "Paris"}
+    assert result.id.startswith("tool_get_weather_")
+
+
+def test_compact_tool_call_parse_reference_and_broken_json():
+    result = compact_tool_call_parse('get_weather #2\n{"location": "Paris"')[-1]
+    assert result.function.name == "get_weather"
+    assert json.loads(result.function.arguments) == {"location": "Paris"}
+
+
+def test_compact_tool_call_parse_without_arguments():
+    result = compact_tool_call_parse("<tc>get_time</tc>")[-1]
+    assert result.function.arguments == "{}"
+
+
+def test_compact_tool_call_parse_invalid():
+    with pytest.raises(ValueError, match="missing tool name"):
+        compact_tool_call_parse("this is not a call\n{}")
+
+
+def test_compact_stream_processor_char_by_char():
+    processor = CompactStreamProcessor()
+    text = 'Let me check.\n<tc>get_weather\n{"location":"Paris"}</tc>\n<tc>get_weather\n{"location":"Rome"}</tc>'
+    outputs = []
+    for c in text:
+        outputs.extend(processor.process(c))
+    outputs.extend(processor.finalize())
+
+    tool_calls = [o for o in outputs if isinstance(o, ChatCompletionMessageToolCall)]
+    assert [json.loads(t.function.arguments) for t in tool_calls] == [
+        {"location": "Paris"},
+        {"location": "Rome"},
+    ]
+    assert "".join(o for o in outputs if isinstance(o, str)).strip() == "Let me check."
+
+
+def test_compact_history_uses_short_references():
+    messages = list(CompactTransformation().trans_param_messages(HISTORY, TOOLS))  # type: ignore
+
+    assert messages[0]["role"] == "system"
+    assert '{"name":"get_weather"' in messages[0]["content"]  # type: ignore
+    assert messages[2]["content"] == (
+        "Checking.\n"
+        '<tc>get_weather #1\n{"location":"Paris"}</tc>\n'
+        '<tc>get_weather #2\n{"location":"Rome"}</tc>'
+    )
+    assert messages[3] == {"role": "user", "content": "<tr #1>Sunny</tr>"}
+    assert messages[4] == {"role": "user", "content": "<tr #2>Rainy</tr>"}
+
+
+def test_compact_prompt_is_smaller_than_hermes():
+    compact = CompactTransformation().trans_param_messages(HISTORY, TOOLS)  # type: ignore
+    hermes = HermesTransformation().trans_param_messages(HISTORY, TOOLS)  # type: ignore
+    assert len(json.dumps(list(compact))) < len(json.dumps(list(hermes)))
+
+
+def test_compact_trans_completion_message():
+    message = ChatCompletionMessage(
+        role="assistant",
+        content='Sure.\n<tc>get_weather\n{"location":"Paris"}</tc>',
+    )
+    result = CompactTransformation().trans_completion_message(message)
+    assert result.content == "Sure.\n"
+    assert result.tool_calls is not None
+    assert result.tool_calls[0].function.name == "get_weather"  # type: ignore
+
+
+def test_compact_dedup_refers_to_short_reference():
+    forecast = "Sunny all afternoon, 24 degrees with a light westerly wind"
+    history = [
+        *HISTORY[:-2],
+        {"role": "tool", "tool_call_id": "call_abc", "content": forecast},
+        HISTORY[-1],
+        {"role": "tool", "tool_call_id": "call_ghi", "content": forecast},
+    ]
+    messages = list(
+        CompactTransformation(dedup_tool_results=1).trans_param_messages(
+            history,  # type: ignore
+            TOOLS,  # type: ignore
+        )
+    )
+    assert messages[-1] == {
+        "role": "user",
+        "content": "<tr #3>[Identical to the result of #1]</tr>",
+    }
+
+
+def _with_ref_ids(messages: list) -> list:
+    """`messages` with the tool call ids that untransform_messages gives back."""
+    ids = {"call_abc": "call_1", "call_def": "call_2", "call_ghi": "call_3"}
+    result = json.loads(json.dumps(messages))
+    for message in result:
+        for tool_call in message.get("tool_calls", []):
+            tool_call["id"] = ids[tool_call["id"]]
+        if "tool_call_id" in message:
+            message["tool_call_id"] = ids[message["tool_call_id"]]
+    return result
+
+
+def test_compact_untransform_messages_round_trip():
+    history = [
+        *HISTORY,
+        {"role": "tool", "tool_call_id": "call_ghi", "content": "Sunny"},
+        {
+            "role": "assistant",
+            "content": 'Again.\n<tc>get_weather\n{"location":"Oslo"</tc>',
+        },
+    ]
+    transformation = CompactTransformation(dedup_tool_results=1)
+    transformed = transformation.trans_param_messages(history, TOOLS)  # type: ignore
+    messages = transformation.untransform_messages(transformed)
+
+    # Deduplicated results get their content back
+    assert messages[:-1] == _with_ref_ids(history[:-1])
+    # A call written by the model is repaired
+    assert messages[-1]["content"] == "Again."  # type: ignore
+    assert messages[-1]["tool_calls"][0]["function"] == {  # type: ignore
+        "name": "get_weather",
+        "arguments": '{"location": "Oslo"}',
+    }
+
+
+def test_compact_untransform_jsonl():
+    transformed = CompactTransformation().trans_param_messages(HISTORY, TOOLS)  # type: ignore
+    src = io.BytesIO(json.dumps({"messages": transformed}).encode() + b"\n")
+    dst = io.BytesIO()
+
+    assert untransform_jsonl(src, dst, CompactTransformation()) == 1
+    assert json.loads(dst.getvalue()) == {
+        "messages": _with_ref_ids(HISTORY),
+        "tools": TOOLS,
+    }
+
+
+def test_compact_tools_parse_line_separator_in_description():
+    # Kept raw by ensure_ascii=False, and a line boundary for str.splitlines
+    tools = [
+        {
+            "type": "function",
+            "function": {
+                "name": "note",
+                "description": "First line\u2028second line\x85third",
+                "parameters": {"type": "object", "properties": {}},
+            },
+        },
+        *TOOLS,
+    ]
+    assert compact_tools_parse(compact_tools_prompt(tools)) == tools  # type: ignore
+
+
+def test_compact_rejects_hermes_only_options():
+    with pytest.raises(ValueError, match="enable_raw_json_detection"):
+        CompactTransformation(enable_raw_json_detection=True)
+    with pytest.raises(ValueError, match="detector"):
+        CompactTransformation(detector=ToolCallDetector())
+
+
+def test_compact_reasoning_split():
+    processor = CompactTransformation(reasoning="split").create_stream_processor()
+    text = '<think>Call <tc>get_time</tc>?</think>Sure.\n<tc>get_weather\n{"location":"Paris"}</tc>'
+    outputs = []
+    for i in range(0, len(text), 5):
+        outputs.extend(processor.process(text[i : i + 5]))
+    outputs.extend(processor.finalize())
+
+    assert "".join(o for o in outputs if isinstance(o, ReasoningText)) == (
+        "Call <tc>get_time</tc>?"
+    )
+    assert "".join(o for o in outputs if type(o) is str) == "Sure.\n"
+    tool_calls = [o for o in outputs if isinstance(o, ChatCompletionMessageToolCall)]
+    assert [call.function.name for call in tool_calls] == ["get_weather"]
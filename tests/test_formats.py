@@ -0,0 +1,157 @@
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+
+from tooluser import CallFormat, ToolCallDetector
+from tooluser.formats import HERMES_FORMAT
+from tooluser.hermes_transform import HermesTransformation, tool_call_parse
+from tooluser.transform import PendingToolCalls, RepairOffload, aresolve_outputs
+
+REPLY = (
+    "Checking three things.\n"
+    '<tool_call>\n{"name": "get_weather", "arguments": {"location": "Paris"}}\n</tool_call>\n'
+    '```json\n{"name": "get_time", "arguments": {"tz": "CET"}}\n```\n'
+    '<function=read_file>{"path": "a.py"}</function>'
+)
+
+
+def _outputs(text: str, chunk_size: int, transformation: HermesTransformation):
+    """Text and (name, arguments) of the tool calls of a reply streamed in chunks."""
+    processor = transformation.create_stream_processor()
+    outputs = []
+    for i in range(0, len(text), chunk_size):
+        outputs.extend(processor.process(text[i : i + chunk_size]))
+    outputs.extend(processor.finalize())
+    content = "".join(o for o in outputs if isinstance(o, str))
+    calls = [
+        (o.function.name, json.loads(o.function.arguments))
+        for o in outputs
+        if isinstance(o, ChatCompletionMessageToolCall)
+    ]
+    return content, calls
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, len(REPLY)])
+def test_all_formats_in_one_reply(chunk_size):
+    detector = ToolCallDetector()
+    content, calls = _outputs(
+        REPLY, chunk_size, HermesTransformation(detector=detector)
+    )
+
+    assert content.strip() == "Checking three things."
+    assert calls == [
+        ("get_weather", {"location": "Paris"}),
+        ("get_time", {"tz": "CET"}),
+        ("read_file", {"path": "a.py"}),
+    ]
+    assert detector.hits == {
+        "hermes": 1,
+        "fenced_json": 1,
+        "function_tag": 1,
+        "raw_json": 0,
+    }
+
+
+def test_blocks_that_are_not_calls_stay_text():
+    """Test that code examples are kept as written, fences included"""
+    detector = ToolCallDetector()
+    text = (
+        'The config:\n```json\n{"port": 8080}\n```\n'
+        "And a tag: <function=x>not json</function> <function=y>[1]</function>"
+    )
+    for chunk_size in (1, 5, len(text)):
+        content, calls = _outputs(
+            text, chunk_size, HermesTransformation(detector=detector)
+        )
+        assert content == text
+        assert calls == []
+    assert sum(detector.hits.values()) == 0
+
+
+def test_detector_with_raw_json_and_catalog():
+    detector = ToolCallDetector()
+    transformation = HermesTransformation(
+        enable_raw_json_detection=True, detector=detector
+    )
+    message = transformation.trans_completion_message(
+        ChatCompletionMessage(
+            role="assistant",
+            content='Sure. {"name": "get_time", "arguments": {"tz": "CET"}}',
+        )
+    )
+
+    assert message.content == "Sure. "
+    assert message.tool_calls[0].function.name == "get_time"  # type: ignore
+    assert detector.hits["raw_json"] == 1
+
+
+def test_unclosed_and_truncated_blocks():
+    transformation = HermesTransformation(detector=ToolCallDetector())
+    text = 'Here.\n```json\n{"name": "get_time", "arguments": {}}'
+    assert _outputs(text, 4, transformation) == ("Here.\n", [("get_time", {})])
+
+    processor = transformation.create_stream_processor()
+    outputs = processor.process(text)
+    processor.truncated = True  # type: ignore[attr-defined]
+    outputs.extend(processor.finalize())
+    assert "".join(outputs) == text  # type: ignore[arg-type]
+
+
+def test_custom_format():
+    """Test that a format is added by its markers and parser alone"""
+    call = CallFormat(
+        "call_tag",
+        re.escape("<call>"),
+        "</call>",
+        lambda text, match: tool_call_parse(text),
+        len("<call>"),
+    )
+    detector = ToolCallDetector([HERMES_FORMAT, call])
+    content, calls = _outputs(
+        'Ok <call>{"name": "get_time", "arguments": {}}</call>',
+        2,
+        HermesTransformation(detector=detector),
+    )
+
+    assert content == "Ok "
+    assert calls == [("get_time", {})]
+    assert detector.hits["call_tag"] == 1
+    # Formats that are not enabled are plain text
+    assert _outputs(REPLY, 5, HermesTransformation(detector=detector))[1] == [
+        ("get_weather", {"location": "Paris"})
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_large_repairs_in_a_process_pool(anyio_backend):
+    """Test that deferred blocks of every format can be parsed in another process"""
+    content = "x" * 2000
+    text = (
+        f'```json\n{{"name": "write", "arguments": {{"text": "{content}"\n```\n'
+        f'<function=write>{{"text": "{content}"</function>\n'
+        f'```json\n{{"port": "{content}\n```'
+    )
+    detector = ToolCallDetector()
+    processor = HermesTransformation(detector=detector).create_stream_processor()
+    processor.offload_size = 1000
+    outputs = processor.process(text)
+    outputs.extend(processor.finalize())
+    assert sum(isinstance(o, PendingToolCalls) for o in outputs) == 3  # noqa: PLR2004
+
+    with ProcessPoolExecutor(1) as executor:
+        resolved = await aresolve_outputs(outputs, RepairOffload(1000, executor))
+
+    calls = [o for o in resolved if isinstance(o, ChatCompletionMessageToolCall)]
+    assert [json.loads(call.function.arguments) for call in calls] == [
+        {"text": content},
+        {"text": content},
+    ]
+    text_parts = "".join(o for o in resolved if isinstance(o, str))
+    assert text_parts.endswith(f'```json\n{{"port": "{content}\n```')
+    # Counted in this process once parsed
+    assert detector.hits["fenced_json"] == 1
+    assert detector.hits["function_tag"] == 1
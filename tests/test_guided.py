@@ -0,0 +1,137 @@
+import json
+import re
+
+import pytest
+from openai import AsyncOpenAI
+
+from tooluser import GuidedDecoding, ToolUser
+from tooluser.compact_transform import CompactTransformation
+from tooluser.guided import text_without
+from tooluser.hermes_transform import HermesStreamProcessor, HermesTransformation
+from tooluser.testing import FakeUpstream
+
+WEATHER_PARAMETERS = {
+    "type": "object",
+    "properties": {"location": {"type": "string"}},
+    "required": ["location"],
+}
+TOOLS = [
+    {
+        "type": "function",
+        "function": {"name": "get_weather", "parameters": WEATHER_PARAMETERS},
+    },
+    {"type": "function", "function": {"name": "get_time"}},
+]
+MESSAGES = [{"role": "user", "content": "Weather in Paris?"}]
+REPLY = (
+    "Let me check.\n"
+    '<tool_call>\n{"name": "get_weather", "arguments": {"location": "Paris"}}\n</tool_call>'
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_structural_tag_in_request(anyio_backend):
+    """Test that the constraint reaches the upstream next to the caller's extra_body"""
+    transformation = HermesTransformation(guided_decoding=GuidedDecoding())
+    async with FakeUpstream(REPLY) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        res = await ToolUser(client, transformation).chat.completions.create(
+            model="fake",
+            messages=MESSAGES,  # type: ignore
+            tools=TOOLS,  # type: ignore
+            extra_body={"top_k": 20},
+        )
+        await client.close()
+
+    body = upstream.requests[0]
+    assert body["top_k"] == 20  # noqa: PLR2004
+    assert body["response_format"] == {
+        "type": "structural_tag",
+        "structures": [
+            {
+                "begin": '<tool_call>\n{"name": "get_weather", "arguments": ',
+                "schema": WEATHER_PARAMETERS,
+                "end": "}\n</tool_call>",
+            },
+            {
+                "begin": '<tool_call>\n{"name": "get_time", "arguments": ',
+                "schema": {"type": "object"},
+                "end": "}\n</tool_call>",
+            },
+        ],
+        "triggers": ["<tool_call>"],
+    }
+    tool_calls = res.choices[0].message.tool_calls  # type: ignore
+    assert tool_calls[0].function.name == "get_weather"  # type: ignore
+
+
+@pytest.mark.anyio
+async def test_no_constraint_without_tools(anyio_backend):
+    transformation = HermesTransformation(guided_decoding=GuidedDecoding())
+    async with FakeUpstream("Hello.") as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        await ToolUser(client, transformation).chat.completions.create(
+            model="fake",
+            messages=MESSAGES,  # type: ignore
+        )
+        await client.close()
+
+    assert "response_format" not in upstream.requests[0]
+
+
+def test_regex_constraint():
+    guided = GuidedDecoding(kind="regex", field="regex")
+    constraint = HermesTransformation(guided_decoding=guided).guided_constraint(TOOLS)
+    pattern = re.compile(constraint["regex"])
+
+    assert pattern.fullmatch("Just text, with a <tag> and {braces}.")
+    assert pattern.fullmatch(REPLY)
+    assert pattern.fullmatch(
+        REPLY + '\n<tool_call>\n{"name": "get_time", "arguments": {}}\n</tool_call>'
+    )
+    # Unknown tool, malformed call, text after the calls
+    assert not pattern.fullmatch(REPLY.replace("get_weather", "get_news"))
+    assert not pattern.fullmatch(REPLY.replace('"arguments": ', ""))
+    assert not pattern.fullmatch(REPLY + "\nDone.")
+
+
+def test_regex_constraint_compact_format():
+    transformation = CompactTransformation(guided_decoding=GuidedDecoding("regex"))
+    pattern = re.compile(transformation.guided_constraint(TOOLS)["guided_regex"])
+
+    assert pattern.fullmatch('Checking.\n<tc>get_weather\n{"location":"Paris"}</tc>')
+    assert not pattern.fullmatch('<tool_call>\n{"name": "get_time"}</tool_call><tc>x')
+
+
+def test_text_without():
+    pattern = re.compile(text_without("<tool_call>"))
+    for text in ["", "a < b", "<<tool", "<tool_cal>", "x <tool_call", "<t<to<"]:
+        assert pattern.fullmatch(text), text
+    for text in ["<tool_call>", "a <<tool_call> b", "<tool_<tool_call>"]:
+        assert not pattern.fullmatch(text), text
+
+
+def test_strict_parse_and_fallback():
+    """Test that strict parsing still repairs a block the upstream left malformed"""
+    processor = HermesTransformation(
+        enable_raw_json_detection=True, guided_decoding=GuidedDecoding()
+    ).create_stream_processor()
+    assert isinstance(processor, HermesStreamProcessor)
+    assert processor.strict
+    assert not processor.enable_raw_json_detection
+
+    outputs = processor.process(REPLY)
+    outputs.extend(processor.finalize())
+    assert outputs[0] == "Let me check.\n"
+    assert json.loads(outputs[1].function.arguments) == {"location": "Paris"}  # type: ignore
+
+    processor = HermesStreamProcessor("<tool_call>", "</tool_call>", strict=True)
+    outputs = processor.process(
+        '<tool_call>{"name": "get_time", "arguments": {"tz": "CET",}</tool_call>'
+    )
+    assert outputs[0].function.name == "get_time"  # type: ignore
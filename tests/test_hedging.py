@@ -0,0 +1,149 @@
+import anyio
+import pytest
+from openai import AsyncOpenAI
+
+from tooluser import Hedging, Scheduler, ToolUser
+from tooluser.testing import FakeUpstream
+
+TOOLS = [{"type": "function", "function": {"name": "get_time"}}]
+MESSAGES = [{"role": "user", "content": "What's the time in Paris?"}]
+REPLY = (
+    "Let me check.\n"
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>'
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def _ask(tool_user: ToolUser, stream: bool) -> tuple[str, list[str], str]:
+    """Content, tool call names and model of a reply."""
+    res = await tool_user.chat.completions.create(
+        model="fake",
+        messages=MESSAGES,  # type: ignore
+        tools=TOOLS,  # type: ignore
+        stream=stream,
+    )
+    if not stream:
+        message = res.choices[0].message  # type: ignore
+        names = [call.function.name for call in message.tool_calls or []]
+        return message.content or "", names, res.model  # type: ignore
+    content, names, model = "", [], ""
+    async with res:  # type: ignore
+        async for chunk in res:  # type: ignore
+            model = chunk.model
+            delta = chunk.choices[0].delta
+            content += delta.content or ""
+            names += [call.function.name for call in delta.tool_calls or []]
+    return content, names, model
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_hedge_to_alternate_upstream(anyio_backend, stream):
+    """Test that a slow upstream is hedged, without waiting for the losing request"""
+    async with (
+        FakeUpstream(REPLY, latency=2.0) as slow,
+        FakeUpstream(REPLY) as fast,
+    ):
+        client = AsyncOpenAI(base_url=slow.base_url, api_key="test")
+        backup = AsyncOpenAI(base_url=fast.base_url, api_key="test")
+        hedging = Hedging(delay=0.05, client=backup, max_ratio=1.0)
+        tool_user = ToolUser(client, hedging=hedging)
+        with anyio.fail_after(1):
+            content, names, _ = await _ask(tool_user, stream)
+        await client.close()
+        await backup.close()
+
+    assert content.strip() == "Let me check."
+    assert names == ["get_time"]
+    assert (hedging.requests, hedging.hedged, hedging.hedge_wins) == (1, 1, 1)
+    assert len(slow.requests) == len(fast.requests) == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_hedges_take_scheduler_slots(anyio_backend, stream):
+    """Test that a duplicate request waits for a scheduler slot of its own"""
+    async with (
+        FakeUpstream(REPLY, latency=0.3) as slow,
+        FakeUpstream(REPLY) as fast,
+    ):
+        client = AsyncOpenAI(base_url=slow.base_url, api_key="test")
+        backup = AsyncOpenAI(base_url=fast.base_url, api_key="test")
+        hedging = Hedging(delay=0.05, client=backup, max_ratio=1.0)
+        # The only slot is the primary's, so the duplicate is never sent
+        full = Scheduler(max_concurrency=1)
+        _, names, _ = await _ask(
+            ToolUser(client, hedging=hedging, scheduler=full), stream
+        )
+        assert names == ["get_time"]
+        assert (full.stats.admitted, full.stats.queued, full.active) == (1, 1, 0)
+        assert (len(slow.requests), len(fast.requests)) == (1, 0)
+
+        free = Scheduler(max_concurrency=2)
+        _, names, _ = await _ask(
+            ToolUser(client, hedging=hedging, scheduler=free), stream
+        )
+        assert names == ["get_time"]
+        assert (free.stats.admitted, free.stats.queued, free.active) == (2, 0, 0)
+        assert hedging.hedge_wins == 1
+        assert len(fast.requests) == 1
+        await client.close()
+        await backup.close()
+
+
+@pytest.mark.anyio
+async def test_hedge_to_alternate_model(anyio_backend):
+    async with FakeUpstream(
+        REPLY, latency=lambda body: 2.0 if body["model"] == "fake" else 0.0
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        hedging = Hedging(delay=0.05, model="fallback", max_ratio=1.0)
+        with anyio.fail_after(1):
+            _, names, model = await _ask(ToolUser(client, hedging=hedging), True)
+        await client.close()
+
+    assert names == ["get_time"]
+    assert model == "fallback"
+
+
+@pytest.mark.anyio
+async def test_fast_requests_are_not_hedged(anyio_backend):
+    async with FakeUpstream(REPLY) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        hedging = Hedging(delay=1.0)
+        for stream in (False, True):
+            await _ask(ToolUser(client, hedging=hedging), stream)
+        await client.close()
+
+    assert (hedging.requests, hedging.hedged) == (2, 0)
+    assert len(upstream.requests) == 2  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_hedging_budget_and_learned_delay(anyio_backend):
+    """Test that hedging waits for enough latencies and stays within its budget"""
+    calls = 0
+
+    def latency(body):
+        nonlocal calls
+        calls += 1
+        # Every fourth request is slow
+        return 0.3 if calls % 4 == 0 else 0.01
+
+    async with FakeUpstream(REPLY, latency=latency) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        hedging = Hedging(percentile=50, min_samples=4, max_ratio=0.2)
+        tool_user = ToolUser(client, hedging=hedging)
+        assert hedging.hedge_delay() is None
+        for _ in range(12):
+            await _ask(tool_user, False)
+        await client.close()
+
+    delay = hedging.hedge_delay()
+    assert delay is not None
+    assert delay < 0.3  # noqa: PLR2004
+    assert 0 < hedging.hedged <= 0.2 * hedging.requests
@@ -1,10 +1,31 @@
+import io
+import json
+
 import pytest
-from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat import (
+    ChatCompletionMessage,
+    ChatCompletionMessageParam,
+    ChatCompletionMessageToolCall,
+)
+from openai.types.chat.chat_completion_chunk import ChoiceDelta
+from pydantic import TypeAdapter
 
+from tooluser.catalog import ToolCatalog
 from tooluser.hermes_transform import (
     HermesStreamProcessor,
     HermesTransformation,
     tool_call_parse,
+    tool_result_serialize,
+    tools_list_parse,
+    tools_list_prompt,
+    untransform_jsonl,
+)
+from tooluser.transform import (
+    PendingToolCalls,
+    PromptOverhead,
+    ReasoningText,
+    content_text,
+    resolve_outputs,
 )
 
 
@@ -456,6 +477,493 @@ def test_mixed_tool_calls_closed_tag_then_raw_json():
     assert tool_calls[2].function.name == "tool_3"
 
 
+def test_trans_param_messages_overhead_report():
+    tools = [{"type": "function", "function": {"name": "get_weather"}}]
+    messages = [
+        {"role": "user", "content": "Weather?"},
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": "call_1",
+                    "type": "function",
+                    "function": {"name": "get_weather", "arguments": "{}"},
+                }
+            ],
+        },
+        {"role": "tool", "tool_call_id": "call_1", "content": "Sunny"},
+    ]
+    overhead = PromptOverhead(tokenizer=lambda text: len(text.split()))
+    new_messages = list(
+        HermesTransformation().trans_param_messages(messages, tools, overhead=overhead)  # type: ignore
+    )
+
+    assert overhead.original_chars == len("Weather?" + "get_weather{}" + "Sunny")
+    assert overhead.catalog_chars == len(new_messages[0]["content"])  # type: ignore
+    assert overhead.tool_calls_chars == len(new_messages[2]["content"]) - 1  # type: ignore
+    assert overhead.tool_results_chars == len(new_messages[3]["content"])  # type: ignore
+    assert overhead.transformed_chars == sum(
+        len(m["content"])  # type: ignore
+        for m in new_messages
+    )
+    assert overhead.added_chars > overhead.catalog_chars
+    assert overhead.catalog_tokens == len(new_messages[0]["content"].split())  # type: ignore
+
+
+UNTRANSFORM_TOOLS = [{"type": "function", "function": {"name": "get_weather"}}]
+UNTRANSFORM_MESSAGES = [
+    {"role": "system", "content": "Be brief."},
+    {"role": "user", "content": "Weather in Paris and Rome?"},
+    {
+        "role": "assistant",
+        "content": "Checking.",
+        "tool_calls": [
+            {
+                "id": "call_1",
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": '{"city": "Paris"}'},
+            },
+            {
+                "id": "call_2",
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": '{"city": "Rome"}'},
+            },
+        ],
+    },
+    {"role": "tool", "tool_call_id": "call_1", "content": "Sunny\n"},
+    {"role": "tool", "tool_call_id": "call_2", "content": "Rainy"},
+    {"role": "assistant", "content": "Paris is sunny, Rome is rainy."},
+]
+
+
+def test_untransform_messages_round_trip():
+    transformation = HermesTransformation()
+    transformed = transformation.trans_param_messages(
+        UNTRANSFORM_MESSAGES,  # type: ignore
+        UNTRANSFORM_TOOLS,  # type: ignore
+    )
+    assert transformation.untransform_messages(transformed) == UNTRANSFORM_MESSAGES
+
+
+def test_untransform_messages_model_written_call():
+    transformation = HermesTransformation()
+    messages = transformation.untransform_messages(
+        [
+            {
+                "role": "assistant",
+                "content": '<tool_call>\n{"name": "get_weather", "arguments": {"city": "Paris"\n</tool_call>',
+            }
+        ]
+    )
+    assert messages[0]["content"] is None  # type: ignore
+    tool_call = messages[0]["tool_calls"][0]  # type: ignore
+    assert tool_call["function"]["name"] == "get_weather"
+    assert json.loads(tool_call["function"]["arguments"]) == {"city": "Paris"}
+    assert tool_call["id"].startswith("tool_get_weather_")
+
+
+def test_untransform_jsonl():
+    transformed = HermesTransformation().trans_param_messages(
+        UNTRANSFORM_MESSAGES,  # type: ignore
+        UNTRANSFORM_TOOLS,  # type: ignore
+    )
+    src = io.BytesIO(
+        (
+            json.dumps({"id": 1, "messages": transformed})
+            + "\n"
+            + json.dumps({"id": 2, "messages": [{"role": "user", "content": "hi"}]})
+            + "\n"
+        ).encode()
+    )
+    dst = io.BytesIO()
+
+    assert untransform_jsonl(src, dst) == 2  # noqa: PLR2004
+    first, second = [json.loads(line) for line in dst.getvalue().splitlines()]
+    assert first == {
+        "id": 1,
+        "messages": UNTRANSFORM_MESSAGES,
+        "tools": UNTRANSFORM_TOOLS,
+    }
+    assert second == {"id": 2, "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_offload_defers_only_large_blocks_that_need_repair():
+    """Test that only large malformed tool calls are deferred, keeping their place"""
+    large = json.dumps({"name": "write", "arguments": {"text": "x" * 2000}})
+    small_broken = '{"name": "write", "arguments": {"text": "x"'
+    processor = HermesStreamProcessor(start_tag="<tool_call>", end_tag="</tool_call>")
+    processor.offload_size = 1000
+
+    outputs = processor.process(
+        f"a<tool_call>{small_broken}</tool_call>b<tool_call>{large}</tool_call>"
+        f"c<tool_call>{large[:-2]}</tool_call>d"
+    )
+    outputs.extend(processor.finalize())
+
+    assert [type(output) for output in outputs] == [
+        str,
+        ChatCompletionMessageToolCall,
+        str,
+        ChatCompletionMessageToolCall,
+        str,
+        PendingToolCalls,
+        str,
+    ]
+    resolved = resolve_outputs(outputs)
+    assert isinstance(resolved[5], ChatCompletionMessageToolCall)
+    assert json.loads(resolved[5].function.arguments) == {"text": "x" * 2000}
+
+
+def test_cache_control_on_tool_prompt():
+    """Test that the tool prompt can carry a prompt-cache marker"""
+    cache_control = {"type": "ephemeral"}
+    plain = HermesTransformation().trans_param_messages(
+        UNTRANSFORM_MESSAGES,  # type: ignore
+        UNTRANSFORM_TOOLS,  # type: ignore
+    )
+    marked = HermesTransformation(cache_control=cache_control).trans_param_messages(
+        UNTRANSFORM_MESSAGES,  # type: ignore
+        UNTRANSFORM_TOOLS,  # type: ignore
+    )
+
+    assert marked[0]["content"] == [  # type: ignore
+        {"type": "text", "text": plain[0]["content"], "cache_control": cache_control}  # type: ignore
+    ]
+    assert marked[1:] == plain[1:]  # type: ignore
+
+
+def test_cache_control_on_stable_history():
+    """Test that cache_history marks the message before the newest one"""
+    cache_control = {"type": "ephemeral", "ttl": "1h"}
+    messages = [
+        *UNTRANSFORM_MESSAGES,
+        {"role": "user", "content": [{"type": "text", "text": "And tomorrow?"}]},
+    ]
+    transformation = HermesTransformation(
+        cache_control=cache_control, cache_history=True
+    )
+    plain = HermesTransformation().trans_param_messages(messages, UNTRANSFORM_TOOLS)  # type: ignore
+    marked = transformation.trans_param_messages(messages, UNTRANSFORM_TOOLS)  # type: ignore
+
+    assert [part.get("cache_control") for part in marked[-2]["content"]] == [  # type: ignore
+        cache_control
+    ]
+    assert marked[-1] == plain[-1]  # type: ignore
+    # The caller's messages are left untouched
+    assert "cache_control" not in json.dumps(messages)
+
+
+def test_cache_control_keeps_request_valid():
+    """Test that marked requests stay valid, with the same text for providers that ignore the field"""
+    adapter = TypeAdapter(ChatCompletionMessageParam)
+    transformation = HermesTransformation(
+        cache_control={"type": "ephemeral"}, cache_history=True
+    )
+    plain = HermesTransformation().trans_param_messages(
+        UNTRANSFORM_MESSAGES,  # type: ignore
+        UNTRANSFORM_TOOLS,  # type: ignore
+    )
+    marked = transformation.trans_param_messages(
+        UNTRANSFORM_MESSAGES,  # type: ignore
+        UNTRANSFORM_TOOLS,  # type: ignore
+    )
+
+    for plain_message, marked_message in zip(plain, marked, strict=True):
+        adapter.validate_python(json.loads(json.dumps(marked_message)))
+        assert marked_message["role"] == plain_message["role"]
+        assert content_text(marked_message.get("content")) == content_text(
+            plain_message.get("content")
+        )
+    # Transcripts logged with markers still convert back
+    assert transformation.untransform_messages(marked) == UNTRANSFORM_MESSAGES
+
+
+def test_tools_list_prompt_layout():
+    """Test that the tools prompt keeps the layout of the former Jinja template"""
+    tools = [{"name": "get_weather", "description": 'It\'s "sunny" in 東京'}]
+    prompt = tools_list_prompt(tools)  # type: ignore
+
+    assert prompt.startswith(
+        "\n<tool_instruction>\nYou are a function calling AI model."
+    )
+    assert prompt.endswith(
+        "no text should follow the final </tool_call> tag.\n</tool_instruction>"
+    )
+    assert (
+        "<tools>\n"
+        + r"""['{"name": "get_weather", "description": "It\'s \\"sunny\\" in 東京"}']"""
+        + "\n</tools>"
+    ) in prompt
+    assert tools_list_parse(prompt) == tools
+
+
+def test_raw_json_detection_only_for_known_tools():
+    """Test that with the request's catalog, raw JSON of other names stays text"""
+    catalog = ToolCatalog([{"type": "function", "function": {"name": "get_weather"}}])
+    transformation = HermesTransformation(enable_raw_json_detection=True)
+    text = 'Use this config: {"name": "config", "arguments": {"port": 8080}}'
+
+    generic = transformation.trans_completion_message(
+        ChatCompletionMessage(role="assistant", content=text)
+    )
+    assert generic.tool_calls[0].function.name == "config"  # type: ignore
+
+    gated = transformation.trans_completion_message(
+        ChatCompletionMessage(role="assistant", content=text), catalog
+    )
+    assert gated.tool_calls is None
+    assert gated.content == text
+
+    # The arguments of an unknown call may hold a known one, which must end the text
+    text = '{"name": "wrap", "arguments": {"name": "get_weather", "arguments": {}}}'
+    processor = transformation.create_stream_processor(catalog)
+    outputs = processor.process(text)
+    outputs.extend(processor.finalize())
+    assert "".join(o for o in outputs if isinstance(o, str)) == text
+    processor = transformation.create_stream_processor(catalog)
+    outputs = processor.process('Sure. {"name": "get_weather", "arguments": {}}')
+    outputs.extend(processor.finalize())
+    tool_calls = [o for o in outputs if isinstance(o, ChatCompletionMessageToolCall)]
+    assert tool_calls[0].function.name == "get_weather"
+
+
+THINKING_REPLY = (
+    "<think>Maybe "
+    '<tool_call>\n{"name": "get_time", "arguments": {}}\n</tool_call>'
+    ", or ask first.</think>\n"
+    "I will check.\n"
+    '<tool_call>\n{"name": "get_weather", "arguments": {"location": "Paris"}}\n</tool_call>'
+)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 9, len(THINKING_REPLY)])
+def test_reasoning_blocks_are_not_scanned(chunk_size):
+    """Test that a call considered in a <think> block stays reasoning"""
+    for reasoning in ("inline", "split"):
+        processor = HermesTransformation(reasoning=reasoning).create_stream_processor()
+        outputs = []
+        for i in range(0, len(THINKING_REPLY), chunk_size):
+            outputs.extend(processor.process(THINKING_REPLY[i : i + chunk_size]))
+        outputs.extend(processor.finalize())
+
+        tool_calls = [
+            o for o in outputs if isinstance(o, ChatCompletionMessageToolCall)
+        ]
+        assert [call.function.name for call in tool_calls] == ["get_weather"]
+        text = "".join(o for o in outputs if type(o) is str)
+        thought = "".join(o for o in outputs if isinstance(o, ReasoningText))
+        considered = 'Maybe <tool_call>\n{"name": "get_time", "arguments": {}}'
+        if reasoning == "inline":
+            assert text.startswith("<think>" + considered)
+            assert text.endswith("</think>\nI will check.\n")
+            assert thought == ""
+        else:
+            assert text == "\nI will check.\n"
+            assert thought.startswith(considered)
+            assert thought.endswith(", or ask first.")
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        ['<think>Hm.</think>Sure. {"name": "f", "arguments": {"q": "a <think> b"}}'],
+        [
+            '<think>Hm.</think>Sure. {"name": "f", "arguments": {"q": "a <think>',
+            ' b"}}',
+        ],
+    ],
+)
+def test_think_tag_inside_raw_json_call(chunks):
+    """Test that a <think> tag in the arguments of a raw JSON call does not split it"""
+    processor = HermesTransformation(
+        enable_raw_json_detection=True, reasoning="split"
+    ).create_stream_processor()
+    outputs = []
+    for chunk in chunks:
+        outputs.extend(processor.process(chunk))
+    outputs.extend(processor.finalize())
+
+    tool_calls = [o for o in outputs if isinstance(o, ChatCompletionMessageToolCall)]
+    assert [call.function.arguments for call in tool_calls] == ['{"q": "a <think> b"}']
+    assert "".join(o for o in outputs if isinstance(o, ReasoningText)) == "Hm."
+    assert "".join(o for o in outputs if type(o) is str) == "Sure. "
+
+
+def test_reasoning_content_split():
+    transformation = HermesTransformation(reasoning="split")
+    message = transformation.trans_completion_message(
+        ChatCompletionMessage(role="assistant", content=THINKING_REPLY)
+    )
+    assert message.content == "\nI will check.\n"
+    assert message.reasoning_content.endswith(", or ask first.")  # type: ignore[attr-defined]
+    assert message.tool_calls[0].function.name == "get_weather"  # type: ignore
+
+    # An unclosed block is reasoning up to the end, and without the option it is text
+    message = transformation.trans_completion_message(
+        ChatCompletionMessage(role="assistant", content="Hi <think>hmm")
+    )
+    assert (message.content, message.reasoning_content) == ("Hi ", "hmm")  # type: ignore[attr-defined]
+    message = HermesTransformation().trans_completion_message(
+        ChatCompletionMessage(role="assistant", content=THINKING_REPLY)
+    )
+    assert message.content.startswith("<think>Maybe ")  # type: ignore
+    assert [call.function.name for call in message.tool_calls] == [  # type: ignore
+        "get_time",
+        "get_weather",
+    ]
+
+    delta = transformation.trans_completion_message_stream(
+        transformation.create_stream_processor(),
+        ChoiceDelta(content="<think>a</think>b"),
+        finalize=True,
+    )
+    assert (delta.content, delta.reasoning_content) == ("b", "a")  # type: ignore[attr-defined]
+
+
+def test_strip_reasoning_history():
+    messages = [
+        {"role": "user", "content": "Weather?"},
+        {
+            "role": "assistant",
+            "content": "<think>Paris, probably.</think>\n\nChecking.",
+            "reasoning_content": "More thoughts",
+            "tool_calls": [
+                {
+                    "id": "call_1",
+                    "type": "function",
+                    "function": {"name": "get_weather", "arguments": "{}"},
+                }
+            ],
+        },
+        {"role": "tool", "tool_call_id": "call_1", "content": "Sunny"},
+        {
+            "role": "assistant",
+            "content": [{"type": "text", "text": "<think>Done.</think>It is sunny."}],
+        },
+    ]
+    stripped = HermesTransformation(strip_reasoning=True).trans_param_messages(
+        messages, []
+    )
+    kept = HermesTransformation().trans_param_messages(messages, [])
+
+    call_message, answer = list(stripped)[2], list(stripped)[4]
+    assert call_message["content"].startswith("Checking.\n<tool_call>")  # type: ignore
+    assert "reasoning_content" not in call_message
+    assert answer["content"] == [{"type": "text", "text": "It is sunny."}]  # type: ignore
+    assert list(kept)[2]["reasoning_content"] == "More thoughts"  # type: ignore
+    # The caller's messages are left as they were
+    assert messages[1]["reasoning_content"] == "More thoughts"
+
+
+def _read_call(call_id: str, path: str) -> dict:
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": call_id,
+                "type": "function",
+                "function": {
+                    "name": "read_file",
+                    "arguments": json.dumps({"path": path}),
+                },
+            }
+        ],
+    }
+
+
+def test_dedup_tool_results():
+    """Test that later copies of a tool result refer to the first one"""
+    source = "def main():\n    return '☀ 42'\n" * 50
+    messages = [
+        {"role": "user", "content": "Fix main.py"},
+        _read_call("call_1", "main.py"),
+        {"role": "tool", "tool_call_id": "call_1", "content": source},
+        _read_call("call_2", "main.py"),
+        {
+            "role": "tool",
+            "tool_call_id": "call_2",
+            "content": [{"type": "text", "text": source}],
+        },
+        _read_call("call_3", "empty.py"),
+        {"role": "tool", "tool_call_id": "call_3", "content": "ok"},
+        _read_call("call_4", "empty.py"),
+        {"role": "tool", "tool_call_id": "call_4", "content": "ok"},
+    ]
+    transformation = HermesTransformation(dedup_tool_results=64)
+    overhead = PromptOverhead()
+    new_messages = list(
+        transformation.trans_param_messages(messages, [], overhead=overhead)  # type: ignore
+    )
+
+    assert source in new_messages[3]["content"]  # type: ignore
+    assert new_messages[5]["content"] == tool_result_serialize(
+        {
+            "role": "tool",
+            "tool_call_id": "call_2",
+            "content": "[Identical to the <tool_result> of call_1 above]",
+        }
+    )
+    # Results shorter than the threshold are kept as they are
+    assert "ok" in new_messages[9]["content"]  # type: ignore
+    # Counted in UTF-8 bytes, which the non-ASCII source has more of than characters
+    reference = "[Identical to the <tool_result> of call_1 above]"
+    assert overhead.dedup_saved_bytes == len(source.encode()) - len(reference)
+
+    # Deterministic, and the first turns are unchanged as the history grows
+    again = transformation.trans_param_messages(messages[:5], [])
+    assert list(again) == new_messages[:6]
+    plain = HermesTransformation().trans_param_messages(messages, [])
+    assert list(plain)[:4] == new_messages[:4]
+
+
+def test_dedup_keeps_results_shorter_than_the_reference():
+    """Test that a repeated result is only replaced by a reference shorter than it"""
+    result = "x" * 20
+    messages = [
+        _read_call("call_1", "a.py"),
+        {"role": "tool", "tool_call_id": "call_1", "content": result},
+        _read_call("call_2", "a.py"),
+        {"role": "tool", "tool_call_id": "call_2", "content": result},
+    ]
+    overhead = PromptOverhead()
+    new_messages = list(
+        HermesTransformation(dedup_tool_results=1).trans_param_messages(
+            messages,
+            [],
+            overhead=overhead,  # type: ignore
+        )
+    )
+
+    assert result in new_messages[4]["content"]  # type: ignore
+    assert "Identical" not in new_messages[4]["content"]  # type: ignore
+    assert overhead.dedup_saved_bytes == 0
+
+
+def test_dedup_savings_without_breakdown():
+    """Test that an overhead without breakdown counts dedup savings and nothing else"""
+    source = "print('hello')\n" * 20
+    messages = [
+        _read_call("call_1", "a.py"),
+        {"role": "tool", "tool_call_id": "call_1", "content": source},
+        _read_call("call_2", "a.py"),
+        {"role": "tool", "tool_call_id": "call_2", "content": source},
+    ]
+    tokenized = []
+    overhead = PromptOverhead(tokenizer=tokenized.append, breakdown=False)  # type: ignore
+    HermesTransformation(dedup_tool_results=64).trans_param_messages(
+        messages,
+        [],
+        overhead=overhead,  # type: ignore
+    )
+
+    reference = "[Identical to the <tool_result> of call_1 above]"
+    assert overhead.dedup_saved_bytes == len(source) - len(reference)
+    assert tokenized == []
+    assert overhead.transformed_chars == overhead.original_chars == 0
+
+
 """
 {"name": "tool_1", "arguments": {"location": "San Francisco, CA", "unit": "celsius"}}
 </tool_call>
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+
+def _loaded_after(statement: str, modules: list[str]) -> list[str]:
+    code = (
+        f"import sys; {statement}; "
+        f"print(','.join(m for m in {modules!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout.strip()
+    return output.split(",") if output else []
+
+
+def test_import_is_lazy():
+    """Test that importing the package and the CLI loads no heavy dependency"""
+    heavy = ["openai", "json_repair", "jinja2", "tooluser.tool_user"]
+
+    assert _loaded_after("import tooluser", heavy) == []
+    assert _loaded_after("import tooluser.cli", heavy) == []
+
+
+def test_public_names_resolve_on_access():
+    import tooluser
+    from tooluser.tool_user import ToolUser
+
+    assert tooluser.ToolUser is ToolUser
+    assert set(tooluser.__all__) <= set(dir(tooluser))
+    assert _loaded_after("from tooluser import ToolUser", ["json_repair"]) == []
@@ -0,0 +1,144 @@
+import anyio
+import pytest
+from openai import AsyncOpenAI, RateLimitError
+
+from tooluser import Scheduler, ToolUser
+from tooluser.testing import FakeUpstream
+
+MESSAGES = [{"role": "user", "content": "What's the time?"}]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def _burst(tool_user: ToolUser, count: int, stream: bool = False) -> int:
+    """Send `count` requests at once; returns the number rejected with a 429."""
+    rejected = 0
+
+    async def request():
+        nonlocal rejected
+        try:
+            res = await tool_user.chat.completions.create(
+                model="fake",
+                messages=MESSAGES,  # type: ignore
+                stream=stream,
+            )
+            if stream:
+                async with res:  # type: ignore
+                    async for _ in res:  # type: ignore
+                        pass
+        except RateLimitError:
+            rejected += 1
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(count):
+            tg.start_soon(request)
+    return rejected
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_scheduler_keeps_within_concurrency_limit(anyio_backend, stream):
+    """Test that a burst beyond the upstream's concurrency limit is queued, not rejected"""
+    async with FakeUpstream(
+        "It is noon.", latency=0.05, max_concurrent_requests=2
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test", max_retries=0)
+        assert await _burst(ToolUser(client), 8, stream) > 0
+
+        scheduler = Scheduler(max_concurrency=2)
+        upstream.rejected = upstream.peak_requests = 0
+        assert await _burst(ToolUser(client, scheduler=scheduler), 8, stream) == 0
+        await client.close()
+
+    assert upstream.rejected == 0
+    assert upstream.peak_requests == 2  # noqa: PLR2004
+    assert scheduler.active == scheduler.queue_depth == 0
+    assert scheduler.stats.admitted == 8  # noqa: PLR2004
+    assert scheduler.stats.queued == 6  # noqa: PLR2004
+    assert scheduler.stats.max_wait > 0.05  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_scheduler_keeps_within_request_rate(anyio_backend):
+    async with FakeUpstream(
+        "It is noon.", requests_per_minute=3, rate_window=0.3
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test", max_retries=0)
+        # A slightly longer window than the upstream's absorbs the network delay
+        scheduler = Scheduler(requests_per_minute=3, window=0.35)
+        start = anyio.current_time()
+        assert await _burst(ToolUser(client, scheduler=scheduler), 7) == 0
+        elapsed = anyio.current_time() - start
+        await client.close()
+
+    assert len(upstream.requests) == 7  # noqa: PLR2004
+    assert elapsed > 0.7  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_scheduler_token_rate(anyio_backend):
+    scheduler = Scheduler(tokens_per_minute=100, window=0.2)
+    start = anyio.current_time()
+    async with scheduler.slot(60):
+        pass
+    async with scheduler.slot(60):
+        pass
+
+    assert anyio.current_time() - start > 0.2  # noqa: PLR2004
+    assert scheduler.stats.queued == 1
+
+
+@pytest.mark.anyio
+async def test_scheduler_priority_and_tenant_fairness(anyio_backend):
+    """Test that higher priorities go first, then tenants take turns"""
+    scheduler = Scheduler(max_concurrency=1)
+    order = []
+
+    async def request(name, tenant, priority=0):
+        async with scheduler.slot(priority=priority, tenant=tenant):
+            order.append(name)
+            await anyio.sleep(0.01)
+
+    await scheduler.acquire()
+    async with anyio.create_task_group() as tg:
+        for name, tenant in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]:
+            tg.start_soon(request, name, tenant)
+        tg.start_soon(request, "urgent", "c", 5)
+        await anyio.sleep(0.05)
+        assert scheduler.queue_depth == 5  # noqa: PLR2004
+        scheduler.release()
+
+    assert order == ["urgent", "a1", "b1", "a2", "a3"]
+    assert scheduler.stats.max_queue_depth == 5  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_leaves_the_queue(anyio_backend):
+    scheduler = Scheduler(max_concurrency=1)
+    await scheduler.acquire()
+    admitted = []
+
+    async def request(name):
+        async with scheduler.slot():
+            admitted.append(name)
+
+    cancelled = anyio.CancelScope()
+
+    async def cancelled_request():
+        with cancelled:
+            await request("first")
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(cancelled_request)
+        tg.start_soon(request, "second")
+        await anyio.sleep(0.01)
+        cancelled.cancel()
+        await anyio.sleep(0.01)
+        assert scheduler.queue_depth == 1
+        scheduler.release()
+
+    assert admitted == ["second"]
+    assert scheduler.active == scheduler.queue_depth == 0
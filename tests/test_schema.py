@@ -0,0 +1,93 @@
+import timeit
+
+from tooluser.catalog import ToolCatalog
+from tooluser.schema import compile_schema
+
+WEATHER = {
+    "type": "object",
+    "properties": {
+        "location": {"type": "string", "minLength": 1},
+        "unit": {"type": "string", "enum": ["celsius", "fahrenheit"]},
+        "days": {"type": "integer", "minimum": 1, "maximum": 14},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["location"],
+    "additionalProperties": False,
+}
+TOOLS = [
+    {"type": "function", "function": {"name": "get_weather", "parameters": WEATHER}},
+    {"type": "function", "function": {"name": "get_time"}},
+]
+
+
+def test_valid_arguments():
+    validate = compile_schema(WEATHER)
+    assert validate({"location": "Paris"}) == []
+    assert validate({"location": "Paris", "unit": "celsius", "days": 3}) == []
+    assert validate({"location": "Paris", "days": 3.0, "tags": ["a"]}) == []
+
+
+def test_invalid_arguments():
+    validate = compile_schema(WEATHER)
+    assert validate({"unit": "kelvin", "days": True, "extra": 1, "tags": [1]}) == [
+        "$.unit: must be one of ['celsius', 'fahrenheit']",
+        "$.days: expected integer",
+        "$: unexpected property 'extra'",
+        "$.tags[0]: expected string",
+        "$: missing required property 'location'",
+    ]
+    assert validate({"location": "", "days": 20}) == [
+        "$.location: shorter than 1",
+        "$.days: greater than 14",
+    ]
+    assert validate([]) == ["$: expected object"]
+
+
+def test_combinators_and_unknown_keywords():
+    validate = compile_schema(
+        {
+            "anyOf": [{"type": "string"}, {"type": "null"}],
+            "format": "date",
+            "$ref": "#/definitions/ignored",
+        }
+    )
+    assert validate("2024-01-01") == []
+    assert validate(None) == []
+    assert validate(1) == ["$: does not match anyOf"]
+    assert compile_schema({})(object()) == []
+
+
+def test_catalog_is_cached_and_compiles_once():
+    catalog = ToolCatalog.of(TOOLS)
+    assert ToolCatalog.of([dict(tool) for tool in TOOLS]) is catalog
+    assert catalog.names == {"get_weather", "get_time"}
+    assert catalog.validator("get_weather") is catalog.validator("get_weather")
+    assert catalog.validator("unknown") is None
+
+
+def test_catalog_validate():
+    catalog = ToolCatalog.of(TOOLS)
+    assert catalog.validate("1", "get_weather", '{"location": "Paris"}') is None
+    assert catalog.validate("2", "get_time", "{}") is None
+
+    invalid = catalog.validate("3", "get_weather", '{"unit": "kelvin"}')
+    assert invalid is not None
+    assert invalid.id == "3"
+    assert invalid.name == "get_weather"
+    assert len(invalid.errors) == 2  # noqa: PLR2004
+
+    unknown = catalog.validate("4", "get_stock", "{}")
+    assert unknown is not None and unknown.errors == ["unknown tool 'get_stock'"]
+    broken = catalog.validate("5", "get_time", "{")
+    assert broken is not None and broken.errors == ["$: not valid JSON"]
+
+
+def test_validation_takes_microseconds():
+    catalog = ToolCatalog.of(TOOLS)
+    arguments = '{"location": "Paris", "unit": "celsius", "days": 3, "tags": ["a"]}'
+    number = 10000
+    seconds = timeit.timeit(
+        lambda: catalog.validate("1", "get_weather", arguments), number=number
+    )
+    # Generous bound so slow CI machines pass; typically a few microseconds
+    assert seconds / number < 100e-6  # noqa: PLR2004
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import signal
+import socket
+import subprocess
+import sys
+
+import pytest
+from openai import AsyncOpenAI
+
+from tooluser.server import ToolUserServer, _bind
+from tooluser.testing import FakeUpstream
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    # The fake upstream and the server are asyncio servers
+    return "asyncio"
+
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_time",
+            "description": "Get the time in a given location",
+            "parameters": {
+                "type": "object",
+                "properties": {"location": {"type": "string"}},
+            },
+        },
+    }
+]
+TOOL_CALL_REPLY = 'Let me check.\n<tool_call>\n{"name": "get_time", "arguments": {"location": "Shanghai"}}\n</tool_call>'
+
+
+async def _start(upstream: FakeUpstream) -> ToolUserServer:
+    await upstream.start()
+    server = ToolUserServer(upstream=upstream.base_url, api_key="test")
+    await server.start()
+    return server
+
+
+async def test_server_transforms_json_response():
+    upstream = FakeUpstream(TOOL_CALL_REPLY)
+    server = await _start(upstream)
+    try:
+        client = AsyncOpenAI(
+            base_url=f"http://127.0.0.1:{server.port}/v1", api_key="caller-key"
+        )
+        res = await client.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "What's the time in Shanghai?"}],
+            tools=TOOLS,  # type: ignore
+        )
+        message = res.choices[0].message
+        assert message.content == "Let me check.\n"
+        assert message.tool_calls is not None
+        assert message.tool_calls[0].function.name == "get_time"  # type: ignore
+        assert message.tool_calls[0].function.arguments == '{"location": "Shanghai"}'  # type: ignore
+
+        # The upstream receives the transformed request
+        sent = upstream.requests[-1]
+        assert "tools" not in sent
+        assert sent["messages"][0]["role"] == "system"
+        assert "<tool_instruction>" in sent["messages"][0]["content"]
+        await client.close()
+    finally:
+        await server.close()
+        await upstream.close()
+
+
+async def test_server_transforms_sse_response():
+    upstream = FakeUpstream(TOOL_CALL_REPLY, chunk_size=5)
+    server = await _start(upstream)
+    try:
+        client = AsyncOpenAI(
+            base_url=f"http://127.0.0.1:{server.port}/v1", api_key="caller-key"
+        )
+        stream = await client.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "What's the time in Shanghai?"}],
+            tools=TOOLS,  # type: ignore
+            stream=True,
+        )
+        content = ""
+        tool_calls = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta
+            content += delta.content or ""
+            tool_calls.extend(delta.tool_calls or [])
+        assert content == "Let me check.\n"
+        assert [t.function.name for t in tool_calls] == ["get_time"]  # type: ignore
+        await client.close()
+    finally:
+        await server.close()
+        await upstream.close()
+
+
+async def _get(port: int, path: str) -> tuple[int, dict]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode()
+    )
+    raw = await reader.read()
+    writer.close()
+    head, _, body = raw.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+async def test_server_forwards_unknown_fields_and_routes():
+    upstream = FakeUpstream("plain answer")
+    server = await _start(upstream)
+    try:
+        client = AsyncOpenAI(
+            base_url=f"http://127.0.0.1:{server.port}/v1", api_key="caller-key"
+        )
+        res = await client.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "hi"}],
+            extra_body={"provider": {"order": ["a"]}},
+        )
+        assert res.choices[0].message.content == "plain answer"
+        assert upstream.requests[-1]["provider"] == {"order": ["a"]}
+        await client.close()
+
+        assert await _get(server.port, "/health") == (200, {"status": "ok"})
+        status, _ = await _get(server.port, "/nope")
+        assert status == 404  # noqa: PLR2004
+    finally:
+        await server.close()
+        await upstream.close()
+
+
+async def _post(port: int, head: str, body: bytes = b"") -> tuple[int, dict]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        "POST /v1/chat/completions HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+        f"{head}\r\n".encode()
+        + body
+    )
+    raw = await reader.read()
+    writer.close()
+    head_bytes, _, response = raw.partition(b"\r\n\r\n")
+    return int(head_bytes.split()[1]), json.loads(response)
+
+
+async def test_server_rejects_malformed_requests():
+    upstream = FakeUpstream("plain answer")
+    await upstream.start()
+    server = ToolUserServer(upstream=upstream.base_url, max_body_size=1024)
+    await server.start()
+    try:
+        status, _ = await _post(server.port, "Content-Length: ten\r\n")
+        assert status == 400  # noqa: PLR2004
+        status, _ = await _post(
+            server.port, "Transfer-Encoding: chunked\r\n", b"zz\r\n{}\r\n0\r\n\r\n"
+        )
+        assert status == 400  # noqa: PLR2004
+        status, error = await _post(server.port, "Content-Length: 2048\r\n")
+        assert status == 413  # noqa: PLR2004
+        assert "1024 bytes" in error["error"]["message"]
+
+        body = json.dumps(
+            {"model": "fake", "messages": [{"content": "hi"}], "tools": TOOLS}
+        ).encode()
+        status, error = await _post(
+            server.port, f"Content-Length: {len(body)}\r\n", body
+        )
+        assert status == 400  # noqa: PLR2004
+        assert "role" in error["error"]["message"]
+
+        # Valid JSON of the wrong shape
+        for fields, name in [
+            (
+                {"messages": [{"role": "user", "content": "hi"}], "tools": "abc"},
+                "tools",
+            ),
+            ({"messages": [1], "tools": TOOLS}, "messages"),
+        ]:
+            body = json.dumps({"model": "fake", **fields}).encode()
+            status, error = await _post(
+                server.port, f"Content-Length: {len(body)}\r\n", body
+            )
+            assert status == 400  # noqa: PLR2004
+            assert f"'{name}' must be a list" in error["error"]["message"]
+
+        async def fail(request, writer):
+            raise RuntimeError("boom")
+
+        server._chat_completions = fail  # type: ignore[method-assign]
+        status, error = await _post(server.port, "Content-Length: 2\r\n", b"{}")
+        assert status == 500  # noqa: PLR2004
+        assert error["error"]["message"] == "RuntimeError: boom"
+    finally:
+        await server.close()
+        await upstream.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.skipif(
+    not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT is not supported"
+)
+async def test_server_workers_share_the_port():
+    """Test that `serve --workers 2` answers on one port, and stops with SIGTERM"""
+    port = _free_port()
+    first, second = _bind("127.0.0.1", port, True), _bind("127.0.0.1", port, True)
+    first.close()
+    second.close()
+
+    upstream = FakeUpstream(TOOL_CALL_REPLY)
+    await upstream.start()
+    process = subprocess.Popen(
+        [
+            *(sys.executable, "-m", "tooluser", "serve"),
+            *("--upstream", upstream.base_url, "--port", str(port)),
+            *("--workers", "2", "--api-key", "test"),
+        ]
+    )
+    try:
+        for _ in range(100):
+            try:
+                await _get(port, "/health")
+                break
+            except ConnectionError:
+                await asyncio.sleep(0.1)
+        client = AsyncOpenAI(base_url=f"http://127.0.0.1:{port}/v1", api_key="test")
+        for _ in range(4):
+            # A new connection each time, balanced across the workers by the kernel
+            res = await client.with_options(
+                default_headers={"Connection": "close"}
+            ).chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "What's the time?"}],
+                tools=TOOLS,  # type: ignore
+            )
+            assert res.choices[0].message.tool_calls[0].function.name == "get_time"  # type: ignore
+        await client.close()
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
+        await upstream.close()
+    assert len(upstream.requests) == 4  # noqa: PLR2004
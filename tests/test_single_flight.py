@@ -0,0 +1,140 @@
+from functools import partial
+
+import anyio
+import pytest
+from openai import AsyncOpenAI
+
+from tooluser import SingleFlight, ToolUser
+from tooluser.testing import FakeUpstream
+
+TOOLS = [{"type": "function", "function": {"name": "get_time"}}]
+MESSAGES = [{"role": "user", "content": "What's the time in Paris?"}]
+REPLY = (
+    "Let me check.\n"
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>'
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def _create(tool_user: ToolUser, **kwargs):
+    return await tool_user.chat.completions.create(
+        model="fake",
+        messages=MESSAGES,  # type: ignore
+        tools=TOOLS,  # type: ignore
+        **kwargs,
+    )
+
+
+@pytest.mark.anyio
+async def test_identical_requests_share_one_call(anyio_backend):
+    """Test that concurrent identical requests get copies of one parsed response"""
+    single_flight = SingleFlight()
+    responses = []
+    async with FakeUpstream(REPLY, latency=0.2) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, single_flight=single_flight)
+
+        async def request():
+            responses.append(await _create(tool_user))
+
+        async with anyio.create_task_group() as tg:
+            for _ in range(5):
+                tg.start_soon(request)
+            tg.start_soon(partial(_create, tool_user, temperature=1))
+        await client.close()
+
+    # The request with another temperature is not shared
+    assert len(upstream.requests) == 2  # noqa: PLR2004
+    assert (single_flight.calls, single_flight.joined) == (2, 4)
+    messages = [response.choices[0].message for response in responses]
+    assert len({id(message) for message in messages}) == 5  # noqa: PLR2004
+    assert all(message == messages[0] for message in messages)
+    assert messages[0].tool_calls[0].function.name == "get_time"  # type: ignore
+
+
+@pytest.mark.anyio
+async def test_cancelling_one_waiter_keeps_the_others(anyio_backend):
+    single_flight = SingleFlight()
+    async with FakeUpstream(REPLY, latency=0.2) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, single_flight=single_flight)
+        responses = []
+
+        async def request():
+            responses.append(await _create(tool_user))
+
+        cancelled = anyio.CancelScope()
+
+        async def cancelled_request():
+            with cancelled:
+                await _create(tool_user)
+
+        async with anyio.create_task_group() as tg:
+            # The first request starts the shared call
+            tg.start_soon(cancelled_request)
+            tg.start_soon(request)
+            await anyio.sleep(0.05)
+            cancelled.cancel()
+        await client.close()
+
+    assert len(upstream.requests) == 1
+    assert responses[0].choices[0].message.tool_calls
+
+
+@pytest.mark.anyio
+async def test_stream_readers_replay_one_stream(anyio_backend):
+    """Test that each stream reader gets every chunk, with tool calls parsed once"""
+    single_flight = SingleFlight()
+    async with FakeUpstream(REPLY, chunk_size=5, chunk_delay=0.005) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, single_flight=single_flight)
+        results = []
+
+        async def read(stop_early: bool):
+            stream = await _create(tool_user, stream=True)
+            text, tool_calls = "", []
+            async with stream:  # type: ignore
+                async for chunk in stream:  # type: ignore
+                    if stop_early:
+                        return
+                    delta = chunk.choices[0].delta
+                    text += delta.content or ""
+                    tool_calls.extend(delta.tool_calls or [])
+            results.append((text, tool_calls))
+
+        async with anyio.create_task_group() as tg:
+            for stop_early in (False, True, False):
+                tg.start_soon(read, stop_early)
+        await client.close()
+
+    assert len(upstream.requests) == 1
+    assert single_flight.joined == 2  # noqa: PLR2004
+    assert len(results) == 2  # noqa: PLR2004
+    assert results[0] == results[1]
+    text, tool_calls = results[0]
+    assert text.strip() == "Let me check."
+    assert [call.function.name for call in tool_calls] == ["get_time"]
+
+
+@pytest.mark.anyio
+async def test_abandoned_stream_closes_upstream(anyio_backend):
+    """Test that the shared stream is closed once every reader has left"""
+    async with FakeUpstream("tick " * 200, chunk_size=5, chunk_delay=0.01) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, single_flight=SingleFlight())
+        streams = [await _create(tool_user, stream=True) for _ in range(2)]
+        for stream in streams:
+            async with stream:  # type: ignore
+                async for _ in stream:  # type: ignore
+                    break
+
+        with anyio.fail_after(5):
+            while upstream.open_connections:
+                await anyio.sleep(0.01)
+        await client.close()
+
+    assert len(upstream.requests) == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from tooluser.stress import ReplyMix, format_results, stress
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_reply_mix_spreads_tool_calls_evenly():
+    mix = ReplyMix(reply_tokens=5, tool_call_ratio=0.25, tool_calls=2)
+    replies = [mix({}) for _ in range(8)]
+
+    assert [reply.count("<tool_call>") for reply in replies] == [0, 0, 0, 2] * 2
+    assert all(reply.startswith("the model reads each file") for reply in replies)
+
+
+@pytest.mark.anyio
+async def test_stress_reports_each_level(anyio_backend):
+    results = await stress(
+        [1, 3],
+        4,
+        token_rate=0,
+        reply_tokens=10,
+        tool_call_ratio=0.5,
+        upstream_process=False,
+    )
+
+    assert [result.concurrency for result in results] == [1, 3]
+    for result in results:
+        assert result.streams == 4  # noqa: PLR2004
+        assert result.streams_per_s > 0
+        assert result.chunks_per_s > 0
+        assert result.cpu_ms_per_stream > 0
+        assert result.rss_mb > 0
+    table = format_results(results).splitlines()
+    assert len(table) == 4  # noqa: PLR2004
+    assert table[0].startswith("| concurrency | streams |")
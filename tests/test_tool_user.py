@@ -1,7 +1,25 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import anyio
+import pytest
 from openai import AsyncOpenAI
+from openai._streaming import AsyncStream
+from openai.resources.chat.completions import AsyncCompletions
 
-from tooluser import make_tool_user
+from tooluser import ResponseCache, StreamTimeoutError, ToolUser, make_tool_user
+from tooluser.events import (
+    Finish,
+    ReasoningDelta,
+    TextDelta,
+    ToolCallArgsDelta,
+    ToolCallEnd,
+    ToolCallStart,
+)
 from tooluser.hermes_transform import HermesTransformation
+from tooluser.testing import FakeUpstream
+from tooluser.tool_user import DISCONNECT_ERRORS, _native_call_events
+from tooluser.transform import RepairOffload
 
 
 def test_make_tool_user_default_settings():
@@ -31,3 +49,787 @@ def test_make_tool_user_with_custom_transformation():
 
     # The client should be enhanced
     assert enhanced_client is not None
+
+
+def test_tool_user_leaves_client_untouched():
+    """Test that ToolUser does not replace the client's chat.completions"""
+    client = AsyncOpenAI(api_key="test")
+    native = client.chat.completions
+    tool_user = ToolUser(client)
+
+    assert client.chat.completions is native
+    assert type(client.chat.completions) is AsyncCompletions
+    assert tool_user.chat.completions is not native
+
+
+def test_tool_user_per_tenant_transformations_share_one_pool():
+    """Test that several ToolUser views reuse the client's single HTTP pool"""
+    client = AsyncOpenAI(api_key="test")
+    tenant_a = ToolUser(client)
+    tenant_b = ToolUser(
+        client, transformation=HermesTransformation(enable_raw_json_detection=False)
+    )
+
+    assert tenant_a.transformation is not tenant_b.transformation
+    assert tenant_a.chat.completions._client is client
+    assert tenant_b.chat.completions._client is client
+    assert tenant_a.chat.completions._client._client is client._client
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_native_and_tool_user_paths_use_one_connection(anyio_backend):
+    """Test that native and tool-use calls reuse the same keep-alive connection"""
+    async with FakeUpstream(
+        '<tool_call>\n{"name": "get_time", "arguments": {}}\n</tool_call>'
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client)
+        tools = [{"type": "function", "function": {"name": "get_time"}}]
+        messages = [{"role": "user", "content": "What's the time?"}]
+
+        native = await client.chat.completions.create(
+            model="fake",
+            messages=messages,  # type: ignore
+        )
+        assert native.choices[0].message.tool_calls is None
+        for _ in range(3):
+            res = await tool_user.chat.completions.create(
+                model="fake",
+                messages=messages,  # type: ignore
+                tools=tools,  # type: ignore
+            )
+            assert res.choices[0].message.tool_calls is not None
+
+        assert upstream.total_connections == 1
+        await client.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_overhead_hook(anyio_backend):
+    """Test that on_overhead receives a report for requests with tools"""
+    reports = []
+    async with FakeUpstream("It is noon.") as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, on_overhead=reports.append, tokenizer=len)
+        await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "What's the time?"}],
+            tools=[{"type": "function", "function": {"name": "get_time"}}],
+        )
+        await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "No tools here"}],
+        )
+        await client.close()
+
+    assert len(reports) == 1
+    assert reports[0].model == "fake"
+    assert reports[0].original_chars == len("What's the time?")
+    assert reports[0].catalog_tokens == reports[0].catalog_chars > 0
+
+
+class _BaselineTransformation:
+    """A custom transformation written against the Transformation protocol, which does
+    not take `overhead`."""
+
+    def __init__(self):
+        self.hermes = HermesTransformation()
+
+    def create_stream_processor(self):
+        return self.hermes.create_stream_processor()
+
+    def trans_param_messages(self, messages, tools):
+        return self.hermes.trans_param_messages(messages, tools)
+
+    def trans_completion_message(self, message):
+        return self.hermes.trans_completion_message(message)
+
+    def trans_completion_message_stream(self, processor, delta, finalize=False):
+        return self.hermes.trans_completion_message_stream(processor, delta, finalize)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_custom_transformation_without_overhead(anyio_backend):
+    """Test that a transformation without the overhead parameter works with on_overhead"""
+    reports = []
+    async with FakeUpstream(WEATHER_CALL) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        for on_overhead in (None, reports.append):
+            tool_user = ToolUser(
+                client,
+                _BaselineTransformation(),  # type: ignore[arg-type]
+                on_overhead=on_overhead,
+            )
+            res = await tool_user.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "Weather in Paris?"}],
+                tools=TOOLS,  # type: ignore
+            )
+            assert res.choices[0].message.tool_calls[0].function.name == "get_weather"  # type: ignore
+        await client.close()
+
+    # Nothing to report from a transformation that does not account for its prompt
+    assert reports == []
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.parametrize("stream", [False, True])
+async def test_dedup_savings_in_usage(anyio_backend, stream):
+    """Test that the bytes saved by deduplication are reported in the usage"""
+    result = "é" * 100
+    messages = [{"role": "user", "content": "Read a.txt twice"}]
+    for call_id in ("call_1", "call_2"):
+        messages.append(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "type": "function",
+                        "function": {"name": "read_file", "arguments": "{}"},
+                    }
+                ],
+            }
+        )
+        messages.append({"role": "tool", "tool_call_id": call_id, "content": result})
+    async with FakeUpstream("Same file.") as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, HermesTransformation(dedup_tool_results=64))
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=messages,  # type: ignore
+            tools=[{"type": "function", "function": {"name": "read_file"}}],
+            stream=stream,
+            **({"stream_options": {"include_usage": True}} if stream else {}),
+        )
+        if stream:
+            usage = [chunk.usage async for chunk in res if chunk.usage]  # type: ignore
+            assert len(usage) == 1
+            usage = usage[0]
+        else:
+            usage = res.usage  # type: ignore
+        await client.close()
+
+    reference = "[Identical to the <tool_result> of call_1 above]"
+    assert usage.dedup_saved_bytes == 200 - len(reference)  # type: ignore
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.parametrize("stream", [False, True])
+async def test_invalid_arguments_hook(anyio_backend, stream):
+    """Test that tool calls not matching the parameters schema are reported"""
+    invalid = []
+    reply = (
+        '<tool_call>\n{"name": "get_time", "arguments": {"location": 1}}\n</tool_call>'
+        '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>'
+    )
+    tools = [
+        {
+            "type": "function",
+            "function": {
+                "name": "get_time",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"location": {"type": "string"}},
+                    "required": ["location"],
+                },
+            },
+        }
+    ]
+    async with FakeUpstream(reply) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, on_invalid_arguments=invalid.append)
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "What's the time?"}],
+            tools=tools,  # type: ignore
+            stream=stream,
+        )
+        if stream:
+            tool_calls = [
+                tool_call
+                async for chunk in res  # type: ignore
+                for tool_call in chunk.choices[0].delta.tool_calls or []
+            ]
+        else:
+            tool_calls = res.choices[0].message.tool_calls  # type: ignore
+        await client.close()
+
+    # Invalid calls are still returned, and reported through the hook
+    assert len(tool_calls) == 2  # noqa: PLR2004
+    assert len(invalid) == 1
+    assert invalid[0].id == tool_calls[0].id
+    assert invalid[0].errors == ["$.location: expected string"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_raw_json_calls_of_unknown_tools_stay_text(anyio_backend):
+    reply = 'Set it like this: {"name": "config", "arguments": {"port": 8080}}'
+    async with FakeUpstream(reply) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        res = await ToolUser(client).chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "How do I set the port?"}],
+            tools=[{"type": "function", "function": {"name": "get_time"}}],
+        )
+        await client.close()
+
+    assert res.choices[0].message.tool_calls is None
+    assert res.choices[0].message.content == reply
+
+
+TOOLS = [
+    {"type": "function", "function": {"name": "get_time"}},
+    {"type": "function", "function": {"name": "get_weather"}},
+]
+WEATHER_CALL = '<tool_call>\n{"name": "get_weather", "arguments": {"location": "Paris"}}\n</tool_call>'
+
+
+def _continuation(body: dict) -> str:
+    """The reply, without the prefill of the assistant turn if there is one."""
+    last = body["messages"][-1]
+    if last["role"] == "assistant" and last.get("prefix"):
+        return WEATHER_CALL.removeprefix(last["content"])
+    return "Let me check the weather first.\n" + WEATHER_CALL
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.parametrize("stream", [False, True])
+async def test_tool_choice_prefill(anyio_backend, stream):
+    """Test that a named tool_choice sends one tool and prefills the call"""
+    async with FakeUpstream(_continuation, chunk_size=4) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, HermesTransformation(prefill="prefix"))
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "Weather in Paris?"}],
+            tools=TOOLS,  # type: ignore
+            tool_choice={"type": "function", "function": {"name": "get_weather"}},
+            parallel_tool_calls=False,
+            stream=stream,
+        )
+        if stream:
+            content = ""
+            tool_calls = []
+            async for chunk in res:  # type: ignore
+                content += chunk.choices[0].delta.content or ""
+                tool_calls.extend(chunk.choices[0].delta.tool_calls or [])
+        else:
+            content = res.choices[0].message.content  # type: ignore
+            tool_calls = res.choices[0].message.tool_calls  # type: ignore
+        await client.close()
+
+    request = upstream.requests[0]
+    assert "tool_choice" not in request
+    assert "parallel_tool_calls" not in request
+    catalog = request["messages"][0]["content"]
+    assert "get_weather" in catalog
+    assert "get_time" not in catalog
+    assert request["messages"][-1] == {
+        "role": "assistant",
+        "content": '<tool_call>\n{"name": "get_weather", "arguments": ',
+        "prefix": True,
+    }
+    assert not content
+    assert [(c.function.name, c.function.arguments) for c in tool_calls] == [
+        ("get_weather", '{"location": "Paris"}')
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_tool_choice_none_and_required(anyio_backend):
+    async with FakeUpstream(_continuation) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client)
+        for tool_choice in ("none", "required"):
+            await tool_user.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "Weather in Paris?"}],
+                tools=TOOLS,  # type: ignore
+                tool_choice=tool_choice,  # type: ignore
+            )
+        with pytest.raises(ValueError, match="not in tools"):
+            await tool_user.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "Weather in Paris?"}],
+                tools=TOOLS,  # type: ignore
+                tool_choice={"type": "function", "function": {"name": "search"}},
+            )
+        await client.close()
+
+    none, required = upstream.requests
+    # Without prefill, "required" is asked for in the tool prompt
+    assert none["messages"] == [{"role": "user", "content": "Weather in Paris?"}]
+    assert required["messages"][0]["content"].endswith(
+        "You must call at least one function in this reply."
+    )
+    assert len(upstream.requests) == 2  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.parametrize("stream_resumes", [0, 1])
+async def test_stream_resumes_after_disconnect(anyio_backend, stream_resumes):
+    """Test that a dropped stream is continued from the text received so far"""
+    reply = "Let me check the weather first.\n" + WEATHER_CALL
+
+    def content(body: dict) -> str:
+        last = body["messages"][-1]
+        return reply.removeprefix(last["content"]) if last.get("prefix") else reply
+
+    def drop_after(body: dict) -> int | None:
+        # The first reply is cut off inside the tool call
+        return None if body["messages"][-1].get("prefix") else 6
+
+    async with FakeUpstream(content, chunk_size=8, drop_after=drop_after) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test", max_retries=0)
+        tool_user = ToolUser(
+            client,
+            HermesTransformation(prefill="prefix"),
+            stream_resumes=stream_resumes,
+        )
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "Weather in Paris?"}],
+            tools=TOOLS,  # type: ignore
+            stream=True,
+        )
+        text = ""
+        tool_calls = []
+        if stream_resumes:
+            async for chunk in res:  # type: ignore
+                text += chunk.choices[0].delta.content or ""
+                tool_calls.extend(chunk.choices[0].delta.tool_calls or [])
+        else:
+            with pytest.raises(DISCONNECT_ERRORS):
+                async for _ in res:  # type: ignore
+                    pass
+        await client.close()
+
+    if stream_resumes:
+        assert len(upstream.requests) == 2  # noqa: PLR2004
+        assert upstream.requests[1]["messages"][-1] == {
+            "role": "assistant",
+            "content": reply[:48],
+            "prefix": True,
+        }
+        assert text == "Let me check the weather first.\n"
+        assert [(c.function.name, c.function.arguments) for c in tool_calls] == [
+            ("get_weather", '{"location": "Paris"}')
+        ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_requests_without_tools_pass_through(anyio_backend):
+    """Test that a request without tools gets the SDK's own objects, untouched"""
+    reply = 'Example: {"name": "get_time", "arguments": {}} or ' + WEATHER_CALL
+    async with FakeUpstream(reply, chunk_size=5) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client)
+        messages = [{"role": "user", "content": "Show an example"}]
+        stream = await tool_user.chat.completions.create(
+            model="fake", messages=messages, tools=[], stream=True
+        )
+        assert type(stream) is AsyncStream
+        async with stream:
+            chunks = [chunk async for chunk in stream]
+        response = await tool_user.chat.completions.create(
+            model="fake", messages=messages
+        )
+
+        # With options that wrap the response, the content is still left as it is
+        cached = ToolUser(client, cache=ResponseCache())
+        for _ in range(2):
+            wrapped = await cached.chat.completions.create(
+                model="fake", messages=messages, stream=True
+            )
+            text = "".join(
+                [chunk.choices[0].delta.content or "" async for chunk in wrapped]
+            )
+            assert text == reply
+        await client.close()
+
+    assert "".join(c.choices[0].delta.content or "" for c in chunks) == reply
+    assert response.choices[0].message.content == reply
+    assert response.choices[0].message.tool_calls is None
+    assert "tools" not in upstream.requests[0]
+    assert len(upstream.requests) == 3  # noqa: PLR2004
+
+
+async def _wait_for_connections(upstream: FakeUpstream, count: int) -> None:
+    with anyio.fail_after(5):
+        while upstream.open_connections != count:
+            await anyio.sleep(0.01)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_closing_stream_releases_upstream_connection(anyio_backend):
+    """Test that leaving a stream early closes the upstream response"""
+    async with FakeUpstream("tick " * 200, chunk_size=5, chunk_delay=0.01) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client)
+        tools = [{"type": "function", "function": {"name": "get_time"}}]
+
+        async def open_stream():
+            return await tool_user.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "Count"}],
+                tools=tools,  # type: ignore
+                stream=True,
+            )
+
+        async with await open_stream() as stream:
+            async for _ in stream:
+                break
+        stream = await open_stream()
+        await stream.__anext__()
+        await stream.close()
+        await stream.close()
+        stream = await open_stream()
+        await stream.__anext__()
+        await stream.aclose()
+
+        await _wait_for_connections(upstream, 0)
+        await client.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_cancelled_streams_release_upstream_connections(anyio_backend):
+    """Test that cancelling consumers brings the connection count back to baseline"""
+    async with FakeUpstream("tick " * 200, chunk_size=5, chunk_delay=0.01) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client)
+        tools = [{"type": "function", "function": {"name": "get_time"}}]
+        started = 0
+
+        async def consume():
+            nonlocal started
+            stream = await tool_user.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": "Count"}],
+                tools=tools,  # type: ignore
+                stream=True,
+            )
+            async with stream:
+                async for _ in stream:
+                    started += 1
+                    await anyio.sleep_forever()
+
+        async with anyio.create_task_group() as tg:
+            for _ in range(8):
+                tg.start_soon(consume)
+            with anyio.fail_after(5):
+                while started < 8:  # noqa: PLR2004
+                    await anyio.sleep(0.01)
+            assert upstream.open_connections == 8  # noqa: PLR2004
+            tg.cancel_scope.cancel()
+
+        await _wait_for_connections(upstream, 0)
+        await client.close()
+
+
+STALLED_REPLY = (
+    "Let me check.\n"
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>\n'
+    '<tool_call>\n{"name": "get_time", "arguments": {"location": "Tok'
+)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_stream_idle_timeout(anyio_backend):
+    """Test that a stalled stream emits what it received, closes and raises"""
+    # The upstream sends all of STALLED_REPLY, then hangs
+    async with FakeUpstream(
+        STALLED_REPLY + 'yo"}}\n</tool_call>',
+        chunk_size=len(STALLED_REPLY),
+        stall_after=1,
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, stream_idle_timeout=0.2)
+        stream = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "What's the time?"}],
+            tools=[{"type": "function", "function": {"name": "get_time"}}],  # type: ignore
+            stream=True,
+        )
+        content, tool_calls = "", []
+        with pytest.raises(StreamTimeoutError) as exc_info:
+            async for chunk in stream:  # type: ignore
+                content += chunk.choices[0].delta.content or ""
+                tool_calls.extend(chunk.choices[0].delta.tool_calls or [])
+
+        assert exc_info.value.kind == "idle"
+        assert exc_info.value.timeout == 0.2  # noqa: PLR2004
+        # The complete call is kept, the unfinished one is returned as text
+        assert [json.loads(t.function.arguments) for t in tool_calls] == [
+            {"location": "Paris"}
+        ]
+        assert content.startswith("Let me check.")
+        assert content.endswith(
+            '<tool_call>\n{"name": "get_time", "arguments": {"location": "Tok'
+        )
+        await _wait_for_connections(upstream, 0)
+        await client.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_stream_deadline(anyio_backend):
+    """Test that a slow but steady stream is cut at its deadline"""
+    async with FakeUpstream("tick " * 200, chunk_size=5, chunk_delay=0.02) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, stream_idle_timeout=1.0, stream_deadline=0.3)
+        start = anyio.current_time()
+        stream = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "Count"}],
+            tools=[{"type": "function", "function": {"name": "get_time"}}],  # type: ignore
+            stream=True,
+        )
+        content = ""
+        with pytest.raises(StreamTimeoutError) as exc_info:
+            async for chunk in stream:  # type: ignore
+                content += chunk.choices[0].delta.content or ""
+
+        assert exc_info.value.kind == "deadline"
+        assert anyio.current_time() - start < 1.0
+        # Nothing is lost: the held-back tail is flushed before the error
+        assert content and "tick " * (len(content) // 5) == content
+        await _wait_for_connections(upstream, 0)
+        await client.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_stream_events(anyio_backend):
+    """Test that stream_events yields text, tool call and finish events"""
+    reply = (
+        "Let me check.\n"
+        '<tool_call>\n{"name": "get_time", "arguments": {"location": "Paris"}}\n</tool_call>'
+    )
+    async with FakeUpstream(reply, chunk_size=5) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client)
+        events = [
+            event
+            async for event in tool_user.chat.completions.stream_events(
+                model="fake",
+                messages=[{"role": "user", "content": "What's the time?"}],
+                tools=[{"type": "function", "function": {"name": "get_time"}}],
+            )
+        ]
+        await client.close()
+
+    assert upstream.requests[0]["stream"] is True
+    assert "tools" not in upstream.requests[0]
+    text = "".join(event.text for event in events if isinstance(event, TextDelta))
+    assert text == "Let me check.\n"
+    start, args, end, finish = events[-4:]
+    assert isinstance(start, ToolCallStart)
+    assert start.name == "get_time"
+    assert args == ToolCallArgsDelta(0, start.id, '{"location": "Paris"}')
+    assert end == ToolCallEnd(0, start.id)
+    assert finish == Finish(0, "stop")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_stream_events_reasoning(anyio_backend):
+    """Test that split <think> blocks are yielded as reasoning events"""
+    reply = "<think>Plain answer.</think>Hello!"
+    async with FakeUpstream(reply, chunk_size=3) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, HermesTransformation(reasoning="split"))
+        events = [
+            event
+            async for event in tool_user.chat.completions.stream_events(
+                model="fake",
+                messages=[{"role": "user", "content": "Hi"}],
+                tools=[{"type": "function", "function": {"name": "get_time"}}],
+            )
+        ]
+        await client.close()
+
+    assert "".join(e.text for e in events if isinstance(e, ReasoningDelta)) == (
+        "Plain answer."
+    )
+    assert "".join(e.text for e in events if isinstance(e, TextDelta)) == "Hello!"
+    assert events[-1] == Finish(0, "stop")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_stream_reasoning_split(anyio_backend):
+    """Test that split <think> blocks are streamed as reasoning_content chunks"""
+    reply = "<think>Plain answer here.</think>Hello!"
+    async with FakeUpstream(reply, chunk_size=3) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, HermesTransformation(reasoning="split"))
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "Hi"}],
+            tools=[{"type": "function", "function": {"name": "get_time"}}],
+            stream=True,
+        )
+        reasoning = ""
+        content = ""
+        async for chunk in res:  # type: ignore
+            delta = chunk.choices[0].delta
+            reasoning += getattr(delta, "reasoning_content", None) or ""
+            content += delta.content or ""
+        await client.close()
+
+    assert reasoning == "Plain answer here."
+    assert content == "Hello!"
+
+
+def test_native_tool_call_events():
+    """Test that native tool call deltas of the upstream are mapped to events"""
+    calls: dict[int, str] = {}
+    first = list(
+        _native_call_events(
+            0,
+            [
+                {
+                    "index": 0,
+                    "id": "call_1",
+                    "function": {"name": "get_time", "arguments": '{"loc'},
+                }
+            ],
+            calls,
+        )
+    )
+    second = list(
+        _native_call_events(
+            0, [{"index": 0, "function": {"arguments": 'ation": "Paris"}'}}], calls
+        )
+    )
+    assert first == [
+        ToolCallStart(0, "call_1", "get_time"),
+        ToolCallArgsDelta(0, "call_1", '{"loc'),
+    ]
+    assert second == [ToolCallArgsDelta(0, "call_1", 'ation": "Paris"}')]
+    assert calls == {0: "call_1"}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_stream_events_idle_timeout(anyio_backend):
+    """Test that stream_events flushes and raises when the upstream stalls"""
+    async with FakeUpstream(
+        STALLED_REPLY, chunk_size=len(STALLED_REPLY) - 10, stall_after=1
+    ) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        tool_user = ToolUser(client, stream_idle_timeout=0.2)
+        events = []
+        with pytest.raises(StreamTimeoutError):
+            async for event in tool_user.chat.completions.stream_events(
+                model="fake",
+                messages=[{"role": "user", "content": "What's the time?"}],
+                tools=[{"type": "function", "function": {"name": "get_time"}}],
+            ):
+                events.append(event)
+
+        assert sum(isinstance(event, ToolCallEnd) for event in events) == 1
+        text = "".join(event.text for event in events if isinstance(event, TextDelta))
+        assert text.endswith(STALLED_REPLY[: len(STALLED_REPLY) - 10][-20:])
+        await _wait_for_connections(upstream, 0)
+        await client.close()
+
+
+async def _max_loop_lag(work) -> tuple[float, object]:
+    """Run `work()` while measuring the longest gap between event loop ticks."""
+    lag = 0.0
+    result = None
+
+    async def measure():
+        nonlocal lag
+        while True:
+            start = anyio.current_time()
+            await anyio.sleep(0.005)
+            lag = max(lag, anyio.current_time() - start - 0.005)
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(measure)
+        await anyio.sleep(0.02)
+        result = await work()
+        # Let the measuring task see the last gap
+        await anyio.sleep(0.02)
+        tg.cancel_scope.cancel()
+    return lag, result
+
+
+class _CountingExecutor(ThreadPoolExecutor):
+    """A one-thread executor that counts the work submitted to it."""
+
+    def __init__(self):
+        super().__init__(1)
+        self.submitted = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(fn, *args, **kwargs)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+@pytest.mark.parametrize("stream", [False, True])
+async def test_large_repair_is_offloaded(anyio_backend, stream):
+    """Test that repairing a large malformed tool call runs in the offload executor
+    without stalling the event loop"""
+    call = json.dumps({"name": "write_file", "arguments": {"content": "x" * 100_000}})
+    # A broken ending makes json_repair take a few hundred milliseconds
+    reply = "Writing it.\n<tool_call>\n" + call[:-2] + "'\n</tool_call>"
+
+    async def complete(tool_user: ToolUser):
+        res = await tool_user.chat.completions.create(
+            model="fake",
+            messages=[{"role": "user", "content": "Write the file"}],
+            tools=[{"type": "function", "function": {"name": "write_file"}}],  # type: ignore
+            stream=stream,
+        )
+        if not stream:
+            return res.choices[0].message.content, [  # type: ignore
+                (t.function.name, t.function.arguments)
+                for t in res.choices[0].message.tool_calls or []  # type: ignore
+            ]
+        content, tool_calls = "", []
+        async for chunk in res:  # type: ignore
+            content += chunk.choices[0].delta.content or ""
+            tool_calls.extend(
+                (t.function.name, t.function.arguments)
+                for t in chunk.choices[0].delta.tool_calls or []
+            )
+        return content or None, tool_calls
+
+    async with FakeUpstream(reply, chunk_size=len(reply) // 4) as upstream:
+        client = AsyncOpenAI(base_url=upstream.base_url, api_key="test")
+        inline_lag, inline = await _max_loop_lag(
+            lambda: complete(ToolUser(client, repair_offload=None))
+        )
+        with _CountingExecutor() as executor:
+            offloaded_lag, offloaded = await _max_loop_lag(
+                lambda: complete(
+                    ToolUser(client, repair_offload=RepairOffload(1024, executor))
+                )
+            )
+        await client.close()
+
+    assert offloaded == inline
+    assert inline[1] and inline[1][0][0] == "write_file"
+    assert executor.submitted == 1
+    # Relative to the same repair inline, so slower machines scale both sides
+    assert offloaded_lag < inline_lag / 3